@@ -4,37 +4,59 @@ Do not remove this copyright. No derivative code allowed.
 """
 import sys
 import os
+import time
+import importlib
+startup_time = time.time()
 import gradio as gr
 import torch
 from pathlib import Path
 import json
 
-# Text 2 Image
-from modules.text2image.tab_lumina2 import create_lumina2_tab
-from modules.text2image.tab_sana import create_sana_tab
-from modules.text2image.tab_lumina import create_lumina_tab
-from modules.text2image.tab_hunyuandit import create_hunyuandit_tab
-from modules.text2image.tab_kandinsky3 import create_kandinsky3_tab
-from modules.text2image.tab_cogview3plus import create_cogView3Plus_tab
-from modules.text2image.tab_auraflow import create_auraflow_tab
-from modules.text2image.tab_auraflow_gguf import create_auraflow_gguf_tab
-
-# Text 2 Video
-from modules.text2video.tab_skyreels_t2v import create_skyreels_t2v_tab
-from modules.text2video.tab_wan21_t2v import create_wan21_t2v_tab
-
-# Image 2 Video
-from modules.image2video.tab_ltximage2video091 import create_ltximage2video091_tab
-
-# Video 2 Video
-# from modules.video2video.tab_wan21_v2v import create_wan21_v2v_tab
-
-# Extras
-from modules.extras.tab_video_upscale import create_video_upscaler_interface
+# Tabs are listed as (label, module, builder). A tab module is imported when its tab is built,
+# and the pipeline classes it uses are imported on its first generation.
+TAB_GROUPS = [
+    ("Text 2 Image", [
+        ("Lumina Image 2.0", "modules.text2image.tab_lumina2", "create_lumina2_tab"),
+        ("Sana", "modules.text2image.tab_sana", "create_sana_tab"),
+        ("Lumina 1.0 Next SFT", "modules.text2image.tab_lumina", "create_lumina_tab"),
+        ("Hunyuan DiT", "modules.text2image.tab_hunyuandit", "create_hunyuandit_tab"),
+        ("Kandinsky-3", "modules.text2image.tab_kandinsky3", "create_kandinsky3_tab"),
+        ("CogView3 Plus", "modules.text2image.tab_cogview3plus", "create_cogView3Plus_tab"),
+        ("AuraFlow 0.3", "modules.text2image.tab_auraflow", "create_auraflow_tab"),
+    ]),
+    ("Text 2 Image - quantized", [
+        ("AuraFlow 0.3 - GGUF", "modules.text2image.tab_auraflow_gguf", "create_auraflow_gguf_tab"),
+    ]),
+    ("Text 2 Video", [
+        ("Wan-Video - Wan2.1", "modules.text2video.tab_wan21_t2v", "create_wan21_t2v_tab"),
+        ("SkyworkAI- SkyReels", "modules.text2video.tab_skyreels_t2v", "create_skyreels_t2v_tab"),
+    ]),
+    ("Image 2 Video", [
+        ("LTX-Video 0.9.1", "modules.image2video.tab_ltximage2video091", "create_ltximage2video091_tab"),
+    ]),
+    # ("Video 2 Video", [
+    #     ("Wan-Video - Wan2.1", "modules.video2video.tab_wan21_v2v", "create_wan21_v2v_tab"),
+    # ]),
+    ("Extras", [
+        ("Video upscaler", "modules.extras.tab_video_upscale", "create_video_upscaler_interface"),
+    ]),
+]
 
 # Import utilities for metadata handling
 from modules.util.utilities import read_metadata_from_file
 
+# Set WEBUI_PROFILE_STARTUP=1 to print the time spent importing and building each tab
+PROFILE_STARTUP = os.environ.get("WEBUI_PROFILE_STARTUP", "0") == "1"
+startup_report = [("gradio, torch and utilities", time.time() - startup_time)]
+
+def build_tab(module_name, builder_name):
+    """Import a tab module and build its UI"""
+    start_time = time.time()
+    module = importlib.import_module(module_name)
+    import_seconds = time.time() - start_time
+    getattr(module, builder_name)()
+    startup_report.append((f"{module_name} (import {import_seconds:.2f}s)", time.time() - start_time))
+
 def format_time(seconds):
     """Convert seconds to minutes and seconds format"""
     minutes = int(seconds // 60)
@@ -108,51 +130,19 @@ def create_info_tab():
 with gr.Blocks() as dwebui:
     gr.Markdown("# WebUI for Image/Video generation")
     with gr.Tabs():
-        # Text 2 Image Tab
-        with gr.Tab("Text 2 Image"):
-            with gr.Tabs():
-                with gr.Tab("Lumina Image 2.0"):
-                    create_lumina2_tab()
-                with gr.Tab("Sana"):
-                    create_sana_tab()
-                with gr.Tab("Lumina 1.0 Next SFT"):
-                    create_lumina_tab()
-                with gr.Tab("Hunyuan DiT"):
-                    create_hunyuandit_tab()
-                with gr.Tab("Kandinsky-3"):
-                    create_kandinsky3_tab()
-                with gr.Tab("CogView3 Plus"):
-                    create_cogView3Plus_tab()
-                with gr.Tab("AuraFlow 0.3"):
-                    create_auraflow_tab()
-
-        with gr.Tab("Text 2 Image - quantized"):
-            with gr.Tabs():
-                with gr.Tab("AuraFlow 0.3 - GGUF"):
-                    create_auraflow_gguf_tab()
-        # Text 2 Video Tab
-        with gr.Tab("Text 2 Video"):
-            with gr.Tabs():
-                with gr.Tab("Wan-Video - Wan2.1"):
-                    create_wan21_t2v_tab()           
-                with gr.Tab("SkyworkAI- SkyReels"):
-                    create_skyreels_t2v_tab()
-        with gr.Tab("Image 2 Video"):
-            with gr.Tabs():
-                with gr.Tab("LTX-Video 0.9.1"):
-                    create_ltximage2video091_tab()
-        """
-        with gr.Tab("Video 2 Video"):
-            with gr.Tabs():
-                with gr.Tab("Wan-Video - Wan2.1"):
-                    create_wan21_v2v_tab()
-        """
-        with gr.Tab("Extras"):
-            with gr.Tabs():
-                with gr.Tab("Video upscaler"):
-                    create_video_upscaler_interface()
+        for group_label, tabs in TAB_GROUPS:
+            with gr.Tab(group_label):
+                with gr.Tabs():
+                    for tab_label, module_name, builder_name in tabs:
+                        with gr.Tab(tab_label):
+                            build_tab(module_name, builder_name)
         with gr.Tab("Info"):
             create_info_tab()
 
+print(f">>>>UI built in {time.time() - startup_time:.1f}s<<<<")
+if PROFILE_STARTUP:
+    for name, seconds in startup_report:
+        print(f"    {seconds:6.2f}s  {name}")
+
 # Launch the WebUI
 dwebui.launch(share=False)
\ No newline at end of file
@@ -1 +1 @@
-from .video import VideoData, save_video, save_frames
+from .video import VideoData, VideoWriter, save_video, save_frames
@@ -0,0 +1,73 @@
+"""
+Measures the TextImageDataset loading throughput at several worker counts.
+
+    python -m diffsynth.data.benchmark --dataset_path data/dog --workers 0,2,4,8
+
+Without --dataset_path, a synthetic dataset of JPEG images with mixed aspect ratios is written
+to a temporary folder. Compare the images/sec with the training step rate: if loading is
+faster than training, the trainer is not input-bound.
+"""
+import argparse, os, csv, time, tempfile
+import numpy as np
+from PIL import Image
+from .simple_text_image import TextImageDataset, create_data_loader
+
+
+def make_synthetic_dataset(dataset_path, num_images=64, seed=0):
+    rng = np.random.default_rng(seed)
+    os.makedirs(os.path.join(dataset_path, "train"), exist_ok=True)
+    sizes = [(1536, 1024), (1024, 1536), (1280, 1280), (1920, 1080)]
+    rows = []
+    for image_id in range(num_images):
+        width, height = sizes[image_id % len(sizes)]
+        # Smooth noise compresses like a photo, unlike white noise
+        image = rng.integers(0, 256, (height // 16, width // 16, 3), dtype=np.uint8)
+        file_name = f"{image_id:05d}.jpg"
+        Image.fromarray(image).resize((width, height), resample=Image.BICUBIC).save(os.path.join(dataset_path, "train", file_name), quality=90)
+        rows.append({"file_name": file_name, "text": f"synthetic image {image_id}"})
+    with open(os.path.join(dataset_path, "train", "metadata.csv"), "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["file_name", "text"])
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def measure(dataset_path, num_workers, batch_size, num_batches, height, width, aspect_ratio_buckets, uint8, fast_jpeg_decode=False):
+    dataset = TextImageDataset(
+        dataset_path, steps_per_epoch=(num_batches + 1) * batch_size, height=height, width=width,
+        center_crop=False, random_flip=True, aspect_ratio_buckets=aspect_ratio_buckets, uint8=uint8,
+        fast_jpeg_decode=fast_jpeg_decode,
+    )
+    data_loader = iter(create_data_loader(dataset, batch_size=batch_size, num_workers=num_workers))
+    # The first batch includes the start of the workers
+    next(data_loader)
+    start_time = time.time()
+    for _ in range(num_batches):
+        next(data_loader)
+    return num_batches * batch_size / (time.time() - start_time)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the TextImageDataset data loader.")
+    parser.add_argument("--dataset_path", type=str, default=None)
+    parser.add_argument("--workers", type=str, default="0,2,4,8", help="Comma separated worker counts")
+    parser.add_argument("--batch_size", type=int, default=4)
+    parser.add_argument("--num_batches", type=int, default=16)
+    parser.add_argument("--height", type=int, default=1024)
+    parser.add_argument("--width", type=int, default=1024)
+    parser.add_argument("--aspect_ratio_buckets", action="store_true")
+    parser.add_argument("--fast_jpeg_decode", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        dataset_path = args.dataset_path
+        if dataset_path is None:
+            dataset_path = temp_dir
+            make_synthetic_dataset(dataset_path)
+        for num_workers in [int(i) for i in args.workers.split(",")]:
+            for uint8 in [False, True]:
+                images_per_second = measure(dataset_path, num_workers, args.batch_size, args.num_batches, args.height, args.width, args.aspect_ratio_buckets, uint8, args.fast_jpeg_decode)
+                print(f"workers={num_workers} {'uint8' if uint8 else 'float32'}: {images_per_second:.1f} images/sec")
+
+
+if __name__ == "__main__":
+    main()
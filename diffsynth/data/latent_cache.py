@@ -0,0 +1,164 @@
+import torch, os, json
+from safetensors import safe_open
+from safetensors.torch import save_file
+from tqdm import tqdm
+from .simple_text_image import image_to_model_input
+
+
+
+def prompt_emb_to_tensors(prompt_emb, prefix):
+    # encode_prompt returns a dict of tensors with a batch dimension of 1
+    return {f"{prefix}.{name}": value[0].contiguous() for name, value in prompt_emb.items() if isinstance(value, torch.Tensor)}
+
+
+
+class LatentCacheWriter:
+    """
+    Writes latents and prompt embeddings to safetensors shards of at most `shard_size` samples.
+    """
+    def __init__(self, cache_path, shard_size=256):
+        self.cache_path = cache_path
+        self.shard_size = shard_size
+        self.tensors = {}
+        self.num_samples = 0
+        self.shards = []
+        os.makedirs(cache_path, exist_ok=True)
+
+
+    def add(self, tensors, is_sample=True):
+        # Returns the id of the shard the tensors are written to
+        shard_id = len(self.shards)
+        self.tensors.update({name: tensor.detach().to("cpu") for name, tensor in tensors.items()})
+        self.num_samples += int(is_sample)
+        if self.num_samples >= self.shard_size:
+            self.flush()
+        return shard_id
+
+
+    def flush(self):
+        if len(self.tensors) == 0:
+            return
+        file_name = f"shard_{len(self.shards):05d}.safetensors"
+        file_path = os.path.join(self.cache_path, file_name)
+        save_file(self.tensors, file_path + ".tmp")
+        os.replace(file_path + ".tmp", file_path)
+        self.shards.append(file_name)
+        self.tensors = {}
+        self.num_samples = 0
+
+
+
+@torch.no_grad()
+def build_latent_cache(pipe, dataset, cache_path, num_repeats=1, shard_size=256, batch_size=4, config=None):
+    """
+    Encodes every image and text of a TextImageDataset once, for CachedLatentDataset.
+
+    Each image is encoded `num_repeats` times, so random crops and flips of the dataset
+    are still sampled, but only among these variants. The text of an image is encoded once.
+
+    Args:
+        pipe (BasePipeline): Pipeline with `encode_prompt` and `vae_encoder` on its device
+        dataset (TextImageDataset): The dataset to encode
+        cache_path (str): Folder of the shards and index.json
+        config (dict): Saved in index.json, to tell whether the cache matches later training arguments
+    """
+    writer = LatentCacheWriter(cache_path, shard_size=shard_size)
+    items, text_shards, prompt_emb_names = [], {}, []
+    data_ids = [data_id for _ in range(num_repeats) for data_id in range(len(dataset.path))]
+    bucket_ids = getattr(dataset, "bucket_ids", None)
+    if bucket_ids is not None:
+        # Images of one encoder batch must have the same size
+        data_ids.sort(key=lambda data_id: bucket_ids[data_id])
+    batches = [data_ids[batch_start: batch_start + batch_size] for batch_start in range(0, len(data_ids), batch_size)]
+    if bucket_ids is not None:
+        batches = [
+            [data_id for data_id in batch_ids if bucket_ids[data_id] == bucket_id]
+            for batch_ids in batches for bucket_id in sorted(set(bucket_ids[data_id] for data_id in batch_ids))
+        ]
+    item_id = 0
+    for batch_ids in tqdm(batches, desc="Encoding dataset"):
+        batch = [dataset.load_item(data_id) for data_id in batch_ids]
+        images = image_to_model_input(torch.stack([data["image"] for data in batch]), pipe.torch_dtype, pipe.device)
+        latents = pipe.vae_encoder(images)
+        for data_id, data, latent in zip(batch_ids, batch, latents):
+            text_key = f"text_{data_id}"
+            if data_id not in text_shards:
+                prompt_emb = pipe.encode_prompt(data["text"], positive=True)
+                prompt_emb_names = [name for name, value in prompt_emb.items() if isinstance(value, torch.Tensor)]
+                text_shards[data_id] = writer.add(prompt_emb_to_tensors(prompt_emb, text_key), is_sample=False)
+            items.append({
+                "latents": f"latents_{item_id}",
+                "latents_shard": writer.add({f"latents_{item_id}": latent.contiguous()}),
+                "text": text_key,
+                "text_shard": text_shards[data_id],
+                "bucket": None if bucket_ids is None else bucket_ids[data_id],
+            })
+            item_id += 1
+    writer.flush()
+    index = {"config": config or {}, "shards": writer.shards, "prompt_emb_names": prompt_emb_names, "items": items}
+    with open(os.path.join(cache_path, "index.json.tmp"), "w", encoding="utf-8") as f:
+        json.dump(index, f)
+    os.replace(os.path.join(cache_path, "index.json.tmp"), os.path.join(cache_path, "index.json"))
+    return index
+
+
+
+class CachedLatentDataset(torch.utils.data.Dataset):
+    """
+    Serves the latents and prompt embeddings written by build_latent_cache.
+
+    The shards are memory-mapped, so only the samples of a batch are read from disk and
+    every data loader worker shares the page cache.
+    """
+    def __init__(self, cache_path, steps_per_epoch=10000):
+        self.cache_path = cache_path
+        self.steps_per_epoch = steps_per_epoch
+        with open(os.path.join(cache_path, "index.json"), "r", encoding="utf-8") as f:
+            index = json.load(f)
+        self.shards = index["shards"]
+        self.items = index["items"]
+        self.prompt_emb_names = index["prompt_emb_names"]
+        # Latents of different aspect ratio buckets must be batched with AspectBucketBatchSampler
+        self.bucket_ids = [item.get("bucket") for item in self.items]
+        if len(set(self.bucket_ids)) <= 1:
+            self.bucket_ids = None
+        # Opened lazily, because file handles cannot be sent to data loader workers
+        self.handles = {}
+
+
+    @staticmethod
+    def is_available(cache_path, config=None):
+        index_path = os.path.join(cache_path, "index.json")
+        if not os.path.exists(index_path):
+            return False
+        with open(index_path, "r", encoding="utf-8") as f:
+            return config is None or json.load(f).get("config") == config
+
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["handles"] = {}
+        return state
+
+
+    def shard(self, shard_id):
+        if shard_id not in self.handles:
+            self.handles[shard_id] = safe_open(os.path.join(self.cache_path, self.shards[shard_id]), framework="pt", device="cpu")
+        return self.handles[shard_id]
+
+
+    def __getitem__(self, index):
+        if self.bucket_ids is not None:
+            item = self.items[index]
+        else:
+            data_id = torch.randint(0, len(self.items), (1,))[0]
+            data_id = (data_id + index) % len(self.items) # For fixed seed.
+            item = self.items[data_id]
+        latents = self.shard(item["latents_shard"]).get_tensor(item["latents"])
+        text_shard = self.shard(item["text_shard"])
+        prompt_emb = {name: text_shard.get_tensor(f"{item['text']}.{name}") for name in self.prompt_emb_names}
+        return {"latents": latents, "prompt_emb": prompt_emb}
+
+
+    def __len__(self):
+        return self.steps_per_epoch
@@ -1,41 +1,154 @@
-import torch, os, torchvision
-from torchvision import transforms
-import pandas as pd
+import torch, os, csv, math
+import numpy as np
 from PIL import Image
 
 
 
+def make_aspect_buckets(height=1024, width=1024, division_factor=64, max_aspect_ratio=2.0):
+    # Sizes with about the pixel count of height x width, both sides divisible by division_factor
+    area = height * width
+    buckets = {(height, width)}
+    for bucket_width in range(division_factor, width * 4 + 1, division_factor):
+        bucket_height = area // bucket_width // division_factor * division_factor
+        if bucket_height > 0 and 1 / max_aspect_ratio <= bucket_width / bucket_height <= max_aspect_ratio:
+            buckets.add((bucket_height, bucket_width))
+    return sorted(buckets)
+
+
+
+def image_to_model_input(image, dtype, device):
+    # uint8 images are sent to the device as they are and normalized there
+    image = image.to(device=device, non_blocking=True)
+    if image.dtype == torch.uint8:
+        image = image.float() / 127.5 - 1
+    return image.to(dtype=dtype)
+
+
+
 class TextImageDataset(torch.utils.data.Dataset):
-    def __init__(self, dataset_path, steps_per_epoch=10000, height=1024, width=1024, center_crop=True, random_flip=False):
+    """
+    Images and captions listed in `train/metadata.csv` of `dataset_path`.
+
+    Args:
+        aspect_ratio_buckets (bool): Resize each image to the bucket closest to its aspect ratio,
+            instead of cropping every image to height x width. Batches must then come from
+            AspectBucketBatchSampler, see create_data_loader.
+        uint8 (bool): Return uint8 images, normalized on the device by image_to_model_input.
+            This makes the data sent from the workers four times smaller.
+        fast_jpeg_decode (bool): Decode JPEG images at a reduced DCT scale that still covers the
+            target size. Much faster for large photos, but the downscaled pixels differ from a
+            full decode (up to about 0.09 on the [-1, 1] scale for 1280-1920px images cropped to 512).
+    """
+    def __init__(self, dataset_path, steps_per_epoch=10000, height=1024, width=1024, center_crop=True, random_flip=False, aspect_ratio_buckets=False, uint8=False, fast_jpeg_decode=False):
         self.steps_per_epoch = steps_per_epoch
-        metadata = pd.read_csv(os.path.join(dataset_path, "train/metadata.csv"))
-        self.path = [os.path.join(dataset_path, "train", file_name) for file_name in metadata["file_name"]]
-        self.text = metadata["text"].to_list()
+        with open(os.path.join(dataset_path, "train/metadata.csv"), "r", encoding="utf-8", newline="") as f:
+            metadata = list(csv.DictReader(f))
+        self.path = [os.path.join(dataset_path, "train", row["file_name"]) for row in metadata]
+        self.text = [row["text"] for row in metadata]
         self.height = height
         self.width = width
-        self.image_processor = transforms.Compose(
-            [
-                transforms.CenterCrop((height, width)) if center_crop else transforms.RandomCrop((height, width)),
-                transforms.RandomHorizontalFlip() if random_flip else transforms.Lambda(lambda x: x),
-                transforms.ToTensor(),
-                transforms.Normalize([0.5], [0.5]),
-            ]
-        )
+        self.center_crop = center_crop
+        self.random_flip = random_flip
+        self.uint8 = uint8
+        self.fast_jpeg_decode = fast_jpeg_decode
+        self.buckets, self.bucket_ids = None, None
+        if aspect_ratio_buckets:
+            self.buckets = make_aspect_buckets(height, width)
+            bucket_ratios = np.log([bucket_width / bucket_height for bucket_height, bucket_width in self.buckets])
+            self.bucket_ids = []
+            for path in self.path:
+                # Only the header is read here
+                with Image.open(path) as image:
+                    image_width, image_height = image.size
+                self.bucket_ids.append(int(np.abs(bucket_ratios - math.log(image_width / image_height)).argmin()))
 
 
     def __getitem__(self, index):
+        if self.bucket_ids is not None:
+            # The batch sampler picks the images
+            return self.load_item(index)
         data_id = torch.randint(0, len(self.path), (1,))[0]
         data_id = (data_id + index) % len(self.path) # For fixed seed.
+        return self.load_item(data_id)
+
+
+    def load_item(self, data_id):
         text = self.text[data_id]
-        image = Image.open(self.path[data_id]).convert("RGB")
-        target_height, target_width = self.height, self.width
+        if self.bucket_ids is None:
+            target_height, target_width = self.height, self.width
+        else:
+            target_height, target_width = self.buckets[self.bucket_ids[data_id]]
+        image = Image.open(self.path[data_id])
+        if self.fast_jpeg_decode:
+            # JPEG images are decoded at the smallest scale that still covers the target size
+            scale = max(target_width / image.width, target_height / image.height)
+            image.draft("RGB", (math.ceil(image.width * scale), math.ceil(image.height * scale)))
+        image = image.convert("RGB")
         width, height = image.size
         scale = max(target_width / width, target_height / height)
-        shape = [round(height*scale),round(width*scale)]
-        image = torchvision.transforms.functional.resize(image,shape,interpolation=transforms.InterpolationMode.BILINEAR)
-        image = self.image_processor(image)
+        shape = [max(round(height*scale), target_height), max(round(width*scale), target_width)]
+        image = image.resize((shape[1], shape[0]), resample=Image.BILINEAR)
+        if self.center_crop:
+            top, left = (shape[0] - target_height) // 2, (shape[1] - target_width) // 2
+        else:
+            top, left = torch.randint(0, shape[0] - target_height + 1, (1,)).item(), torch.randint(0, shape[1] - target_width + 1, (1,)).item()
+        image = image.crop((left, top, left + target_width, top + target_height))
+        if self.random_flip and torch.rand(1).item() < 0.5:
+            image = image.transpose(Image.FLIP_LEFT_RIGHT)
+        image = torch.from_numpy(np.asarray(image).copy()).permute(2, 0, 1)
+        if not self.uint8:
+            image = image.float() / 127.5 - 1
         return {"text": text, "image": image}
 
 
     def __len__(self):
         return self.steps_per_epoch
+
+
+
+class AspectBucketBatchSampler(torch.utils.data.Sampler):
+    """
+    Yields `num_batches` batches of dataset indices, all images of a batch sharing one bucket.
+
+    Buckets are drawn in proportion to their number of images.
+    """
+    def __init__(self, bucket_ids, batch_size=1, num_batches=10000, seed=0):
+        self.batch_size = batch_size
+        self.num_batches = num_batches
+        self.seed = seed
+        self.epoch = 0
+        self.bucket_ids = torch.tensor(bucket_ids)
+        self.bucket_members = {bucket_id: torch.nonzero(self.bucket_ids == bucket_id)[:, 0] for bucket_id in set(bucket_ids)}
+
+
+    def __iter__(self):
+        generator = torch.Generator().manual_seed(self.seed + self.epoch)
+        self.epoch += 1
+        for _ in range(self.num_batches):
+            data_id = torch.randint(0, len(self.bucket_ids), (1,), generator=generator).item()
+            members = self.bucket_members[self.bucket_ids[data_id].item()]
+            others = members[torch.randint(0, len(members), (self.batch_size - 1,), generator=generator)]
+            yield [data_id] + others.tolist()
+
+
+    def __len__(self):
+        return self.num_batches
+
+
+
+def create_data_loader(dataset, batch_size=1, num_workers=0, prefetch_factor=4, shuffle=True):
+    """
+    Batches that are decoded in `num_workers` processes, each keeping `prefetch_factor` batches
+    ready, and copied to pinned memory for fast transfer to the GPU.
+    """
+    worker_kwargs = dict(persistent_workers=True, prefetch_factor=prefetch_factor) if num_workers > 0 else {}
+    if getattr(dataset, "bucket_ids", None) is not None:
+        batch_sampler = AspectBucketBatchSampler(dataset.bucket_ids, batch_size=batch_size, num_batches=len(dataset) // batch_size)
+        return torch.utils.data.DataLoader(
+            dataset, batch_sampler=batch_sampler, num_workers=num_workers,
+            pin_memory=torch.cuda.is_available(), **worker_kwargs
+        )
+    return torch.utils.data.DataLoader(
+        dataset, shuffle=shuffle, batch_size=batch_size, num_workers=num_workers,
+        pin_memory=torch.cuda.is_available(), **worker_kwargs
+    )
@@ -1,22 +1,111 @@
-import imageio, os
+import imageio, os, queue, threading, torch
 import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from PIL import Image
 from tqdm import tqdm
 
 
 class LowMemoryVideo:
-    def __init__(self, file_name):
+    """
+    Video reader that decodes ahead of the requested frame on a background thread.
+
+    Decoded frames are kept as uint8 [H, W, 3] arrays in an LRU cache of `cache_size` frames.
+    Reading frames in order is served from the frames decoded ahead (at most `prefetch` past
+    the last requested frame). A request outside of that window moves the decoder to the
+    requested frame; imageio restarts ffmpeg there, which seeks to the nearest keyframe before
+    it and decodes forward to the frame.
+    """
+    def __init__(self, file_name, cache_size=64, prefetch=16):
         self.reader = imageio.get_reader(file_name)
-    
+        # Counted once, count_frames scans the file
+        self.length = self.reader.count_frames()
+        self.prefetch = prefetch
+        # The frames decoded ahead must not evict the frame that is waited for
+        self.cache_size = max(cache_size, prefetch + 2)
+        self.cache = OrderedDict()
+        self.condition = threading.Condition()
+        self.request = 0
+        self.next_index = 0
+        self.error = None
+        self.decoding = False
+        self.closed = False
+        with self.condition:
+            self.start_decoding()
+
     def __len__(self):
-        return self.reader.count_frames()
+        return self.length
+
+    def next_decode_index(self):
+        if self.request not in self.cache and not (self.next_index <= self.request <= self.next_index + self.prefetch):
+            self.next_index = self.request
+        if self.next_index < self.length and self.next_index <= self.request + self.prefetch:
+            return self.next_index
+        return None
+
+    def start_decoding(self):
+        if not self.decoding:
+            self.decoding = True
+            threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        while True:
+            with self.condition:
+                index = None if self.closed else self.next_decode_index()
+                if index is None:
+                    # The thread stops when it is ahead enough, so that an idle thread does not keep the reader alive
+                    self.decoding = False
+                    self.condition.notify_all()
+                    return
+            try:
+                frame = np.asarray(self.reader.get_data(index))
+            except Exception as e:
+                with self.condition:
+                    self.error = e
+                    self.decoding = False
+                    self.condition.notify_all()
+                return
+            with self.condition:
+                self.cache[index] = frame
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+                self.next_index = index + 1
+                self.condition.notify_all()
+
+    def get_array(self, item):
+        if item < 0 or item >= self.length:
+            raise IndexError(f"Frame {item} is out of range for a video of {self.length} frames")
+        with self.condition:
+            if item not in self.cache:
+                self.request = item
+                self.error = None
+                self.start_decoding()
+                while item not in self.cache and self.error is None:
+                    self.condition.wait()
+                if item not in self.cache:
+                    raise self.error
+            self.cache.move_to_end(item)
+            frame = self.cache[item]
+            # Keep decoding ahead of this frame
+            self.request = item
+            self.start_decoding()
+            return frame
 
     def __getitem__(self, item):
-        return Image.fromarray(np.array(self.reader.get_data(item))).convert("RGB")
+        return Image.fromarray(self.get_array(item)).convert("RGB")
 
-    def __del__(self):
+    def close(self):
+        with self.condition:
+            self.closed = True
+            while self.decoding:
+                self.condition.wait()
         self.reader.close()
 
+    def __del__(self):
+        # The decoding thread holds a reference, so this only runs once it has stopped
+        if hasattr(self, "reader"):
+            self.reader.close()
+
 
 def split_file_name(file_name):
     result = []
@@ -58,24 +147,44 @@ class LowMemoryImageFolder:
     def __getitem__(self, item):
         return Image.open(self.file_list[item]).convert("RGB")
 
+    def get_array(self, item):
+        return np.asarray(self.__getitem__(item))
+
     def __del__(self):
         pass
 
 
 def crop_and_resize(image, height, width):
-    image = np.array(image)
-    image_height, image_width, _ = image.shape
+    """
+    Crops the center of image to the aspect ratio of height / width and resizes it to that size.
+
+    image is a PIL image, which returns a PIL image, or a uint8 [H, W, C] or [N, H, W, C] array or
+    tensor, which returns a uint8 tensor. A batch of frames is resized in one interpolation.
+    """
+    if isinstance(image, Image.Image):
+        return Image.fromarray(crop_and_resize(np.array(image), height, width).numpy())
+    frames = image if isinstance(image, torch.Tensor) else torch.from_numpy(np.asarray(image))
+    if frames.dim() == 3:
+        return crop_and_resize(frames.unsqueeze(0), height, width)[0]
+    image_height, image_width = frames.shape[1:3]
     if image_height / image_width < height / width:
         croped_width = int(image_height / height * width)
         left = (image_width - croped_width) // 2
-        image = image[:, left: left+croped_width]
-        image = Image.fromarray(image).resize((width, height))
+        frames = frames[:, :, left: left+croped_width]
     else:
         croped_height = int(image_width / width * height)
         left = (image_height - croped_height) // 2
-        image = image[left: left+croped_height, :]
-        image = Image.fromarray(image).resize((width, height))
-    return image
+        frames = frames[:, left: left+croped_height, :]
+    if frames.shape[1:3] != (height, width):
+        frames = frames.permute(0, 3, 1, 2)
+        try:
+            # Resized as uint8 without a float copy, which recent versions of torch support
+            frames = torch.nn.functional.interpolate(frames, size=(height, width), mode="bicubic", align_corners=False, antialias=True)
+        except RuntimeError:
+            frames = torch.nn.functional.interpolate(frames.float(), size=(height, width), mode="bicubic", align_corners=False, antialias=True)
+            frames = frames.round().clamp(0, 255).to(torch.uint8)
+        frames = frames.permute(0, 2, 3, 1)
+    return frames.contiguous()
 
 
 class VideoData:
@@ -114,7 +223,7 @@ class VideoData:
         if self.height is not None and self.width is not None:
             return self.height, self.width
         else:
-            height, width, _ = self.__getitem__(0).shape
+            height, width, _ = self.data.get_array(0).shape
             return height, width
 
     def __getitem__(self, item):
@@ -125,6 +234,21 @@ class VideoData:
                 frame = crop_and_resize(frame, self.height, self.width)
         return frame
 
+    def get_batch(self, indices, batch_size=16):
+        """
+        Returns the frames at indices as a uint8 [N, H, W, C] tensor.
+        Frames are cropped and resized `batch_size` at a time, so that only the resized frames are held.
+        """
+        indices = list(indices)
+        batches = []
+        for batch_id in range(0, len(indices), batch_size):
+            frames = np.stack([self.data.get_array(i) for i in indices[batch_id: batch_id + batch_size]])
+            if self.height is not None and self.width is not None and frames.shape[1:3] != (self.height, self.width):
+                batches.append(crop_and_resize(frames, self.height, self.width))
+            else:
+                batches.append(torch.from_numpy(frames))
+        return torch.concat(batches, dim=0)
+
     def __del__(self):
         pass
 
@@ -135,14 +259,100 @@ class VideoData:
             frame.save(os.path.join(folder, f"{i}.png"))
 
 
+def frame_to_array(frame, bgr=False):
+    """
+    Returns a frame as a uint8 [H, W, 3] RGB array.
+    Accepts PIL images and uint8 [H, W, C] numpy arrays or torch tensors (BGR if bgr is set).
+    """
+    if isinstance(frame, Image.Image):
+        frame = np.asarray(frame.convert("RGB"))
+    elif hasattr(frame, "numpy"):
+        frame = frame.detach().cpu().numpy()
+    if bgr:
+        frame = frame[..., ::-1]
+    return np.ascontiguousarray(frame, dtype=np.uint8)
+
+
+class VideoWriter:
+    """
+    Video file writer that converts and writes frames on a background thread.
+
+    append() only queues the frame, so the caller (e.g. the VAE decoder or an upscaler) keeps
+    working while the frames are converted to RGB arrays and piped to ffmpeg, which encodes in its
+    own process. At most `max_queue_size` frames wait in the queue.
+
+    Extra keyword arguments (e.g. codec, macro_block_size) are passed to imageio.get_writer.
+    """
+    def __init__(self, save_path, fps, quality=9, ffmpeg_params=None, bgr=False, max_queue_size=8, **kwargs):
+        self.writer = imageio.get_writer(save_path, fps=fps, quality=quality, ffmpeg_params=ffmpeg_params, **kwargs)
+        self.bgr = bgr
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            frame = self.queue.get()
+            if frame is None:
+                break
+            if self.error is not None:
+                # Keep draining so that append() never blocks after a failure
+                continue
+            try:
+                self.writer.append_data(frame_to_array(frame, self.bgr))
+            except Exception as e:
+                self.error = e
+
+    def append(self, frame):
+        if self.error is not None:
+            raise self.error
+        self.queue.put(frame)
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self.writer.close()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
 def save_video(frames, save_path, fps, quality=9, ffmpeg_params=None):
-    writer = imageio.get_writer(save_path, fps=fps, quality=quality, ffmpeg_params=ffmpeg_params)
-    for frame in tqdm(frames, desc="Saving video"):
-        frame = np.array(frame)
-        writer.append_data(frame)
-    writer.close()
+    # frames may be a generator (e.g. a streamed VAE decode), each frame is written as it arrives.
+    # A uint8 [T, H, W, C] array or tensor is written without going through PIL.
+    with VideoWriter(save_path, fps=fps, quality=quality, ffmpeg_params=ffmpeg_params) as writer:
+        for frame in tqdm(frames, desc="Saving video"):
+            writer.append(frame)
+
+
+def save_frame(frame, file_path):
+    Image.fromarray(frame).save(file_path)
+
 
-def save_frames(frames, save_path):
+def save_frames(frames, save_path, max_workers=None):
+    """
+    Saves frames as {i}.png in save_path, compressed by `max_workers` processes.
+    Frames are submitted in a bounded window, so a generator is never fully held in memory.
+    """
     os.makedirs(save_path, exist_ok=True)
-    for i, frame in enumerate(tqdm(frames, desc="Saving images")):
-        frame.save(os.path.join(save_path, f"{i}.png"))
+    if max_workers is None:
+        max_workers = min(os.cpu_count() or 1, 8)
+    if max_workers <= 1:
+        for i, frame in enumerate(tqdm(frames, desc="Saving images")):
+            save_frame(frame_to_array(frame), os.path.join(save_path, f"{i}.png"))
+        return
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = []
+        for i, frame in enumerate(tqdm(frames, desc="Saving images")):
+            futures.append(executor.submit(save_frame, frame_to_array(frame), os.path.join(save_path, f"{i}.png")))
+            if len(futures) >= max_workers * 2:
+                futures.pop(0).result()
+        for future in futures:
+            future.result()
@@ -0,0 +1,78 @@
+"""
+Measures the frame loading throughput of VideoData against reading frame by frame.
+
+    python -m diffsynth.data.video_benchmark --video_file input.mp4 --height 512 --width 512
+
+Without --video_file, a synthetic video of 1000 frames is written to a temporary folder. The
+baseline reads every frame with imageio's get_data, converts it to PIL and crops and resizes it
+with PIL, like VideoData did before frames were decoded ahead and resized in batches. The random
+pattern reads short runs of frames at random positions, which exercises seeking and the cache.
+"""
+import argparse, os, time, tempfile
+import numpy as np
+import imageio
+from PIL import Image, ImageOps
+from .video import VideoData, save_video
+
+
+def make_synthetic_video(file_path, num_frames=1000, height=480, width=832, fps=16, seed=0):
+    rng = np.random.default_rng(seed)
+    # A moving smooth pattern compresses like a real video, unlike white noise
+    pattern = np.asarray(Image.fromarray(rng.integers(0, 256, (height // 16, width // 8, 3), dtype=np.uint8)).resize((width * 2, height), resample=Image.BICUBIC))
+    frames = (pattern[:, (i * 4) % width: (i * 4) % width + width] for i in range(num_frames))
+    save_video(frames, file_path, fps=fps, quality=7)
+
+
+def make_indices(pattern, num_frames, num_reads, seed=0):
+    if pattern == "sequential":
+        return list(range(min(num_frames, num_reads)))
+    rng = np.random.default_rng(seed)
+    indices = []
+    while len(indices) < num_reads:
+        start = int(rng.integers(0, num_frames))
+        indices.extend(range(start, min(start + 8, num_frames)))
+    return indices[:num_reads]
+
+
+def read_frame_by_frame(video_file, indices, height, width):
+    reader = imageio.get_reader(video_file)
+    frames = []
+    for i in indices:
+        frame = Image.fromarray(np.array(reader.get_data(i))).convert("RGB")
+        if height is not None and width is not None:
+            frame = ImageOps.fit(frame, (width, height), method=Image.BICUBIC)
+        frames.append(frame)
+    reader.close()
+    return frames
+
+
+def read_batch(video_file, indices, height, width):
+    return VideoData(video_file=video_file, height=height, width=width).get_batch(indices)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark VideoData frame loading.")
+    parser.add_argument("--video_file", type=str, default=None)
+    parser.add_argument("--num_frames", type=int, default=1000, help="Length of the synthetic video")
+    parser.add_argument("--num_reads", type=int, default=1000)
+    parser.add_argument("--height", type=int, default=512)
+    parser.add_argument("--width", type=int, default=512)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        video_file = args.video_file
+        if video_file is None:
+            video_file = os.path.join(temp_dir, "video.mp4")
+            make_synthetic_video(video_file, num_frames=args.num_frames)
+        num_frames = len(VideoData(video_file=video_file))
+        for pattern in ["sequential", "random"]:
+            indices = make_indices(pattern, num_frames, args.num_reads)
+            for name, read_fn in [("frame by frame", read_frame_by_frame), ("VideoData.get_batch", read_batch)]:
+                start_time = time.time()
+                read_fn(video_file, indices, args.height, args.width)
+                seconds = time.time() - start_time
+                print(f"{pattern} {name}: {len(indices)} frames in {seconds:.2f} s, {len(indices) / seconds:.1f} frames/sec")
+
+
+if __name__ == "__main__":
+    main()
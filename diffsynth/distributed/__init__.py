@@ -0,0 +1 @@
+from .sequence_parallel import *
@@ -0,0 +1,180 @@
+"""
+Sequence parallel DiT inference with torch.distributed.
+
+Every rank runs the whole pipeline with the same seed. Inside the DiT, the video tokens are
+split across ranks. Self-attention exchanges heads for tokens with an all-to-all, so that each
+rank attends over the full sequence with num_heads / world_size heads, and exchanges them back
+afterwards. The tokens are gathered before the head, so that the scheduler and the VAE see the
+full latents on every rank.
+
+Launch one process per device with torchrun:
+
+    torchrun --nproc_per_node 2 script.py
+
+The gloo backend runs on CPU processes, nccl on GPUs.
+"""
+import os, types
+import torch
+import torch.distributed as dist
+
+
+def init_sequence_parallel(backend=None):
+    """
+    Joins the process group started by torchrun
+
+    Returns:
+        tuple: (rank, world_size)
+    """
+    if not dist.is_initialized():
+        if backend is None:
+            backend = "nccl" if torch.cuda.is_available() else "gloo"
+        dist.init_process_group(backend=backend)
+    if dist.get_backend() == "nccl":
+        torch.cuda.set_device(int(os.environ.get("LOCAL_RANK", 0)))
+    return dist.get_rank(), dist.get_world_size()
+
+
+def get_sequence_parallel_world_size():
+    return dist.get_world_size() if dist.is_available() and dist.is_initialized() else 1
+
+
+def get_sequence_parallel_rank():
+    return dist.get_rank() if dist.is_available() and dist.is_initialized() else 0
+
+
+def shared_random_seed():
+    # The same random seed on every rank, so that all ranks denoise the same latents
+    seed = torch.randint(0, 2**31 - 1, (1,))
+    if get_sequence_parallel_world_size() > 1:
+        if dist.get_backend() == "nccl":
+            seed = seed.cuda()
+        dist.broadcast(seed, src=0)
+    return int(seed.item())
+
+
+def split_sequence(x: torch.Tensor, dim=1):
+    """
+    Returns the chunk of x along dim that belongs to this rank.
+    The sequence is padded with zeros at the end to a multiple of the world size.
+    """
+    world_size = get_sequence_parallel_world_size()
+    if world_size == 1:
+        return x
+    chunk_size = (x.shape[dim] + world_size - 1) // world_size
+    padding = chunk_size * world_size - x.shape[dim]
+    if padding > 0:
+        shape = list(x.shape)
+        shape[dim] = padding
+        x = torch.cat([x, x.new_zeros(shape)], dim=dim)
+    return x.narrow(dim, get_sequence_parallel_rank() * chunk_size, chunk_size).contiguous()
+
+
+def gather_sequence(x: torch.Tensor, dim=1, seq_len=None):
+    """Concatenates the chunks of all ranks along dim, and removes the padding of split_sequence"""
+    world_size = get_sequence_parallel_world_size()
+    if world_size == 1:
+        return x
+    chunks = [torch.empty_like(x) for _ in range(world_size)]
+    dist.all_gather(chunks, x.contiguous())
+    x = torch.cat(chunks, dim=dim)
+    return x if seq_len is None else x.narrow(dim, 0, seq_len)
+
+
+def all_to_all(x: torch.Tensor, scatter_dim, gather_dim):
+    """Sends the i-th chunk of x along scatter_dim to rank i, and concatenates the received chunks along gather_dim"""
+    world_size = get_sequence_parallel_world_size()
+    if world_size == 1:
+        return x
+    inputs = [chunk.contiguous() for chunk in x.chunk(world_size, dim=scatter_dim)]
+    outputs = [torch.empty_like(chunk) for chunk in inputs]
+    dist.all_to_all(outputs, inputs)
+    return torch.cat(outputs, dim=gather_dim)
+
+
+def sequence_parallel_attention(attention_fn, q, k, v, seq_len=None, **kwargs):
+    """
+    Runs attention_fn on the full sequence with a part of the heads.
+
+    Args:
+        attention_fn (callable): Attention on [B, L, N, D] tensors
+        q, k, v (torch.Tensor): [B, L / world_size, N, D], the tokens of this rank
+        seq_len (int): Length of the sequence without the padding of split_sequence
+    """
+    local_len = q.shape[1]
+    # [B, L / world_size, N, D] -> [B, L, N / world_size, D]
+    q, k, v = [all_to_all(x, scatter_dim=2, gather_dim=1) for x in (q, k, v)]
+    if seq_len is not None and seq_len < q.shape[1]:
+        padded_len = q.shape[1]
+        q, k, v = q[:, :seq_len], k[:, :seq_len], v[:, :seq_len]
+        x = attention_fn(q, k, v, **kwargs)
+        x = torch.cat([x, x.new_zeros((x.shape[0], padded_len - seq_len, *x.shape[2:]))], dim=1)
+    else:
+        x = attention_fn(q, k, v, **kwargs)
+    x = all_to_all(x, scatter_dim=1, gather_dim=2)
+    assert x.shape[1] == local_len
+    return x
+
+
+def split_rope_freqs(freqs, seq_len):
+    # The rotations of the tokens of this rank, shorter than the chunk at the end of the sequence
+    if isinstance(freqs, list):
+        return [split_rope_freqs(grid, seq_len) for grid in freqs]
+    world_size = get_sequence_parallel_world_size()
+    chunk_size = (seq_len + world_size - 1) // world_size
+    return freqs[get_sequence_parallel_rank() * chunk_size: (get_sequence_parallel_rank() + 1) * chunk_size]
+
+
+def wan_sequence_parallel_attn_forward(self, x, seq_lens, grid_sizes, freqs):
+    from ..models.wan_video_dit import flash_attention, rope_apply
+    b, s, n, d = *x.shape[:2], self.num_heads, self.head_dim
+    q = self.norm_q(self.q(x)).view(b, s, n, d)
+    k = self.norm_k(self.k(x)).view(b, s, n, d)
+    v = self.v(x).view(b, s, n, d)
+    # Padding keys at the end of the gathered sequence are masked by seq_lens
+    x = sequence_parallel_attention(
+        flash_attention,
+        rope_apply(q, grid_sizes, freqs).to(v.dtype),
+        rope_apply(k, grid_sizes, freqs).to(v.dtype),
+        v,
+        k_lens=seq_lens,
+        window_size=self.window_size,
+    )
+    x = x.flatten(2)
+    x = self.o(x)
+    return x
+
+
+def wan_sequence_parallel_block_forward(self, x, use_gradient_checkpointing=False, **kwargs):
+    # Replaces WanModel.block_forward: tokens are split before the blocks and gathered after them
+    seq_len = x.shape[1]
+    x = split_sequence(x, dim=1)
+    kwargs["freqs"] = split_rope_freqs(kwargs["freqs"], seq_len)
+    for block in self.blocks:
+        x = block(x, **kwargs)
+    return gather_sequence(x, dim=1, seq_len=seq_len)
+
+
+def enable_sequence_parallel(dit):
+    """
+    Splits the video tokens of a WanModel or StepVideoModel across the ranks of the process group.
+    The number of attention heads must be divisible by the world size.
+    """
+    from ..models.wan_video_dit import WanModel
+    from ..models.stepvideo_dit import StepVideoModel
+    world_size = get_sequence_parallel_world_size()
+    if isinstance(dit, WanModel):
+        if dit.num_heads % world_size != 0:
+            raise ValueError(f"{dit.num_heads} attention heads cannot be split across {world_size} ranks")
+        for block in dit.blocks:
+            block.self_attn.forward = types.MethodType(wan_sequence_parallel_attn_forward, block.self_attn)
+        dit.block_forward = types.MethodType(wan_sequence_parallel_block_forward, dit)
+    elif isinstance(dit, StepVideoModel):
+        for block in dit.transformer_blocks:
+            if block.attn1.n_heads % world_size != 0:
+                raise ValueError(f"{block.attn1.n_heads} attention heads cannot be split across {world_size} ranks")
+            block.attn1.parallel = True
+            block.attn1.core_attention = block.attn1.parallel_attn_func
+        dit.parallel = True
+    else:
+        raise ValueError(f"Sequence parallel is not supported for {type(dit).__name__}")
+    return dit
@@ -1,11 +1,11 @@
 from .runners.fast import TableManager, PyramidPatchMatcher
+from .backends import get_backend
 from PIL import Image
 import numpy as np
-import cupy as cp
 
 
 class FastBlendSmoother:
-    def __init__(self):
+    def __init__(self, backend="auto"):
         self.batch_size = 8
         self.window_size = 64
         self.ebsynth_config = {
@@ -16,6 +16,8 @@ class FastBlendSmoother:
             "guide_weight": 10.0,
             "initialize": "identity",
             "tracking_window_size": 0,
+            # "cupy" (CUDA), "cpu" (NumPy/torch) or "auto"
+            "backend": get_backend(backend),
         }
 
     @staticmethod
@@ -56,8 +58,5 @@ class FastBlendSmoother:
             original_frames, rendered_frames,
             self.batch_size, self.window_size, self.ebsynth_config
         )
-        mempool = cp.get_default_memory_pool()
-        pinned_mempool = cp.get_default_pinned_memory_pool()
-        mempool.free_all_blocks()
-        pinned_mempool.free_all_blocks()
+        self.ebsynth_config["backend"].release_memory()
         return frames
\ No newline at end of file
@@ -0,0 +1,188 @@
+import contextlib
+import numpy as np
+import torch
+
+
+class CupyBackend:
+    """
+    Runs PatchMatch on a CUDA device with the CuPy raw kernels.
+    """
+    name = "cupy"
+
+    def __init__(self, gpu_id=0, threads_per_block=8):
+        import cupy as cp
+        from .cupy_kernels import remapping_kernel, patch_error_kernel, pairwise_patch_error_kernel
+        self.xp = cp
+        self.gpu_id = gpu_id
+        self.block = (threads_per_block, threads_per_block)
+        self.remapping_kernel = remapping_kernel
+        self.patch_error_kernel = patch_error_kernel
+        self.pairwise_patch_error_kernel = pairwise_patch_error_kernel
+
+    def device(self):
+        return self.xp.cuda.Device(self.gpu_id)
+
+    def asarray(self, array, dtype=np.float32):
+        return self.xp.array(array, dtype=dtype)
+
+    def asnumpy(self, array):
+        return array.get()
+
+    def grid(self, height, width, batch_size):
+        return (
+            (height + self.block[0] - 1) // self.block[0],
+            (width + self.block[1] - 1) // self.block[1],
+            batch_size
+        )
+
+    def remap(self, height, width, channel, patch_size, pad_size, source, nnf):
+        batch_size = source.shape[0]
+        target = self.xp.zeros((batch_size, height + pad_size * 2, width + pad_size * 2, channel), dtype=self.xp.float32)
+        self.remapping_kernel(
+            self.grid(height, width, batch_size), self.block,
+            (height, width, channel, patch_size, pad_size, source, nnf, target)
+        )
+        return target
+
+    def patch_error(self, height, width, channel, patch_size, pad_size, source, nnf, target):
+        batch_size = source.shape[0]
+        error = self.xp.zeros((batch_size, height, width), dtype=self.xp.float32)
+        self.patch_error_kernel(
+            self.grid(height, width, batch_size), self.block,
+            (height, width, channel, patch_size, pad_size, source, nnf, target, error)
+        )
+        return error
+
+    def pairwise_patch_error(self, height, width, channel, patch_size, pad_size, source_a, nnf_a, source_b, nnf_b):
+        batch_size = source_a.shape[0]
+        error = self.xp.zeros((batch_size, height, width), dtype=self.xp.float32)
+        self.pairwise_patch_error_kernel(
+            self.grid(height, width, batch_size), self.block,
+            (height, width, channel, patch_size, pad_size, source_a, nnf_a, source_b, nnf_b, error)
+        )
+        return error
+
+    def release_memory(self):
+        self.xp.get_default_memory_pool().free_all_blocks()
+        self.xp.get_default_pinned_memory_pool().free_all_blocks()
+
+
+class CPUBackend:
+    """
+    Runs PatchMatch on the CPU with NumPy arrays.
+
+    The three kernels are vectorized over the batch and all pixels and loop only over the
+    patch_size x patch_size offsets. Row gathers run in torch, which uses every CPU core.
+    """
+    name = "cpu"
+
+    def __init__(self, num_threads=None, **kwargs):
+        self.xp = np
+        if num_threads is not None:
+            torch.set_num_threads(num_threads)
+
+    def device(self):
+        return contextlib.nullcontext()
+
+    def asarray(self, array, dtype=np.float32):
+        return np.ascontiguousarray(array, dtype=dtype)
+
+    def asnumpy(self, array):
+        return array
+
+    @staticmethod
+    def flat_index(x, y, pad_size, height, width):
+        # Row of each (batch, x, y) pixel in a padded batch flattened to [B * Hp * Wp, C]
+        batch_size = x.shape[0]
+        padded_height, padded_width = height + pad_size * 2, width + pad_size * 2
+        batch_offset = torch.arange(batch_size).view(-1, 1, 1) * (padded_height * padded_width)
+        return (batch_offset + (x + pad_size) * padded_width + (y + pad_size)).reshape(-1)
+
+    def remap(self, height, width, channel, patch_size, pad_size, source, nnf):
+        batch_size = source.shape[0]
+        r = (patch_size - 1) // 2
+        padded_width = width + pad_size * 2
+        source = torch.from_numpy(np.ascontiguousarray(source)).reshape(-1, channel)
+        nnf = torch.from_numpy(np.ascontiguousarray(nnf)).long()
+        # Pad the nnf with an out-of-range marker so that neighbours outside the image never vote
+        nnf_padded = torch.full((batch_size, height + r * 2, width + r * 2, 2), -height - width - r * 4, dtype=torch.long)
+        nnf_padded[:, r: r + height, r: r + width] = nnf
+        target = torch.zeros((batch_size * height * width, channel), dtype=torch.float32)
+        num = torch.zeros((batch_size * height * width, 1), dtype=torch.float32)
+        for px in range(-r, r + 1):
+            for py in range(-r, r + 1):
+                # Neighbour (x + px, y + py) votes for source pixel nnf[x + px, y + py] - (px, py)
+                nnf_neighbour = nnf_padded[:, r + px: r + px + height, r + py: r + py + width]
+                x_ = nnf_neighbour[..., 0] - px
+                y_ = nnf_neighbour[..., 1] - py
+                valid = ((x_ >= 0) & (y_ >= 0) & (x_ < height) & (y_ < width)).reshape(-1, 1)
+                index = self.flat_index(x_.clamp(0, height - 1), y_.clamp(0, width - 1), pad_size, height, width)
+                target += torch.index_select(source, 0, index) * valid
+                num += valid
+        target = (target / num).reshape(batch_size, height, width, channel)
+        target_padded = np.zeros((batch_size, height + pad_size * 2, width + pad_size * 2, channel), dtype=np.float32)
+        target_padded[:, pad_size: pad_size + height, pad_size: pad_size + width] = target.numpy()
+        return target_padded
+
+    def accumulate_patch_error(self, height, width, channel, patch_size, pad_size, image_a, index_a, image_b, index_b):
+        # image_a and image_b: padded batches flattened to [B * Hp * Wp, C]
+        # index_a: row index of each patch centre in image_a, or None for the identity mapping
+        batch_size = image_b.shape[0] // ((height + pad_size * 2) * (width + pad_size * 2))
+        r = (patch_size - 1) // 2
+        padded_width = width + pad_size * 2
+        error = torch.zeros((batch_size * height * width, channel), dtype=torch.float32)
+        image_a_padded = image_a.view(batch_size, height + pad_size * 2, padded_width, channel)
+        for px in range(-r, r + 1):
+            for py in range(-r, r + 1):
+                offset = px * padded_width + py
+                if index_a is None:
+                    patch_a = image_a_padded[:, pad_size + px: pad_size + px + height, pad_size + py: pad_size + py + width].reshape(-1, channel)
+                else:
+                    patch_a = torch.index_select(image_a, 0, index_a + offset)
+                error += (patch_a - torch.index_select(image_b, 0, index_b + offset)).square_()
+        return error.sum(dim=-1).reshape(batch_size, height, width).numpy()
+
+    def patch_error(self, height, width, channel, patch_size, pad_size, source, nnf, target):
+        source = torch.from_numpy(np.ascontiguousarray(source)).reshape(-1, channel)
+        target = torch.from_numpy(np.ascontiguousarray(target)).reshape(-1, channel)
+        nnf = torch.from_numpy(np.ascontiguousarray(nnf)).long()
+        index_source = self.flat_index(nnf[..., 0], nnf[..., 1], pad_size, height, width)
+        return self.accumulate_patch_error(height, width, channel, patch_size, pad_size, target, None, source, index_source)
+
+    def pairwise_patch_error(self, height, width, channel, patch_size, pad_size, source_a, nnf_a, source_b, nnf_b):
+        source_a = torch.from_numpy(np.ascontiguousarray(source_a)).reshape(-1, channel)
+        source_b = torch.from_numpy(np.ascontiguousarray(source_b)).reshape(-1, channel)
+        nnf_a = torch.from_numpy(np.ascontiguousarray(nnf_a)).long()
+        nnf_b = torch.from_numpy(np.ascontiguousarray(nnf_b)).long()
+        index_a = self.flat_index(nnf_a[..., 0], nnf_a[..., 1], pad_size, height, width)
+        index_b = self.flat_index(nnf_b[..., 0], nnf_b[..., 1], pad_size, height, width)
+        return self.accumulate_patch_error(height, width, channel, patch_size, pad_size, source_a, index_a, source_b, index_b)
+
+    def release_memory(self):
+        pass
+
+
+def cupy_is_available():
+    try:
+        import cupy
+        return cupy.cuda.runtime.getDeviceCount() > 0
+    except Exception:
+        return False
+
+
+def get_backend(backend="auto", gpu_id=0, threads_per_block=8):
+    """
+    Args:
+        backend (str or object): "cupy", "cpu", "auto" (CuPy if a CUDA device is usable, otherwise CPU),
+            or an object implementing the same methods as CupyBackend.
+    """
+    if not isinstance(backend, str):
+        return backend
+    if backend == "auto":
+        backend = "cupy" if cupy_is_available() else "cpu"
+    if backend == "cupy":
+        return CupyBackend(gpu_id=gpu_id, threads_per_block=threads_per_block)
+    elif backend == "cpu":
+        return CPUBackend()
+    else:
+        raise ValueError(f"Unknown FastBlend backend: {backend}")
@@ -1,39 +1,263 @@
-from huggingface_hub import hf_hub_download
-from modelscope import snapshot_download
-import os, shutil
+import os, json, time, hashlib, threading, urllib.request, urllib.error, urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 from typing_extensions import Literal, TypeAlias
 from typing import List
 from ..configs.model_config import preset_models_on_huggingface, preset_models_on_modelscope, Preset_model_id
 
 
+def modelscope_url(model_id, origin_file_path):
+    endpoint = os.environ.get("MODELSCOPE_DOMAIN", "www.modelscope.cn")
+    endpoint = endpoint if "://" in endpoint else f"https://{endpoint}"
+    return f"{endpoint}/models/{model_id}/resolve/master/{origin_file_path}"
+
+
+def huggingface_url(model_id, origin_file_path):
+    endpoint = os.environ.get("HF_ENDPOINT", "https://huggingface.co")
+    return f"{endpoint}/{model_id}/resolve/main/{origin_file_path}"
+
+
+def huggingface_headers():
+    token = os.environ.get("HF_TOKEN")
+    return {"Authorization": f"Bearer {token}"} if token else {}
+
+
+website_to_url_fn = {
+    "HuggingFace": huggingface_url,
+    "ModelScope": modelscope_url,
+}
+website_to_headers_fn = {
+    "HuggingFace": huggingface_headers,
+    "ModelScope": dict,
+}
+
+
+def file_sha256(file_path, chunk_size=16 * 1024 * 1024):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class NoRedirectHandler(urllib.request.HTTPRedirectHandler):
+    # Redirects are raised as HTTPError, so that the headers of the redirect response can be read
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class DownloadManager:
+    """
+    Downloads model files concurrently and records their size and sha256 in a manifest.
+
+    A file is written to `<name>.part`, resumed from there after an interruption, and renamed
+    to its final name only when its size and hash match the expected ones. The expected size
+    and hash come from the manifest or from the server (see remote_file_info). A file that is
+    present but has a different size than its manifest entry, or than the remote file if it has
+    no manifest entry, is downloaded again.
+
+    Args:
+        manifest_path (str): JSON file mapping local file paths to {"size", "sha256", "url"}
+        max_workers (int): Files downloaded at the same time
+        url_fns (dict): Website name to a function (model_id, origin_file_path) -> url.
+            Tests can point these at file:// URLs or a local HTTP server.
+    """
+    def __init__(self, manifest_path="models/download_manifest.json", max_workers=4, url_fns=None, headers_fns=None, chunk_size=8 * 1024 * 1024, retries=3):
+        self.manifest_path = manifest_path
+        self.max_workers = max_workers
+        self.url_fns = url_fns or website_to_url_fn
+        self.headers_fns = headers_fns or website_to_headers_fn
+        self.chunk_size = chunk_size
+        self.retries = retries
+        self.lock = threading.Lock()
+        self.manifest = {}
+        if manifest_path is not None and os.path.exists(manifest_path):
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                self.manifest = json.load(f)
+
+
+    def save_manifest(self):
+        if self.manifest_path is None:
+            return
+        with self.lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.manifest_path)), exist_ok=True)
+            with open(self.manifest_path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(self.manifest, f, indent=4, sort_keys=True)
+            os.replace(self.manifest_path + ".tmp", self.manifest_path)
+
+
+    def remote_file_info(self, url, headers):
+        """
+        Reads the size and sha256 of a remote file with a HEAD request that does not follow redirects.
+
+        HuggingFace answers Git LFS files with a redirect to its CDN that carries X-Linked-Size and
+        X-Linked-Etag (the sha256); these headers are not on the redirected response. Other files
+        report their Content-Length, after following redirects.
+
+        Returns:
+            dict: {"size", "sha256"}, either may be None, or None if the server cannot be reached
+        """
+        opener = urllib.request.build_opener(NoRedirectHandler)
+        try:
+            response = opener.open(urllib.request.Request(url, headers=headers, method="HEAD"), timeout=60)
+        except urllib.error.HTTPError as e:
+            if e.code not in (301, 302, 303, 307, 308):
+                return None
+            response = e
+        except (urllib.error.URLError, OSError, ValueError):
+            return None
+        with response:
+            linked_size = response.headers.get("X-Linked-Size")
+            linked_etag = response.headers.get("X-Linked-Etag", "").strip('"')
+            sha256 = linked_etag if len(linked_etag) == 64 else None
+            if linked_size is not None:
+                return {"size": int(linked_size), "sha256": sha256}
+            location = response.headers.get("Location")
+            if location is not None:
+                # A redirect without the linked headers, the size is on the target
+                request = urllib.request.Request(urllib.parse.urljoin(url, location), headers=headers, method="HEAD")
+                try:
+                    with urllib.request.urlopen(request, timeout=60) as redirected:
+                        content_length = redirected.headers.get("Content-Length")
+                except (urllib.error.URLError, OSError, ValueError):
+                    return None
+            else:
+                content_length = response.headers.get("Content-Length")
+        return {"size": int(content_length) if content_length is not None else None, "sha256": sha256}
+
+
+    def is_complete(self, file_path, remote_info=None):
+        if not os.path.exists(file_path):
+            return False
+        entry = self.manifest.get(file_path)
+        if entry is not None and entry.get("size") is not None:
+            return entry["size"] == os.path.getsize(file_path)
+        if remote_info is not None and remote_info["size"] is not None:
+            # Files downloaded before the manifest existed may have been truncated
+            return remote_info["size"] == os.path.getsize(file_path)
+        # Unknown remote size (e.g. offline), the file is trusted
+        return True
+
+
+    def open_url(self, url, headers, offset):
+        request = urllib.request.Request(url, headers=headers)
+        if offset > 0:
+            request.add_header("Range", f"bytes={offset}-")
+        try:
+            return urllib.request.urlopen(request, timeout=60)
+        except urllib.error.HTTPError as e:
+            if e.code == 416 and offset > 0:
+                # The partial file is already complete, or longer than the remote file
+                return None
+            raise
+
+
+    def fetch(self, url, headers, file_path, expected_sha256=None, expected_size=None):
+        part_path = file_path + ".part"
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        response = self.open_url(url, headers, offset)
+        if response is None:
+            total_size = offset
+        else:
+            with response:
+                # file:// URLs and some mirrors ignore the Range header and send the whole file
+                resumed = offset > 0 and getattr(response, "status", None) == 206
+                if not resumed:
+                    offset = 0
+                content_length = response.headers.get("Content-Length")
+                total_size = offset + int(content_length) if content_length is not None else None
+                if offset > 0:
+                    print(f"    Resuming {file_path} from {offset / 1024**2:.1f} MB")
+                with open(part_path, "ab" if resumed else "wb") as f:
+                    for chunk in iter(lambda: response.read(self.chunk_size), b""):
+                        f.write(chunk)
+        size = os.path.getsize(part_path)
+        total_size = expected_size if expected_size is not None else total_size
+        if total_size is not None and size != total_size:
+            if size > total_size:
+                os.remove(part_path)
+            raise IOError(f"{file_path} is incomplete: {size} of {total_size} bytes")
+        sha256 = file_sha256(part_path)
+        if expected_sha256 is not None and sha256 != expected_sha256:
+            os.remove(part_path)
+            raise IOError(f"{file_path} has sha256 {sha256}, expected {expected_sha256}")
+        os.replace(part_path, file_path)
+        return {"size": size, "sha256": sha256, "url": url}
+
+
+    def download_file(self, website, model_id, origin_file_path, local_dir):
+        """
+        Returns:
+            str: The local file path, or None if the download failed
+        """
+        file_path = os.path.join(local_dir, os.path.basename(origin_file_path))
+        url = self.url_fns[website](model_id, origin_file_path)
+        entry = self.manifest.get(file_path)
+        remote_info = None
+        if entry is None or entry.get("size") is None:
+            remote_info = self.remote_file_info(url, self.headers_fns[website]())
+        if self.is_complete(file_path, remote_info):
+            print(f"    {os.path.basename(file_path)} has been already in {local_dir}.")
+            if entry is None and remote_info is not None and remote_info["size"] is not None:
+                # Recorded so that the remote is not asked again, verify() checks the hash
+                with self.lock:
+                    self.manifest[file_path] = {**remote_info, "url": url}
+                self.save_manifest()
+            return file_path
+        if os.path.exists(file_path):
+            print(f"    {file_path} does not match the size of the remote file")
+        os.makedirs(local_dir, exist_ok=True)
+        expected_sha256 = (entry or {}).get("sha256") or (remote_info or {}).get("sha256")
+        expected_size = (remote_info or {}).get("size")
+        print(f"    Start downloading {file_path}")
+        for attempt in range(self.retries):
+            try:
+                start_time = time.time()
+                entry = self.fetch(url, self.headers_fns[website](), file_path, expected_sha256, expected_size)
+                print(f"    Downloaded {file_path} ({entry['size'] / 1024**2:.1f} MB in {time.time() - start_time:.1f}s)")
+                with self.lock:
+                    self.manifest[file_path] = entry
+                self.save_manifest()
+                return file_path
+            except Exception as e:
+                print(f"    Error downloading {file_path} from {website} (attempt {attempt + 1}/{self.retries}): {str(e)}")
+                if isinstance(e, urllib.error.HTTPError) and e.code in (401, 403, 404):
+                    break
+        return None
+
+
+    def download_files(self, website, file_data):
+        """
+        Downloads a list of (model_id, origin_file_path, local_dir) concurrently.
+
+        Returns:
+            list: The local path of each file in order, None where the download failed
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(lambda data: self.download_file(website, *data), file_data))
+
+
+    def verify(self, file_paths=None):
+        """
+        Re-hashes downloaded files and returns the paths that do not match the manifest.
+        """
+        mismatched = []
+        for file_path in file_paths if file_paths is not None else list(self.manifest):
+            entry = self.manifest.get(file_path)
+            if entry is None or not os.path.exists(file_path):
+                continue
+            if os.path.getsize(file_path) != entry.get("size"):
+                mismatched.append(file_path)
+            elif entry.get("sha256") is not None and file_sha256(file_path) != entry["sha256"]:
+                mismatched.append(file_path)
+        return mismatched
+
+
 def download_from_modelscope(model_id, origin_file_path, local_dir):
-    os.makedirs(local_dir, exist_ok=True)
-    file_name = os.path.basename(origin_file_path)
-    if file_name in os.listdir(local_dir):
-        print(f"    {file_name} has been already in {local_dir}.")
-    else:
-        print(f"    Start downloading {os.path.join(local_dir, file_name)}")
-        snapshot_download(model_id, allow_file_pattern=origin_file_path, local_dir=local_dir)
-        downloaded_file_path = os.path.join(local_dir, origin_file_path)
-        target_file_path = os.path.join(local_dir, os.path.split(origin_file_path)[-1])
-        if downloaded_file_path != target_file_path:
-            shutil.move(downloaded_file_path, target_file_path)
-            shutil.rmtree(os.path.join(local_dir, origin_file_path.split("/")[0]))
+    DownloadManager().download_file("ModelScope", model_id, origin_file_path, local_dir)
 
 
 def download_from_huggingface(model_id, origin_file_path, local_dir):
-    os.makedirs(local_dir, exist_ok=True)
-    file_name = os.path.basename(origin_file_path)
-    if file_name in os.listdir(local_dir):
-        print(f"    {file_name} has been already in {local_dir}.")
-    else:
-        print(f"    Start downloading {os.path.join(local_dir, file_name)}")
-        hf_hub_download(model_id, origin_file_path, local_dir=local_dir)
-        downloaded_file_path = os.path.join(local_dir, origin_file_path)
-        target_file_path = os.path.join(local_dir, file_name)
-        if downloaded_file_path != target_file_path:
-            shutil.move(downloaded_file_path, target_file_path)
-            shutil.rmtree(os.path.join(local_dir, origin_file_path.split("/")[0]))
+    DownloadManager().download_file("HuggingFace", model_id, origin_file_path, local_dir)
 
 
 Preset_model_website: TypeAlias = Literal[
@@ -56,56 +280,50 @@ def download_customized_models(
     local_dir,
     downloading_priority: List[Preset_model_website] = ["ModelScope", "HuggingFace"],
 ):
-    downloaded_files = []
+    manager = DownloadManager()
     for website in downloading_priority:
-        # Check if the file is downloaded.
-        file_to_download = os.path.join(local_dir, os.path.basename(origin_file_path))
-        if file_to_download in downloaded_files:
-            continue
-        # Download
-        website_to_download_fn[website](model_id, origin_file_path, local_dir)
-        if os.path.basename(origin_file_path) in os.listdir(local_dir):
-            downloaded_files.append(file_to_download)
-    return downloaded_files
+        file_path = manager.download_file(website, model_id, origin_file_path, local_dir)
+        if file_path is not None:
+            return [file_path]
+    return []
 
 
 def download_models(
     model_id_list: List[Preset_model_id] = [],
     downloading_priority: List[Preset_model_website] = ["ModelScope", "HuggingFace"],
+    max_workers=4,
 ):
     print(f"Downloading models: {model_id_list}")
-    downloaded_files = []
+    manager = DownloadManager(max_workers=max_workers)
     load_files = []
 
-    for model_id in model_id_list:
-        for website in downloading_priority:
+    # Every model is first tried on its preferred website, the failed ones on the next website
+    pending = list(model_id_list)
+    for website in downloading_priority:
+        jobs = []
+        for model_id in pending:
             if model_id in website_to_preset_models[website]:
-                
                 # Parse model metadata
                 model_metadata = website_to_preset_models[website][model_id]
                 if isinstance(model_metadata, list):
                     file_data = model_metadata
                 else:
                     file_data = model_metadata.get("file_list", [])
+                jobs.append((model_id, model_metadata, file_data))
 
-                # Try downloading the model from this website.
-                model_files = []
-                for model_id, origin_file_path, local_dir in file_data:
-                    # Check if the file is downloaded.
-                    file_to_download = os.path.join(local_dir, os.path.basename(origin_file_path))
-                    if file_to_download in downloaded_files:
-                        continue
-                    # Download
-                    website_to_download_fn[website](model_id, origin_file_path, local_dir)
-                    if os.path.basename(origin_file_path) in os.listdir(local_dir):
-                        downloaded_files.append(file_to_download)
-                        model_files.append(file_to_download)
-                
-                # If the model is successfully downloaded, break.
-                if len(model_files) > 0:
-                    if isinstance(model_metadata, dict) and "load_path" in model_metadata:
-                        model_files = model_metadata["load_path"]
-                    load_files.extend(model_files)
-                    break
-                
+        # Download the files of all models together, files shared by models only once
+        unique_file_data = list(dict.fromkeys(tuple(data) for _, _, file_data in jobs for data in file_data))
+        results = dict(zip(unique_file_data, manager.download_files(website, unique_file_data)))
+
+        for model_id, model_metadata, file_data in jobs:
+            model_files = [results[tuple(data)] for data in file_data]
+            # If the model is successfully downloaded, it is not tried on the next website.
+            if len(model_files) > 0 and None not in model_files:
+                if isinstance(model_metadata, dict) and "load_path" in model_metadata:
+                    model_files = model_metadata["load_path"]
+                load_files.extend(file_path for file_path in model_files if file_path not in load_files)
+                pending.remove(model_id)
+
+    if len(pending) > 0:
+        print(f"Failed to download models: {pending}")
     return load_files
@@ -12,6 +12,57 @@ def interact_with_ipadapter(hidden_states, q, ip_k, ip_v, scale=1.0):
     return hidden_states
 
 
+class EntityAttentionMask:
+    """
+    Block-structured attention mask of EliGen entity control.
+
+    The sequence is [entity prompt 1, ..., entity prompt N, global prompt, image]. A prompt attends
+    to itself and to the image tokens of its entity. An image token attends to the whole image and
+    to the prompts of the entities that cover it. Tokens with the same allowed keys form a group,
+    computed by one unmasked attention call, so the cost grows linearly with the number of
+    entities instead of quadratically with the length of the sequence.
+
+    Args:
+        image_masks (torch.Tensor): bool [batch_size, num_prompts, image_seq_len], the image tokens of each prompt
+        prompt_seq_len (int): Number of tokens of each prompt
+    """
+    def __init__(self, image_masks, prompt_seq_len):
+        batch_size, num_prompts, image_seq_len = image_masks.shape
+        device = image_masks.device
+        image_start = num_prompts * prompt_seq_len
+        image_ids = torch.arange(image_start, image_start + image_seq_len, device=device)
+        prompt_ids = [torch.arange(i * prompt_seq_len, (i + 1) * prompt_seq_len, device=device) for i in range(num_prompts)]
+        self.groups = []
+        for batch_id in range(batch_size):
+            groups = []
+            for i in range(num_prompts):
+                groups.append((prompt_ids[i], torch.cat([prompt_ids[i], image_ids[image_masks[batch_id, i]]])))
+            # Image tokens covered by the same set of entities
+            signatures, inverse = torch.unique(image_masks[batch_id].T, dim=0, return_inverse=True)
+            for signature_id, signature in enumerate(signatures):
+                key_ids = [prompt_ids[i] for i in range(num_prompts) if signature[i]] + [image_ids]
+                groups.append((image_ids[inverse == signature_id], torch.cat(key_ids)))
+            self.groups.append(groups)
+
+
+    def attention(self, q, k, v):
+        # q, k, v: [batch_size, num_heads, seq_len, head_dim]
+        output = torch.empty_like(q)
+        for batch_id, groups in enumerate(self.groups):
+            q_, k_, v_ = q[batch_id: batch_id + 1], k[batch_id: batch_id + 1], v[batch_id: batch_id + 1]
+            for query_ids, key_ids in groups:
+                output[batch_id: batch_id + 1, :, query_ids] = torch.nn.functional.scaled_dot_product_attention(
+                    q_[:, :, query_ids], k_[:, :, key_ids], v_[:, :, key_ids]
+                )
+        return output
+
+
+def flux_attention(q, k, v, attn_mask=None):
+    if isinstance(attn_mask, EntityAttentionMask):
+        return attn_mask.attention(q, k, v)
+    return torch.nn.functional.scaled_dot_product_attention(q, k, v, attn_mask=attn_mask)
+
+
 class RoPEEmbedding(torch.nn.Module):
     def __init__(self, dim, theta, axes_dim):
         super().__init__()
@@ -91,7 +142,7 @@ class FluxJointAttention(torch.nn.Module):
 
         q, k = self.apply_rope(q, k, image_rotary_emb)
 
-        hidden_states = torch.nn.functional.scaled_dot_product_attention(q, k, v, attn_mask=attn_mask)
+        hidden_states = flux_attention(q, k, v, attn_mask=attn_mask)
         hidden_states = hidden_states.transpose(1, 2).reshape(batch_size, -1, self.num_heads * self.head_dim)
         hidden_states = hidden_states.to(q.dtype)
         hidden_states_b, hidden_states_a = hidden_states[:, :hidden_states_b.shape[1]], hidden_states[:, hidden_states_b.shape[1]:]
@@ -235,7 +286,7 @@ class FluxSingleTransformerBlock(torch.nn.Module):
 
         q, k = self.apply_rope(q, k, image_rotary_emb)
 
-        hidden_states = torch.nn.functional.scaled_dot_product_attention(q, k, v, attn_mask=attn_mask)
+        hidden_states = flux_attention(q, k, v, attn_mask=attn_mask)
         hidden_states = hidden_states.transpose(1, 2).reshape(batch_size, -1, self.num_heads * self.head_dim)
         hidden_states = hidden_states.to(q.dtype)
         if ipadapter_kwargs_list is not None:
@@ -373,23 +424,26 @@ class FluxDiT(torch.nn.Module):
         return attention_mask
 
 
+    def construct_block_mask(self, entity_masks, prompt_seq_len):
+        # Built once per generation and reused by every denoising step
+        cache = getattr(self, "entity_mask_cache", None)
+        if cache is None or cache[1] != prompt_seq_len or cache[0].shape != entity_masks.shape \
+            or cache[0].device != entity_masks.device or not torch.equal(cache[0], entity_masks):
+            image_masks = torch.stack([self.patchify(entity_masks[:, i]).sum(dim=-1) > 0 for i in range(entity_masks.shape[1])], dim=1)
+            global_mask = torch.ones_like(image_masks[:, :1]) # append global to last
+            attention_mask = EntityAttentionMask(torch.cat([image_masks, global_mask], dim=1), prompt_seq_len)
+            self.entity_mask_cache = (entity_masks.clone(), prompt_seq_len, attention_mask)
+        return self.entity_mask_cache[2]
+
+
     def process_entity_masks(self, hidden_states, prompt_emb, entity_prompt_emb, entity_masks, text_ids, image_ids):
-        repeat_dim = hidden_states.shape[1]
         max_masks = 0
         attention_mask = None
         prompt_embs = [prompt_emb]
         if entity_masks is not None:
-            # entity_masks
             batch_size, max_masks = entity_masks.shape[0], entity_masks.shape[1]
-            entity_masks = entity_masks.repeat(1, 1, repeat_dim, 1, 1)
-            entity_masks = [entity_masks[:, i, None].squeeze(1) for i in range(max_masks)]
-            # global mask
-            global_mask = torch.ones_like(entity_masks[0]).to(device=hidden_states.device, dtype=hidden_states.dtype)
-            entity_masks = entity_masks + [global_mask] # append global to last
             # attention mask
-            attention_mask = self.construct_mask(entity_masks, prompt_emb.shape[1], hidden_states.shape[1])
-            attention_mask = attention_mask.to(device=hidden_states.device, dtype=hidden_states.dtype)
-            attention_mask = attention_mask.unsqueeze(1)
+            attention_mask = self.construct_block_mask(entity_masks.to(device=hidden_states.device), prompt_emb.shape[1])
             # embds: n_masks * b * seq * d
             local_embs = [entity_prompt_emb[:, i, None].squeeze(1) for i in range(max_masks)]
             prompt_embs = local_embs + prompt_embs # append global to last
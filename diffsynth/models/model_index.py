@@ -0,0 +1,100 @@
+import os, json, time
+from concurrent.futures import ProcessPoolExecutor
+
+
+def get_file_fingerprint(file_path):
+    stat = os.stat(file_path)
+    return {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+
+
+class ModelDetectionIndex:
+    """
+    On-disk index of model detection results keyed by (path, size, mtime).
+
+    Each entry records which detector recognised the file, the keys hash it matched,
+    and the model names/classes and resource type, so that repeated startups can go
+    straight to the right loader without hashing the state dict again.
+    """
+    def __init__(self, index_path, signature=None):
+        self.index_path = index_path
+        self.signature = signature
+        self.entries = {}
+        self.dirty = False
+        self.load()
+
+
+    def load(self):
+        if not os.path.isfile(self.index_path):
+            return
+        try:
+            with open(self.index_path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            print(f"    Model index {self.index_path} is unreadable and will be rebuilt.")
+            return
+        # Entries are only valid for the model configs they were detected with
+        if data.get("signature") == self.signature:
+            self.entries = data.get("entries", {})
+
+
+    def save(self):
+        if not self.dirty:
+            return
+        folder = os.path.dirname(self.index_path)
+        if folder != "":
+            os.makedirs(folder, exist_ok=True)
+        temp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"signature": self.signature, "entries": self.entries}, f, indent=1)
+        os.replace(temp_path, self.index_path)
+        self.dirty = False
+
+
+    def lookup(self, file_path):
+        if not isinstance(file_path, str) or not os.path.isfile(file_path):
+            return None
+        entry = self.entries.get(os.path.abspath(file_path))
+        if entry is None or entry["fingerprint"] != get_file_fingerprint(file_path):
+            return None
+        return entry["detection"]
+
+
+    def update(self, file_path, detection, fingerprint=None):
+        if fingerprint is None:
+            fingerprint = get_file_fingerprint(file_path)
+        self.entries[os.path.abspath(file_path)] = {"fingerprint": fingerprint, "detection": detection}
+        self.dirty = True
+
+
+    def scan(self, folder, detect_fn, extensions=(".safetensors", ".bin", ".ckpt", ".pth", ".pt"), num_workers=None):
+        """
+        Detects every model file under a folder in parallel worker processes.
+
+        Args:
+            folder (str): Root folder to scan, e.g. "models".
+            detect_fn (callable): A picklable top-level function mapping a file path to a detection dict.
+            extensions (tuple): File extensions to consider.
+            num_workers (int): Number of worker processes. Defaults to the CPU count.
+
+        Returns:
+            dict: The detection results of the files that were not yet indexed.
+        """
+        file_paths = []
+        for root, _, file_names in os.walk(folder):
+            for file_name in sorted(file_names):
+                file_path = os.path.join(root, file_name)
+                if file_name.endswith(extensions) and self.lookup(file_path) is None:
+                    file_paths.append(file_path)
+        if len(file_paths) == 0:
+            return {}
+        print(f"Scanning {len(file_paths)} model files in {folder}")
+        start_time = time.time()
+        results = {}
+        fingerprints = {file_path: get_file_fingerprint(file_path) for file_path in file_paths}
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            for file_path, detection in zip(file_paths, executor.map(detect_fn, file_paths)):
+                self.update(file_path, detection, fingerprint=fingerprints[file_path])
+                results[file_path] = detection
+        self.save()
+        print(f"    Scanned {len(file_paths)} model files in {time.time() - start_time:.2f}s.")
+        return results
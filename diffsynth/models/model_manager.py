@@ -1,4 +1,4 @@
-import os, torch, json, importlib
+import os, torch, json, importlib, hashlib
 from typing import List
 
 from .downloader import download_models, download_customized_models, Preset_model_id, Preset_model_website
@@ -51,23 +51,38 @@ from ..extensions.ESRGAN import RRDBNet
 
 from ..configs.model_config import model_loader_configs, huggingface_model_loader_configs, patch_model_loader_configs
 from .utils import load_state_dict, init_weights_on_device, hash_state_dict_keys, split_state_dict_with_prefix
+from .model_index import ModelDetectionIndex
+from .state_dict_cache import load_converted_state_dict, save_converted_state_dict, get_converter_version
 
 
-def load_model_from_single_file(state_dict, model_names, model_classes, model_resource, torch_dtype, device):
+def load_model_from_single_file(state_dict, model_names, model_classes, model_resource, torch_dtype, device, file_path=None):
+    # If file_path is given, converted state dicts are cached next to it and reused while the file is unchanged
     loaded_model_names, loaded_models = [], []
     for model_name, model_class in zip(model_names, model_classes):
         print(f"    model_name: {model_name} model_class: {model_class.__name__}")
-        state_dict_converter = model_class.state_dict_converter()
-        if model_resource == "civitai":
-            state_dict_results = state_dict_converter.from_civitai(state_dict)
-        elif model_resource == "diffusers":
-            state_dict_results = state_dict_converter.from_diffusers(state_dict)
-        if isinstance(state_dict_results, tuple):
-            model_state_dict, extra_kwargs = state_dict_results
-            print(f"        This model is initialized with extra kwargs: {extra_kwargs}")
+        converter_version = get_converter_version(model_class) if file_path is not None else None
+        cached_results = load_converted_state_dict(file_path, model_name, torch_dtype, converter_version) if file_path is not None else None
+        if cached_results is not None:
+            model_state_dict, extra_kwargs = cached_results
+            print(f"        Using the cached converted state dict.")
         else:
-            model_state_dict, extra_kwargs = state_dict_results, {}
+            state_dict_converter = model_class.state_dict_converter()
+            if model_resource == "civitai":
+                state_dict_results = state_dict_converter.from_civitai(state_dict)
+            elif model_resource == "diffusers":
+                state_dict_results = state_dict_converter.from_diffusers(state_dict)
+            if isinstance(state_dict_results, tuple):
+                model_state_dict, extra_kwargs = state_dict_results
+                print(f"        This model is initialized with extra kwargs: {extra_kwargs}")
+            else:
+                model_state_dict, extra_kwargs = state_dict_results, {}
+        cache_torch_dtype = torch_dtype
         torch_dtype = torch.float32 if extra_kwargs.get("upcast_to_float32", False) else torch_dtype
+        if cached_results is None and file_path is not None:
+            cached_state_dict = save_converted_state_dict(
+                file_path, model_name, cache_torch_dtype, converter_version, state_dict, model_state_dict, extra_kwargs, target_dtype=torch_dtype)
+            if cached_state_dict is not None:
+                model_state_dict = cached_state_dict
         with init_weights_on_device():
             model = model_class(**extra_kwargs)
         if hasattr(model, "eval"):
@@ -173,6 +188,38 @@ class ModelDetectorFromSingleFile:
         return False
 
 
+    def describe(self, file_path="", state_dict={}):
+        if len(state_dict) == 0:
+            state_dict = load_state_dict(file_path)
+        keys_hash, with_shape = hash_state_dict_keys(state_dict, with_shape=True), True
+        if keys_hash not in self.keys_hash_with_shape_dict:
+            keys_hash, with_shape = hash_state_dict_keys(state_dict, with_shape=False), False
+        model_names, model_classes, model_resource = self.fetch_model_metadata(keys_hash, with_shape)
+        return {
+            "keys_hash": keys_hash,
+            "with_shape": with_shape,
+            "model_names": list(model_names),
+            "model_classes": [model_class.__name__ for model_class in model_classes],
+            "model_resource": model_resource,
+        }
+
+
+    def fetch_model_metadata(self, keys_hash, with_shape=True):
+        if with_shape:
+            return self.keys_hash_with_shape_dict[keys_hash]
+        else:
+            return self.keys_hash_dict[keys_hash]
+
+
+    def load_from_detection(self, file_path="", state_dict={}, detection={}, device="cuda", torch_dtype=torch.float16, cache_converted=False):
+        # The keys hash comes from the model index, so the state dict does not need to be hashed again
+        if len(state_dict) == 0:
+            state_dict = load_state_dict(file_path)
+        model_names, model_classes, model_resource = self.fetch_model_metadata(detection["keys_hash"], detection["with_shape"])
+        cache_file_path = file_path if cache_converted and isinstance(file_path, str) and os.path.isfile(file_path) else None
+        return load_model_from_single_file(state_dict, model_names, model_classes, model_resource, torch_dtype, device, file_path=cache_file_path)
+
+
     def load(self, file_path="", state_dict={}, device="cuda", torch_dtype=torch.float16, **kwargs):
         if len(state_dict) == 0:
             state_dict = load_state_dict(file_path)
@@ -201,6 +248,11 @@ class ModelDetectorFromSplitedSingleFile(ModelDetectorFromSingleFile):
         super().__init__(model_loader_configs)
 
 
+    def describe(self, file_path="", state_dict={}):
+        # Components are matched per prefix at load time
+        return {}
+
+
     def match(self, file_path="", state_dict={}):
         if isinstance(file_path, str) and os.path.isdir(file_path):
             return False
@@ -313,6 +365,39 @@ class ModelDetectorFromPatchedSingleFile:
 
 
 
+def default_model_detectors():
+    return [
+        ModelDetectorFromSingleFile(model_loader_configs),
+        ModelDetectorFromSplitedSingleFile(model_loader_configs),
+        ModelDetectorFromHuggingfaceFolder(huggingface_model_loader_configs),
+        ModelDetectorFromPatchedSingleFile(patch_model_loader_configs),
+    ]
+
+
+def model_detector_signature():
+    # Changes whenever a model config is added, so stale detection results are discarded
+    signature = [repr((config[0], config[1], config[2], [model_class.__name__ for model_class in config[3]], config[4])) for config in model_loader_configs]
+    signature += [repr(config[:3]) for config in huggingface_model_loader_configs]
+    signature += [repr((config[0], config[1], [model_class.__name__ for model_class in config[2]], config[3])) for config in patch_model_loader_configs]
+    return hashlib.md5("\n".join(signature).encode(encoding="UTF-8")).hexdigest()
+
+
+def detect_model_file(file_path, model_detectors=None, state_dict=None):
+    """Runs model detection on a file or folder and returns a JSON-serialisable result for the model index."""
+    if model_detectors is None:
+        model_detectors = default_model_detectors()
+    if state_dict is None and isinstance(file_path, str) and os.path.isfile(file_path):
+        state_dict = load_state_dict(file_path)
+    for model_detector in model_detectors:
+        if model_detector.match(file_path, state_dict):
+            detection = {"detector": type(model_detector).__name__}
+            if hasattr(model_detector, "describe"):
+                detection.update(model_detector.describe(file_path, state_dict))
+            return detection
+    return {"detector": None}
+
+
+
 class ModelManager:
     def __init__(
         self,
@@ -321,6 +406,8 @@ class ModelManager:
         model_id_list: List[Preset_model_id] = [],
         downloading_priority: List[Preset_model_website] = ["ModelScope", "HuggingFace"],
         file_path_list: List[str] = [],
+        model_index_path: str = "models/model_index.json",
+        cache_converted_state_dict: bool = True,
     ):
         self.torch_dtype = torch_dtype
         self.device = device
@@ -328,15 +415,19 @@ class ModelManager:
         self.model_path = []
         self.model_name = []
         downloaded_files = download_models(model_id_list, downloading_priority) if len(model_id_list) > 0 else []
-        self.model_detector = [
-            ModelDetectorFromSingleFile(model_loader_configs),
-            ModelDetectorFromSplitedSingleFile(model_loader_configs),
-            ModelDetectorFromHuggingfaceFolder(huggingface_model_loader_configs),
-            ModelDetectorFromPatchedSingleFile(patch_model_loader_configs),
-        ]
+        self.model_detector = default_model_detectors()
+        self.model_index = ModelDetectionIndex(model_index_path, signature=model_detector_signature()) if model_index_path is not None else None
+        self.cache_converted_state_dict = cache_converted_state_dict
         self.load_models(downloaded_files + file_path_list)
 
 
+    def scan_models(self, folder="models", num_workers=None):
+        """Pre-detects every model file under a folder in parallel so later loads skip detection."""
+        if self.model_index is None:
+            return {}
+        return self.model_index.scan(folder, detect_model_file, num_workers=num_workers)
+
+
     def load_model_from_single_file(self, file_path="", state_dict={}, model_names=[], model_classes=[], model_resource=None):
         print(f"Loading models from file: {file_path}")
         if len(state_dict) == 0:
@@ -393,28 +484,42 @@ class ModelManager:
         if device is None: device = self.device
         if torch_dtype is None: torch_dtype = self.torch_dtype
         if isinstance(file_path, list):
-            state_dict = {}
-            for path in file_path:
+            state_dict = load_state_dict(file_path[0])
+            for path in file_path[1:]:
                 state_dict.update(load_state_dict(path))
         elif os.path.isfile(file_path):
             state_dict = load_state_dict(file_path)
         else:
             state_dict = None
-        for model_detector in self.model_detector:
-            if model_detector.match(file_path, state_dict):
-                model_names, models = model_detector.load(
-                    file_path, state_dict,
-                    device=device, torch_dtype=torch_dtype,
-                    allowed_model_names=model_names, model_manager=self
-                )
-                for model_name, model in zip(model_names, models):
-                    self.model.append(model)
-                    self.model_path.append(file_path)
-                    self.model_name.append(model_name)
-                print(f"    The following models are loaded: {model_names}.")
-                break
+        detection = self.model_index.lookup(file_path) if self.model_index is not None else None
+        if detection is None:
+            detection = detect_model_file(file_path, self.model_detector, state_dict)
+            if self.model_index is not None and isinstance(file_path, str) and os.path.isfile(file_path):
+                self.model_index.update(file_path, detection)
+                self.model_index.save()
         else:
+            print(f"    Model type found in model index: {detection['detector']}")
+        if detection["detector"] is None:
             print(f"    We cannot detect the model type. No models are loaded.")
+            return
+        model_detector = [model_detector for model_detector in self.model_detector if type(model_detector).__name__ == detection["detector"]][0]
+        if "keys_hash" in detection:
+            model_names, models = model_detector.load_from_detection(
+                file_path, state_dict, detection,
+                device=device, torch_dtype=torch_dtype,
+                cache_converted=self.cache_converted_state_dict
+            )
+        else:
+            model_names, models = model_detector.load(
+                file_path, state_dict,
+                device=device, torch_dtype=torch_dtype,
+                allowed_model_names=model_names, model_manager=self
+            )
+        for model_name, model in zip(model_names, models):
+            self.model.append(model)
+            self.model_path.append(file_path)
+            self.model_name.append(model_name)
+        print(f"    The following models are loaded: {model_names}.")
         
 
     def load_models(self, file_path_list, model_names=None, device=None, torch_dtype=None):
@@ -0,0 +1,131 @@
+import os, sys, json, hashlib, inspect
+from safetensors.torch import save_file
+from .utils import LazySafetensorsStateDict
+
+
+def encode_extra_kwargs(extra_kwargs):
+    def encode(value):
+        if isinstance(value, tuple):
+            return {"__tuple__": [encode(i) for i in value]}
+        if isinstance(value, list):
+            return [encode(i) for i in value]
+        if isinstance(value, dict):
+            return {k: encode(v) for k, v in value.items()}
+        return value
+    return json.dumps(encode(extra_kwargs))
+
+
+def decode_extra_kwargs(extra_kwargs_str):
+    def object_hook(value):
+        if "__tuple__" in value:
+            return tuple(value["__tuple__"])
+        return value
+    return json.loads(extra_kwargs_str, object_hook=object_hook)
+
+
+def get_converted_cache_path(file_path, model_name, torch_dtype):
+    dtype_name = str(torch_dtype).split(".")[-1]
+    return f"{file_path}.{model_name}.{dtype_name}.converted"
+
+
+# Bump when the layout of the cache files changes
+CONVERTER_CACHE_VERSION = "1"
+
+
+def get_converter_version(model_class):
+    """
+    Hashes the source of the module that defines the state dict converter of model_class,
+    so that a changed converter (or a helper next to it) invalidates the caches it wrote.
+    """
+    converter_class = type(model_class.state_dict_converter())
+    try:
+        source = inspect.getsource(sys.modules[converter_class.__module__])
+    except (OSError, TypeError, KeyError):
+        source = converter_class.__qualname__
+    return hashlib.sha256(f"{CONVERTER_CACHE_VERSION}:{source}".encode()).hexdigest()
+
+
+def get_source_fingerprint(file_path, converter_version):
+    stat = os.stat(file_path)
+    return {"source_size": str(stat.st_size), "source_mtime": str(stat.st_mtime_ns), "converter_version": converter_version}
+
+
+def load_converted_state_dict(file_path, model_name, torch_dtype, converter_version):
+    """
+    Reads a converted state dict written by save_converted_state_dict.
+
+    Returns:
+        (state_dict, extra_kwargs), or None if there is no cache, or the source file or the converter has changed.
+    """
+    cache_path = get_converted_cache_path(file_path, model_name, torch_dtype)
+    if not os.path.isfile(cache_path):
+        return None
+    try:
+        with open(cache_path, "rb") as f:
+            header_size = int.from_bytes(f.read(8), "little")
+            metadata = json.loads(f.read(header_size)).get("__metadata__", {})
+    except (OSError, ValueError):
+        return None
+    for key, value in get_source_fingerprint(file_path, converter_version).items():
+        if metadata.get(key) != value:
+            print(f"        Converted cache {cache_path} is outdated.")
+            return None
+    return LazySafetensorsStateDict(cache_path), decode_extra_kwargs(metadata.get("extra_kwargs", "{}"))
+
+
+def is_zero_copy(source_state_dict, model_state_dict, torch_dtype):
+    # Converters that only rename keys produce views of the memory-mapped source, which is already as fast as a cache
+    if not isinstance(source_state_dict, LazySafetensorsStateDict):
+        return False
+    source_ptrs = set(tensor.data_ptr() for tensor in source_state_dict.values())
+    for tensor in model_state_dict.values():
+        if tensor.data_ptr() not in source_ptrs:
+            return False
+        if tensor.is_floating_point() and tensor.dtype != torch_dtype:
+            return False
+    return True
+
+
+def save_converted_state_dict(file_path, model_name, torch_dtype, converter_version, source_state_dict, model_state_dict, extra_kwargs, target_dtype=None):
+    """
+    Writes the converted state dict next to its source with the target dtype applied.
+
+    Args:
+        torch_dtype: The dtype requested by the caller, used to name the cache.
+        converter_version: get_converter_version of the model class, compared on load.
+        target_dtype: The dtype the weights are stored in. Defaults to torch_dtype.
+
+    Returns:
+        The cached state dict memory-mapped from disk, or None if nothing was written.
+    """
+    target_dtype = torch_dtype if target_dtype is None else target_dtype
+    if is_zero_copy(source_state_dict, model_state_dict, target_dtype):
+        return None
+    try:
+        extra_kwargs_str = encode_extra_kwargs(extra_kwargs)
+    except TypeError:
+        return None
+    state_dict, seen = {}, set()
+    for name, tensor in model_state_dict.items():
+        if tensor.is_floating_point():
+            tensor = tensor.to(target_dtype)
+        tensor = tensor.contiguous()
+        # safetensors refuses tensors sharing storage, e.g. slices of a fused qkv weight
+        if tensor.untyped_storage().data_ptr() in seen:
+            tensor = tensor.clone()
+        seen.add(tensor.untyped_storage().data_ptr())
+        state_dict[name] = tensor
+    cache_path = get_converted_cache_path(file_path, model_name, torch_dtype)
+    metadata = {"extra_kwargs": extra_kwargs_str, **get_source_fingerprint(file_path, converter_version)}
+    temp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        save_file(state_dict, temp_path, metadata=metadata)
+        os.replace(temp_path, cache_path)
+        print(f"        Converted state dict is cached in {cache_path}")
+    except (OSError, RuntimeError) as e:
+        print(f"        Cannot write converted cache {cache_path}: {e}")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return None
+    del state_dict
+    return LazySafetensorsStateDict(cache_path)
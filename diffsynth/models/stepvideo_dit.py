@@ -15,6 +15,7 @@ import torch, math
 from torch import nn
 from einops import rearrange, repeat
 from tqdm import tqdm
+from ..distributed.sequence_parallel import split_sequence, gather_sequence, sequence_parallel_attention
 
 
 class RMSNorm(nn.Module):
@@ -362,6 +363,18 @@ class Attention(nn.Module):
         x = rearrange(x, 'b h s d -> b s h d')
         return x        
 
+    def parallel_attn_func(
+        self,
+        q,
+        k,
+        v,
+        attn_mask=None,
+        max_seqlen=None,
+        **kwargs
+    ):
+        # q, k, v hold the tokens of this rank; max_seqlen is the length of the full sequence
+        return sequence_parallel_attention(self.torch_attn_func, q, k, v, seq_len=max_seqlen, attn_mask=attn_mask)
+
 
 class RoPE1D:
     def __init__(self, freq=1e4, F0=1.0, scaling_factor=1.0):
@@ -438,7 +451,7 @@ class RoPE3D(RoPE1D):
             cos, sin = self.get_cos_sin(D, int(mesh_grid.max()) + 1, tokens.device, tokens.dtype)
             
             if parallel:
-                pass
+                mesh = split_sequence(mesh_grid[:, :, i], dim=1)
             else:
                 mesh = mesh_grid[:, :, i].clone()
             x = self.apply_rope1d(x, mesh.to(tokens.device), cos, sin)
@@ -494,6 +507,9 @@ class SelfAttention(Attention):
         if self.with_rope:
             xq = self.apply_rope3d(xq, rope_positions, self.rope_ch_split, parallel=self.parallel)
             xk = self.apply_rope3d(xk, rope_positions, self.rope_ch_split, parallel=self.parallel)
+
+        if self.parallel and max_seqlen is None:
+            max_seqlen = math.prod(rope_positions)
             
         output = self.core_attention(
                     xq,
@@ -832,6 +848,13 @@ class StepVideoModel(torch.nn.Module):
         attn_mask=None,
         parallel=True
     ):
+        if parallel:
+            # Every rank runs the blocks on its part of the video tokens
+            seq_len = hidden_states.shape[1]
+            hidden_states = split_sequence(hidden_states, dim=1)
+            # The rows of the cross-attention mask are the same for every token
+            attn_mask = attn_mask[:, :hidden_states.shape[1]]
+
         for block in tqdm(self.transformer_blocks, desc="Transformer blocks"):
             hidden_states = block(
                 hidden_states,
@@ -841,6 +864,8 @@ class StepVideoModel(torch.nn.Module):
                 rope_positions=rope_positions
             )
 
+        if parallel:
+            hidden_states = gather_sequence(hidden_states, dim=1, seq_len=seq_len)
         return hidden_states
         
 
@@ -1,4 +1,5 @@
-import torch, os
+import torch, os, json, mmap, struct
+from collections.abc import MutableMapping
 from safetensors import safe_open
 from contextlib import contextmanager
 import hashlib
@@ -62,8 +63,10 @@ def load_state_dict_from_folder(file_path, torch_dtype=None):
     return state_dict
 
 
-def load_state_dict(file_path, torch_dtype=None):
+def load_state_dict(file_path, torch_dtype=None, lazy=True):
     if file_path.endswith(".safetensors"):
+        if lazy:
+            return LazySafetensorsStateDict(file_path, torch_dtype=torch_dtype)
         return load_state_dict_from_safetensors(file_path, torch_dtype=torch_dtype)
     else:
         return load_state_dict_from_bin(file_path, torch_dtype=torch_dtype)
@@ -80,7 +83,11 @@ def load_state_dict_from_safetensors(file_path, torch_dtype=None):
 
 
 def load_state_dict_from_bin(file_path, torch_dtype=None):
-    state_dict = torch.load(file_path, map_location="cpu", weights_only=True)
+    try:
+        # Zip-format checkpoints can be memory-mapped instead of read into RAM
+        state_dict = torch.load(file_path, map_location="cpu", weights_only=True, mmap=True)
+    except RuntimeError:
+        state_dict = torch.load(file_path, map_location="cpu", weights_only=True)
     if torch_dtype is not None:
         for i in state_dict:
             if isinstance(state_dict[i], torch.Tensor):
@@ -88,6 +95,119 @@ def load_state_dict_from_bin(file_path, torch_dtype=None):
     return state_dict
 
 
+SAFETENSORS_DTYPES = {
+    "F64": torch.float64, "F32": torch.float32, "F16": torch.float16, "BF16": torch.bfloat16,
+    "I64": torch.int64, "I32": torch.int32, "I16": torch.int16, "I8": torch.int8,
+    "U8": torch.uint8, "BOOL": torch.bool,
+}
+if hasattr(torch, "float8_e4m3fn"):
+    SAFETENSORS_DTYPES["F8_E4M3"] = torch.float8_e4m3fn
+    SAFETENSORS_DTYPES["F8_E5M2"] = torch.float8_e5m2
+
+
+def read_safetensors_header(file_path):
+    with open(file_path, "rb") as f:
+        header_size = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_size))
+    header.pop("__metadata__", None)
+    return header, 8 + header_size
+
+
+class LazySafetensorsStateDict(MutableMapping):
+    """
+    A state dict backed by memory-mapped safetensors files.
+
+    Only the headers are parsed on construction. Each tensor is created on access as a
+    zero-copy view of the mapped file (copy-on-write), so hashing keys, converting and
+    load_state_dict(assign=True) never hold a second copy of the weights.
+    Tensors assigned or merged from regular dicts are kept in memory as usual.
+    """
+    def __init__(self, file_path=None, torch_dtype=None):
+        self.torch_dtype = torch_dtype
+        self.tensor_info = {}
+        self.overrides = {}
+        self.mmaps = {}
+        if file_path is not None:
+            self.add_file(file_path)
+
+    def add_file(self, file_path):
+        header, data_offset = read_safetensors_header(file_path)
+        for name, info in header.items():
+            begin, end = info["data_offsets"]
+            self.tensor_info[name] = (file_path, info["dtype"], tuple(info["shape"]), data_offset + begin, data_offset + end)
+            self.overrides.pop(name, None)
+
+    def get_mmap(self, file_path):
+        if file_path not in self.mmaps:
+            with open(file_path, "rb") as f:
+                self.mmaps[file_path] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        return self.mmaps[file_path]
+
+    def get_meta_tensor(self, name):
+        if name in self.overrides:
+            return self.overrides[name].to("meta")
+        _, dtype, shape, _, _ = self.tensor_info[name]
+        return torch.empty(shape, dtype=SAFETENSORS_DTYPES[dtype], device="meta")
+
+    def meta_items(self):
+        """Yields (name, meta tensor) pairs carrying shapes and dtypes without touching tensor data"""
+        for name in self:
+            yield name, self.get_meta_tensor(name)
+
+    def subset(self, names):
+        state_dict = LazySafetensorsStateDict(torch_dtype=self.torch_dtype)
+        state_dict.mmaps = self.mmaps
+        for name in names:
+            if name in self.overrides:
+                state_dict.overrides[name] = self.overrides[name]
+            else:
+                state_dict.tensor_info[name] = self.tensor_info[name]
+        return state_dict
+
+    def update(self, other=(), **kwargs):
+        if isinstance(other, LazySafetensorsStateDict) and other.torch_dtype == self.torch_dtype:
+            self.mmaps.update(other.mmaps)
+            for name in other.tensor_info:
+                self.overrides.pop(name, None)
+            self.tensor_info.update(other.tensor_info)
+            self.overrides.update(other.overrides)
+            other = ()
+        super().update(other, **kwargs)
+
+    def __getitem__(self, name):
+        if name in self.overrides:
+            return self.overrides[name]
+        file_path, dtype, shape, begin, end = self.tensor_info[name]
+        dtype = SAFETENSORS_DTYPES[dtype]
+        if end == begin:
+            tensor = torch.empty(shape, dtype=dtype)
+        else:
+            tensor = torch.frombuffer(self.get_mmap(file_path), dtype=dtype, count=(end - begin) // dtype.itemsize, offset=begin).view(shape)
+        if self.torch_dtype is not None and self.torch_dtype != dtype:
+            tensor = tensor.to(self.torch_dtype)
+        return tensor
+
+    def __setitem__(self, name, value):
+        self.overrides[name] = value
+        self.tensor_info.pop(name, None)
+
+    def __delitem__(self, name):
+        if name in self.overrides:
+            del self.overrides[name]
+        else:
+            del self.tensor_info[name]
+
+    def __iter__(self):
+        yield from self.tensor_info
+        yield from self.overrides
+
+    def __len__(self):
+        return len(self.tensor_info) + len(self.overrides)
+
+    def __contains__(self, name):
+        return name in self.tensor_info or name in self.overrides
+
+
 def search_for_embeddings(state_dict):
     embeddings = []
     for k in state_dict:
@@ -147,7 +267,9 @@ def search_for_files(folder, extensions):
 
 def convert_state_dict_keys_to_single_str(state_dict, with_shape=True):
     keys = []
-    for key, value in state_dict.items():
+    # Lazy state dicts are hashed from their safetensors headers without reading tensor data
+    items = state_dict.meta_items() if isinstance(state_dict, LazySafetensorsStateDict) else state_dict.items()
+    for key, value in items:
         if isinstance(key, str):
             if isinstance(value, torch.Tensor):
                 if with_shape:
@@ -171,7 +293,10 @@ def split_state_dict_with_prefix(state_dict):
         prefix_dict[prefix].append(key)
     state_dicts = []
     for prefix, keys in prefix_dict.items():
-        sub_state_dict = {key: state_dict[key] for key in keys}
+        if isinstance(state_dict, LazySafetensorsStateDict):
+            sub_state_dict = state_dict.subset(keys)
+        else:
+            sub_state_dict = {key: state_dict[key] for key in keys}
         state_dicts.append(sub_state_dict)
     return state_dicts
 
@@ -54,7 +54,9 @@ def flash_attention(
     """
     half_dtypes = (torch.float16, torch.bfloat16)
     assert dtype in half_dtypes
-    assert q.device.type == 'cuda' and q.size(-1) <= 256
+    assert q.size(-1) <= 256
+    if q.device.type != 'cuda' or not (FLASH_ATTN_2_AVAILABLE or FLASH_ATTN_3_AVAILABLE):
+        return sdpa_attention(q, k, v, k_lens=k_lens, causal=causal, dtype=dtype)
 
     # params
     b, lq, lk, out_dtype = q.size(0), q.size(1), k.size(1), q.dtype
@@ -127,17 +129,25 @@ def flash_attention(
             causal=causal,
             window_size=window_size,
             deterministic=deterministic).unflatten(0, (b, lq))
-    else:
-        q = q.unsqueeze(0).transpose(1, 2).to(dtype)
-        k = k.unsqueeze(0).transpose(1, 2).to(dtype)
-        v = v.unsqueeze(0).transpose(1, 2).to(dtype)
-        x = torch.nn.functional.scaled_dot_product_attention(q, k, v)
-        x = x.transpose(1, 2).contiguous()
 
     # output
     return x.type(out_dtype)
 
 
+def sdpa_attention(q, k, v, k_lens=None, causal=False, dtype=torch.bfloat16):
+    """
+    flash_attention without flash-attn, or on the CPU (e.g. sequence parallel processes on gloo).
+    Padding keys beyond k_lens are masked, queries are not trimmed.
+    """
+    out_dtype, lk = q.dtype, k.size(1)
+    attn_mask = None
+    if k_lens is not None and bool((k_lens.cpu() < lk).any()):
+        attn_mask = (torch.arange(lk)[None, :] < k_lens.cpu()[:, None]).view(-1, 1, 1, lk).to(q.device)
+    q, k, v = [x.transpose(1, 2).to(dtype) for x in (q, k, v)]
+    x = torch.nn.functional.scaled_dot_product_attention(q, k, v, attn_mask=attn_mask, is_causal=causal)
+    return x.transpose(1, 2).contiguous().type(out_dtype)
+
+
 def create_sdpa_mask(q, k, q_lens, k_lens, causal=False):
     b, lq, lk = q.size(0), q.size(1), k.size(1)
     if q_lens is None:
@@ -230,34 +240,44 @@ def rope_params(max_seq_len, dim, theta=10000):
 
 
 @amp.autocast(enabled=False, device_type="cuda")
-def rope_apply(x, grid_sizes, freqs):
-    n, c = x.size(2), x.size(3) // 2
+def rope_precompute(freqs, grid_size):
+    """
+    Builds the rotation of every (f, h, w) position of one video.
 
-    # split freqs
+    Returns:
+        A complex64 tensor with shape [f*h*w, 1, C/2].
+    """
+    f, h, w = grid_size
+    c = freqs.size(1)
     freqs = freqs.split([c - 2 * (c // 3), c // 3, c // 3], dim=1)
+    freqs_grid = torch.cat([
+        freqs[0][:f].view(f, 1, 1, -1).expand(f, h, w, -1),
+        freqs[1][:h].view(1, h, 1, -1).expand(f, h, w, -1),
+        freqs[2][:w].view(1, 1, w, -1).expand(f, h, w, -1)
+    ],
+                           dim=-1).reshape(f * h * w, 1, -1)
+    return freqs_grid.to(torch.complex64)
 
-    # loop over samples
-    output = []
-    for i, (f, h, w) in enumerate(grid_sizes.tolist()):
-        seq_len = f * h * w
-
-        # precompute multipliers
-        x_i = torch.view_as_complex(x[i, :seq_len].to(torch.float64).reshape(
-            seq_len, n, -1, 2))
-        freqs_i = torch.cat([
-            freqs[0][:f].view(f, 1, 1, -1).expand(f, h, w, -1),
-            freqs[1][:h].view(1, h, 1, -1).expand(f, h, w, -1),
-            freqs[2][:w].view(1, 1, w, -1).expand(f, h, w, -1)
-        ],
-                            dim=-1).reshape(seq_len, 1, -1)
 
-        # apply rotary embedding
-        x_i = torch.view_as_real(x_i * freqs_i).flatten(2)
-        x_i = torch.cat([x_i, x[i, seq_len:]])
+@amp.autocast(enabled=False, device_type="cuda")
+def rope_apply(x, grid_sizes, freqs):
+    """
+    x:              [B, L, N, C].
+    grid_sizes:     [B, 3].
+    freqs:          A grid from rope_precompute shared by all samples,
+                    or a list with one grid per sample.
+    """
+    if isinstance(freqs, list):
+        return torch.cat([rope_apply(x[i: i + 1], grid_sizes[i: i + 1], freqs[i]) for i in range(len(freqs))])
+    b, s, n = x.shape[:3]
+    seq_len = freqs.size(0)
 
-        # append to collection
-        output.append(x_i)
-    return torch.stack(output).float()
+    # apply rotary embedding to the whole batch at once
+    x_rope = torch.view_as_complex(x[:, :seq_len].float().reshape(b, seq_len, n, -1, 2))
+    x_rope = torch.view_as_real(x_rope * freqs).flatten(3)
+    if seq_len < s:
+        x_rope = torch.cat([x_rope, x[:, seq_len:].float()], dim=1)
+    return x_rope
 
 
 class WanRMSNorm(nn.Module):
@@ -589,6 +609,9 @@ class WanModel(nn.Module):
         ],
                                dim=1)
 
+        # rotations per grid size, built once and reused by every block and step
+        self.rope_cache = {}
+
         if model_type == 'i2v':
             self.img_emb = MLPProj(1280, dim)
 
@@ -604,12 +627,14 @@ class WanModel(nn.Module):
         clip_fea=None,
         y=None,
         use_gradient_checkpointing=False,
+        tea_cache=None,
         **kwargs,
     ):
         """
         x:              A list of videos each with shape [C, T, H, W].
         t:              [B].
         context:        A list of text embeddings each with shape [L, C].
+        tea_cache:      An optional diffsynth.pipelines.tea_cache.TeaCache.
         """
         if self.model_type == 'i2v':
             assert clip_fea is not None and y is not None
@@ -658,10 +683,26 @@ class WanModel(nn.Module):
             e=e0,
             seq_lens=seq_lens,
             grid_sizes=grid_sizes,
-            freqs=self.freqs,
+            freqs=self.get_rope_freqs(grid_sizes, device),
             context=context,
             context_lens=context_lens)
         
+        if tea_cache is not None and tea_cache.check(self, x, e0):
+            x = tea_cache.update(x)
+        else:
+            x = self.block_forward(x, use_gradient_checkpointing=use_gradient_checkpointing, **kwargs)
+            if tea_cache is not None:
+                tea_cache.store(x)
+
+        # head
+        x = self.head(x, e)
+
+        # unpatchify
+        x = self.unpatchify(x, grid_sizes)
+        x = torch.stack(x).float()
+        return x
+
+    def block_forward(self, x, use_gradient_checkpointing=False, **kwargs):
         def create_custom_forward(module):
             def custom_forward(*inputs, **kwargs):
                 return module(*inputs, **kwargs)
@@ -676,15 +717,21 @@ class WanModel(nn.Module):
                 )
             else:
                 x = block(x, **kwargs)
-
-        # head
-        x = self.head(x, e)
-
-        # unpatchify
-        x = self.unpatchify(x, grid_sizes)
-        x = torch.stack(x).float()
         return x
 
+    def get_rope_freqs(self, grid_sizes, device):
+        grids = []
+        for grid_size in grid_sizes.tolist():
+            key = (*grid_size, str(device))
+            if key not in self.rope_cache:
+                if len(self.rope_cache) >= 4:
+                    self.rope_cache.clear()
+                self.rope_cache[key] = rope_precompute(self.freqs, grid_size)
+            grids.append(self.rope_cache[key])
+        if all(grid is grids[0] for grid in grids):
+            return grids[0]
+        return grids
+
     def unpatchify(self, x, grid_sizes):
         c = self.out_dim
         out = []
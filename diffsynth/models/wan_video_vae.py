@@ -1,3 +1,4 @@
+import os
 from einops import rearrange, repeat
 
 import torch
@@ -489,6 +490,13 @@ def count_conv3d(model):
     return count
 
 
+def move_feat_map(feat_map, device):
+    # Entries are tensors, None, or the 'Rep' marker of Resample
+    for i, feat in enumerate(feat_map):
+        if isinstance(feat, torch.Tensor):
+            feat_map[i] = feat.to(device)
+
+
 class VideoVAE_(nn.Module):
 
     def __init__(self,
@@ -528,17 +536,18 @@ class VideoVAE_(nn.Module):
         t = x.shape[2]
         iter_ = 1 + (t - 1) // 4
 
+        out = []
         for i in range(iter_):
             self._enc_conv_idx = [0]
             if i == 0:
-                out = self.encoder(x[:, :, :1, :, :],
-                                   feat_cache=self._enc_feat_map,
-                                   feat_idx=self._enc_conv_idx)
+                out.append(self.encoder(x[:, :, :1, :, :],
+                                        feat_cache=self._enc_feat_map,
+                                        feat_idx=self._enc_conv_idx))
             else:
-                out_ = self.encoder(x[:, :, 1 + 4 * (i - 1):1 + 4 * i, :, :],
-                                    feat_cache=self._enc_feat_map,
-                                    feat_idx=self._enc_conv_idx)
-                out = torch.cat([out, out_], 2)
+                out.append(self.encoder(x[:, :, 1 + 4 * (i - 1):1 + 4 * i, :, :],
+                                        feat_cache=self._enc_feat_map,
+                                        feat_idx=self._enc_conv_idx))
+        out = torch.cat(out, 2)
         mu, log_var = self.conv1(out).chunk(2, dim=1)
         if isinstance(scale[0], torch.Tensor):
             scale = [s.to(dtype=mu.dtype, device=mu.device) for s in scale]
@@ -549,8 +558,15 @@ class VideoVAE_(nn.Module):
             mu = (mu - scale[0]) * scale[1]
         return mu
 
-    def decode(self, z, scale):
-        self.clear_cache()
+    def decode_chunks(self, z, scale, feat_map=None):
+        """
+        Yields the frames decoded from each latent frame (1 for the first one, 4 for the others).
+
+        The causal cache lives in feat_map instead of on the module, so several streams
+        (e.g. one per tile) can be decoded side by side.
+        """
+        if feat_map is None:
+            feat_map = [None] * count_conv3d(self.decoder)
         # z: [b,c,t,h,w]
         if isinstance(scale[0], torch.Tensor):
             scale = [s.to(dtype=z.dtype, device=z.device) for s in scale]
@@ -559,20 +575,15 @@ class VideoVAE_(nn.Module):
         else:
             scale = scale.to(dtype=z.dtype, device=z.device)
             z = z / scale[1] + scale[0]
-        iter_ = z.shape[2]
         x = self.conv2(z)
-        for i in range(iter_):
-            self._conv_idx = [0]
-            if i == 0:
-                out = self.decoder(x[:, :, i:i + 1, :, :],
-                                   feat_cache=self._feat_map,
-                                   feat_idx=self._conv_idx)
-            else:
-                out_ = self.decoder(x[:, :, i:i + 1, :, :],
-                                    feat_cache=self._feat_map,
-                                    feat_idx=self._conv_idx)
-                out = torch.cat([out, out_], 2) # may add tensor offload
-        return out
+        for i in range(z.shape[2]):
+            yield self.decoder(x[:, :, i:i + 1, :, :],
+                               feat_cache=feat_map,
+                               feat_idx=[0])
+
+    def decode(self, z, scale):
+        # Concatenated once, growing the output on every latent frame copies it quadratically
+        return torch.cat(list(self.decode_chunks(z, scale)), 2)
 
     def reparameterize(self, mu, log_var):
         std = torch.exp(0.5 * log_var)
@@ -597,6 +608,8 @@ class VideoVAE_(nn.Module):
 
 
 class WanVideoVAE(nn.Module):
+    # Rough peak decode memory per latent pixel of a tile under bf16 autocast
+    DECODE_BYTES_PER_LATENT_PIXEL = 512 * 1024
 
     def __init__(self, z_dim=16):
         super().__init__()
@@ -616,6 +629,7 @@ class WanVideoVAE(nn.Module):
         # init model
         self.model = VideoVAE_(z_dim=z_dim).eval().requires_grad_(False)
         self.upsampling_factor = 8
+        self.mask_cache = {}
 
 
     def build_1d_mask(self, length, left_bound, right_bound, border_width):
@@ -640,12 +654,9 @@ class WanVideoVAE(nn.Module):
         return mask
 
 
-    def tiled_decode(self, hidden_states, device, tile_size, tile_stride):
-        _, _, T, H, W = hidden_states.shape
+    def split_tiles(self, H, W, tile_size, tile_stride):
         size_h, size_w = tile_size
         stride_h, stride_w = tile_stride
-
-        # Split tasks
         tasks = []
         for h in range(0, H, stride_h):
             if (h-stride_h >= 0 and h-stride_h+size_h >= H): continue
@@ -653,93 +664,178 @@ class WanVideoVAE(nn.Module):
                 if (w-stride_w >= 0 and w-stride_w+size_w >= W): continue
                 h_, w_ = h + size_h, w + size_w
                 tasks.append((h, h_, w, w_))
+        return tasks
 
-        data_device = "cpu"
-        computation_device = device
 
-        out_T = T * 4 - 3
-        weight = torch.zeros((1, 1, out_T, H * self.upsampling_factor, W * self.upsampling_factor), dtype=hidden_states.dtype, device=data_device)
-        values = torch.zeros((1, 3, out_T, H * self.upsampling_factor, W * self.upsampling_factor), dtype=hidden_states.dtype, device=data_device)
-
-        for h, h_, w, w_ in tqdm(tasks, desc="VAE decoding"):
-            hidden_states_batch = hidden_states[:, :, :, h:h_, w:w_].to(computation_device)
-            hidden_states_batch = self.model.decode(hidden_states_batch, self.scale).to(data_device)
-
-            mask = self.build_mask(
-                hidden_states_batch,
-                is_bound=(h==0, h_>=H, w==0, w_>=W),
-                border_width=((size_h - stride_h) * self.upsampling_factor, (size_w - stride_w) * self.upsampling_factor)
-            ).to(dtype=hidden_states.dtype, device=data_device)
-
-            target_h = h * self.upsampling_factor
-            target_w = w * self.upsampling_factor
-            values[
-                :,
-                :,
-                :,
-                target_h:target_h + hidden_states_batch.shape[3],
-                target_w:target_w + hidden_states_batch.shape[4],
-            ] += hidden_states_batch * mask
-            weight[
-                :,
-                :,
-                :,
-                target_h: target_h + hidden_states_batch.shape[3],
-                target_w: target_w + hidden_states_batch.shape[4],
-            ] += mask
+    def get_mask(self, data, is_bound, border_width):
+        # Blend masks only depend on the tile shape and on the image borders the tile touches
+        key = (tuple(data.shape[3:]), is_bound, border_width, data.dtype, str(data.device))
+        if key not in self.mask_cache:
+            self.mask_cache[key] = self.build_mask(data, is_bound, border_width).to(dtype=data.dtype, device=data.device)
+        return self.mask_cache[key]
+
+
+    def batch_tiles(self, tasks, H, W, tile_batch_size):
+        # Tiles cut off by the bottom or right border are smaller, only equally shaped tiles share a batch
+        groups = {}
+        for h, h_, w, w_ in tasks:
+            groups.setdefault((min(h_, H) - h, min(w_, W) - w), []).append((h, h_, w, w_))
+        batches = []
+        for group in groups.values():
+            for i in range(0, len(group), tile_batch_size):
+                batches.append(group[i: i + tile_batch_size])
+        return batches
+
+
+    def free_memory(self, device):
+        if torch.device(device).type == "cuda":
+            return torch.cuda.mem_get_info(torch.device(device))[0]
+        try:
+            # Available host memory, only known on Linux-like systems
+            return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+        except (ValueError, OSError, AttributeError):
+            return 0
+
+
+    def accumulation_device(self, device, num_bytes):
+        # Accumulating next to the computation saves a device-to-host copy per tile
+        if torch.device(device).type == "cuda":
+            free_bytes, _ = torch.cuda.mem_get_info(torch.device(device))
+            if num_bytes * 4 <= free_bytes:
+                return device
+        return "cpu"
+
+
+    def auto_tile_batch_size(self, device, tile_bytes, max_tile_batch_size=8):
+        if torch.device(device).type == "cuda":
+            return int(min(max(self.free_memory(device) * 0.8 // max(tile_bytes, 1), 1), max_tile_batch_size))
+        # On the CPU the convolutions of one tile already keep every core busy
+        return 1
+
+
+    def auto_tile_size(self, H, W, device, memory_budget=None, overlap=(16, 16)):
+        """
+        Chooses the largest square latent tile whose decode fits the memory budget.
+        Larger tiles also recompute fewer overlapping pixels.
+
+        Args:
+            H, W (int): Latent height and width.
+            memory_budget (int): Bytes for one tile, by default 80% of the free device (or host) memory.
+            overlap (tuple): Latent overlap of neighbouring tiles.
+
+        Returns:
+            tuple: (tile_size, tile_stride) in latent pixels.
+        """
+        if memory_budget is None:
+            memory_budget = self.free_memory(device) * 0.8
+            if memory_budget <= 0:
+                return (34, 34), (18, 16)
+        size = int((memory_budget / self.DECODE_BYTES_PER_LATENT_PIXEL) ** 0.5)
+        size_h = min(max(size, overlap[0] + 2), H)
+        size_w = min(max(size, overlap[1] + 2), W)
+        return (size_h, size_w), (max(size_h - overlap[0], 1), max(size_w - overlap[1], 1))
+
+
+    def tiled_forward(self, data, forward_fn, out_channels, out_T, upscale, device, tile_size, tile_stride, tile_batch_size=None, accumulate_device=None, desc="VAE"):
+        # Runs forward_fn on batches of equally shaped tiles and blends the results
+        _, _, T, H, W = data.shape
+        size_h, size_w = tile_size
+        stride_h, stride_w = tile_stride
+        tasks = self.split_tiles(H, W, tile_size, tile_stride)
+        if upscale:
+            rescale = lambda x: x * self.upsampling_factor
+        else:
+            rescale = lambda x: x // self.upsampling_factor
+        border_width = (rescale(size_h - stride_h), rescale(size_w - stride_w))
+
+        out_shape = (out_T, rescale(H), rescale(W))
+        computation_device = device
+        if accumulate_device is None:
+            accumulate_device = self.accumulation_device(device, (out_channels + 1) * out_shape[0] * out_shape[1] * out_shape[2] * data.element_size())
+        data_device = accumulate_device
+        if tile_batch_size is None:
+            latent_area = size_h * size_w if upscale else size_h * size_w // self.upsampling_factor**2
+            tile_batch_size = self.auto_tile_batch_size(device, latent_area * self.DECODE_BYTES_PER_LATENT_PIXEL)
+
+        weight = torch.zeros((1, 1) + out_shape, dtype=data.dtype, device=data_device)
+        values = torch.zeros((1, out_channels) + out_shape, dtype=data.dtype, device=data_device)
+
+        for batch in tqdm(self.batch_tiles(tasks, H, W, tile_batch_size), desc=desc):
+            data_batch = torch.concat([data[:, :, :, h:h_, w:w_] for h, h_, w, w_ in batch]).to(computation_device)
+            data_batch = forward_fn(data_batch).to(device=data_device, dtype=data.dtype)
+            for (h, h_, w, w_), tile in zip(batch, data_batch.split(1)):
+                mask = self.get_mask(tile, is_bound=(h==0, h_>=H, w==0, w_>=W), border_width=border_width)
+                target_h, target_w = rescale(h), rescale(w)
+                values[:, :, :, target_h: target_h + tile.shape[3], target_w: target_w + tile.shape[4]] += tile * mask
+                weight[:, :, :, target_h: target_h + tile.shape[3], target_w: target_w + tile.shape[4]] += mask
         values = values / weight
+        return values.to("cpu")
+
+
+    def tiled_decode(self, hidden_states, device, tile_size, tile_stride, tile_batch_size=None, accumulate_device=None):
+        values = self.tiled_forward(
+            hidden_states, lambda x: self.model.decode(x, self.scale), 3, hidden_states.shape[2] * 4 - 3, True,
+            device, tile_size, tile_stride, tile_batch_size, accumulate_device, desc="VAE decoding"
+        )
         values = values.float().clamp_(-1, 1)
         return values
 
 
-    def tiled_encode(self, video, device, tile_size, tile_stride):
-        _, _, T, H, W = video.shape
+    def tiled_decode_stream(self, hidden_states, device, tile_size, tile_stride):
+        _, _, T, H, W = hidden_states.shape
         size_h, size_w = tile_size
         stride_h, stride_w = tile_stride
-
-        # Split tasks
-        tasks = []
-        for h in range(0, H, stride_h):
-            if (h-stride_h >= 0 and h-stride_h+size_h >= H): continue
-            for w in range(0, W, stride_w):
-                if (w-stride_w >= 0 and w-stride_w+size_w >= W): continue
-                h_, w_ = h + size_h, w + size_w
-                tasks.append((h, h_, w, w_))
+        tasks = self.split_tiles(H, W, tile_size, tile_stride)
 
         data_device = "cpu"
         computation_device = device
-
-        out_T = (T + 3) // 4
-        weight = torch.zeros((1, 1, out_T, H // self.upsampling_factor, W // self.upsampling_factor), dtype=video.dtype, device=data_device)
-        values = torch.zeros((1, 16, out_T, H // self.upsampling_factor, W // self.upsampling_factor), dtype=video.dtype, device=data_device)
-
-        for h, h_, w, w_ in tqdm(tasks, desc="VAE encoding"):
-            hidden_states_batch = video[:, :, :, h:h_, w:w_].to(computation_device)
-            hidden_states_batch = self.model.encode(hidden_states_batch, self.scale).to(data_device)
-
-            mask = self.build_mask(
-                hidden_states_batch,
-                is_bound=(h==0, h_>=H, w==0, w_>=W),
-                border_width=((size_h - stride_h) // self.upsampling_factor, (size_w - stride_w) // self.upsampling_factor)
-            ).to(dtype=video.dtype, device=data_device)
-
-            target_h = h // self.upsampling_factor
-            target_w = w // self.upsampling_factor
-            values[
-                :,
-                :,
-                :,
-                target_h:target_h + hidden_states_batch.shape[3],
-                target_w:target_w + hidden_states_batch.shape[4],
-            ] += hidden_states_batch * mask
-            weight[
-                :,
-                :,
-                :,
-                target_h: target_h + hidden_states_batch.shape[3],
-                target_w: target_w + hidden_states_batch.shape[4],
-            ] += mask
-        values = values / weight
+        border_width = ((size_h - stride_h) * self.upsampling_factor, (size_w - stride_w) * self.upsampling_factor)
+
+        # One decoder stream per tile, their causal caches wait on data_device between latent frames
+        streams, feat_maps = [], []
+        for h, h_, w, w_ in tasks:
+            feat_map = [None] * count_conv3d(self.model.decoder)
+            streams.append(self.model.decode_chunks(hidden_states[:, :, :, h:h_, w:w_].to(computation_device), self.scale, feat_map))
+            feat_maps.append(feat_map)
+
+        for _ in tqdm(range(T), desc="VAE decoding"):
+            values, weight = None, None
+            for (h, h_, w, w_), stream, feat_map in zip(tasks, streams, feat_maps):
+                move_feat_map(feat_map, computation_device)
+                hidden_states_batch = next(stream).to(data_device)
+                move_feat_map(feat_map, data_device)
+                if values is None:
+                    out_T = hidden_states_batch.shape[2]
+                    weight = torch.zeros((1, 1, out_T, H * self.upsampling_factor, W * self.upsampling_factor), dtype=hidden_states.dtype, device=data_device)
+                    values = torch.zeros((1, 3, out_T, H * self.upsampling_factor, W * self.upsampling_factor), dtype=hidden_states.dtype, device=data_device)
+
+                mask = self.get_mask(hidden_states_batch.to(hidden_states.dtype), is_bound=(h==0, h_>=H, w==0, w_>=W), border_width=border_width)
+
+                target_h = h * self.upsampling_factor
+                target_w = w * self.upsampling_factor
+                values[
+                    :,
+                    :,
+                    :,
+                    target_h:target_h + hidden_states_batch.shape[3],
+                    target_w:target_w + hidden_states_batch.shape[4],
+                ] += hidden_states_batch * mask
+                weight[
+                    :,
+                    :,
+                    :,
+                    target_h: target_h + hidden_states_batch.shape[3],
+                    target_w: target_w + hidden_states_batch.shape[4],
+                ] += mask
+            values = values / weight
+            yield values.float().clamp_(-1, 1)
+
+
+    def tiled_encode(self, video, device, tile_size, tile_stride, tile_batch_size=None, accumulate_device=None):
+        values = self.tiled_forward(
+            video, lambda x: self.model.encode(x, self.scale), 16, (video.shape[2] + 3) // 4, False,
+            device, tile_size, tile_stride, tile_batch_size, accumulate_device, desc="VAE encoding"
+        )
         values = values.float()
         return values
 
@@ -756,16 +852,20 @@ class WanVideoVAE(nn.Module):
         return video.float().clamp_(-1, 1)
 
 
-    def encode(self, videos, device, tiled=False, tile_size=(34, 34), tile_stride=(18, 16)):
+    def encode(self, videos, device, tiled=False, tile_size=(34, 34), tile_stride=(18, 16), tile_batch_size=None):
 
         videos = [video.to("cpu") for video in videos]
         hidden_states = []
         for video in videos:
             video = video.unsqueeze(0)
             if tiled:
-                tile_size = (tile_size[0] * 8, tile_size[1] * 8)
-                tile_stride = (tile_stride[0] * 8, tile_stride[1] * 8)
-                hidden_state = self.tiled_encode(video, device, tile_size, tile_stride)
+                if tile_size == "auto":
+                    tile_size, tile_stride = self.auto_tile_size(video.shape[3] // 8, video.shape[4] // 8, device)
+                hidden_state = self.tiled_encode(
+                    video, device,
+                    (tile_size[0] * 8, tile_size[1] * 8), (tile_stride[0] * 8, tile_stride[1] * 8),
+                    tile_batch_size=tile_batch_size
+                )
             else:
                 hidden_state = self.single_encode(video, device)
             hidden_state = hidden_state.squeeze(0)
@@ -774,13 +874,20 @@ class WanVideoVAE(nn.Module):
         return hidden_states
 
 
-    def decode(self, hidden_states, device, tiled=False, tile_size=(34, 34), tile_stride=(18, 16)):
+    def decode(self, hidden_states, device, tiled=False, tile_size=(34, 34), tile_stride=(18, 16), tile_batch_size=None):
+        """
+        Args:
+            tile_size, tile_stride: Latent tile size and stride, or tile_size="auto" to size tiles from free device memory.
+            tile_batch_size (int): Equally shaped tiles decoded in one call, chosen from free device memory if None.
+        """
         hidden_states = [hidden_state.to("cpu") for hidden_state in hidden_states]
         videos = []
         for hidden_state in hidden_states:
             hidden_state = hidden_state.unsqueeze(0)
             if tiled:
-                video = self.tiled_decode(hidden_state, device, tile_size, tile_stride)
+                if tile_size == "auto":
+                    tile_size, tile_stride = self.auto_tile_size(hidden_state.shape[3], hidden_state.shape[4], device)
+                video = self.tiled_decode(hidden_state, device, tile_size, tile_stride, tile_batch_size=tile_batch_size)
             else:
                 video = self.single_decode(hidden_state, device)
             video = video.squeeze(0)
@@ -788,6 +895,31 @@ class WanVideoVAE(nn.Module):
         return videos
 
 
+    def single_decode_stream(self, hidden_state, device):
+        hidden_state = hidden_state.to(device)
+        for video in self.model.decode_chunks(hidden_state, self.scale):
+            yield video.float().clamp_(-1, 1).cpu()
+
+
+    def decode_stream(self, hidden_state, device, tiled=False, tile_size=(34, 34), tile_stride=(18, 16)):
+        """
+        Decodes one video latent [C, T, H, W] latent frame by latent frame.
+
+        Yields float videos [3, t, H, W] in [-1, 1] on the CPU, with t = 1 for the first
+        latent frame and t = 4 for the others, so only the causal cache and one chunk
+        are held at a time.
+        """
+        hidden_state = hidden_state.to("cpu").unsqueeze(0)
+        if tiled and tile_size == "auto":
+            tile_size, tile_stride = self.auto_tile_size(hidden_state.shape[3], hidden_state.shape[4], device)
+        if tiled:
+            videos = self.tiled_decode_stream(hidden_state, device, tile_size, tile_stride)
+        else:
+            videos = self.single_decode_stream(hidden_state, device)
+        for video in videos:
+            yield video.squeeze(0)
+
+
     @staticmethod
     def state_dict_converter():
         return WanVideoVAEStateDictConverter()
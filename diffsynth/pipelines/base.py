@@ -2,6 +2,7 @@ import torch
 import numpy as np
 from PIL import Image
 from torchvision.transforms import GaussianBlur
+from ..distributed import shared_random_seed
 
 
 
@@ -122,6 +123,8 @@ class BasePipeline(torch.nn.Module):
 
     
     def generate_noise(self, shape, seed=None, device="cpu", dtype=torch.float16):
+        if seed is None and getattr(self, "sequence_parallel", False):
+            seed = shared_random_seed()
         generator = None if seed is None else torch.Generator(device).manual_seed(seed)
         noise = torch.randn(shape, generator=generator, device=device, dtype=dtype)
         return noise
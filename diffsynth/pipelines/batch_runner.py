@@ -0,0 +1,183 @@
+"""
+Headless batch generation from a JSON or JSONL job file.
+
+    python -m diffsynth.pipelines.batch_runner jobs.jsonl --output_folder output/batch
+
+Each job is one JSON object, for example
+
+    {"id": "cat", "pipeline": "wan_video", "model_list": ["models/Wan-AI/Wan2.1-T2V-1.3B/diffusion_pytorch_model.safetensors", ...],
+     "prompt": "a cat", "seed": 0, "height": 480, "width": 832, "num_inference_steps": 30, "num_frames": 81, "fps": 15}
+
+A .json file may instead hold {"defaults": {...}, "jobs": [...]}, where the defaults are
+applied to every job. Jobs sharing a pipeline and model list are run together so that the
+models are loaded once. Every finished job is appended to checkpoint.jsonl in the output
+folder, and jobs recorded there are skipped when the runner is started again. Jobs without
+an "id" are named by their position, so give ids to jobs in a file that may still be edited.
+"""
+import os, json, time, argparse, torch
+from ..models import ModelManager
+from ..data import save_video
+from .sd_image import SDImagePipeline
+from .sdxl_image import SDXLImagePipeline
+from .sd3_image import SD3ImagePipeline
+from .flux_image import FluxImagePipeline
+from .hunyuan_video import HunyuanVideoPipeline
+from .wan_video import WanVideoPipeline
+
+
+PIPELINE_CLASSES = {
+    "sd_image": SDImagePipeline,
+    "sdxl_image": SDXLImagePipeline,
+    "sd3_image": SD3ImagePipeline,
+    "flux_image": FluxImagePipeline,
+    "hunyuan_video": HunyuanVideoPipeline,
+    "wan_video": WanVideoPipeline,
+}
+VIDEO_PIPELINES = ["hunyuan_video", "wan_video"]
+
+# Job fields passed to the pipeline call; anything else goes in "pipeline_inputs"
+PIPELINE_INPUT_KEYS = ["prompt", "negative_prompt", "seed", "height", "width", "num_inference_steps", "num_frames", "cfg_scale"]
+# Job fields that decide which loaded pipeline a job can share
+GROUP_KEYS = ["pipeline", "model_list", "torch_dtype", "device", "vram_management"]
+
+
+class BatchPipelineRunner:
+    def __init__(self, output_folder, resume=True):
+        self.output_folder = output_folder
+        self.checkpoint_path = os.path.join(output_folder, "checkpoint.jsonl")
+        self.resume = resume
+
+
+    def load_jobs(self, jobs_path):
+        if jobs_path.endswith(".jsonl"):
+            with open(jobs_path, "r") as f:
+                jobs, defaults = [json.loads(line) for line in f if line.strip() != ""], {}
+        else:
+            with open(jobs_path, "r") as f:
+                data = json.load(f)
+            jobs, defaults = (data, {}) if isinstance(data, list) else (data["jobs"], data.get("defaults", {}))
+        jobs = [{**defaults, **job} for job in jobs]
+        for job_id, job in enumerate(jobs):
+            job.setdefault("id", f"job_{job_id:05d}")
+            if job.get("pipeline") not in PIPELINE_CLASSES:
+                raise ValueError(f"Job {job['id']}: unknown pipeline {job.get('pipeline')}, expected one of {list(PIPELINE_CLASSES)}")
+            if "model_list" not in job:
+                raise ValueError(f"Job {job['id']}: model_list is required")
+        ids = [job["id"] for job in jobs]
+        if len(set(ids)) != len(ids):
+            raise ValueError("Job ids must be unique")
+        return jobs
+
+
+    def group_jobs(self, jobs):
+        # Groups keep the order in which their first job appears in the file
+        groups = {}
+        for job in jobs:
+            key = json.dumps([job.get(name) for name in GROUP_KEYS])
+            groups.setdefault(key, []).append(job)
+        return list(groups.values())
+
+
+    def load_checkpoint(self):
+        finished = set()
+        if self.resume and os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, "r") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A line cut short by a crash
+                        continue
+                    if record.get("status") == "done":
+                        finished.add(record["id"])
+        return finished
+
+
+    def write_checkpoint(self, record):
+        with open(self.checkpoint_path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+
+    def load_pipeline(self, pipeline, model_list, torch_dtype="bfloat16", device="cuda", vram_management=True):
+        torch_dtype = getattr(torch, torch_dtype)
+        pipeline_class = PIPELINE_CLASSES[pipeline]
+        # With VRAM management the weights stay on the CPU and are onloaded layer by layer
+        vram_management = vram_management and hasattr(pipeline_class, "enable_vram_management")
+        model_manager = ModelManager(torch_dtype=torch_dtype, device="cpu" if vram_management else device)
+        model_manager.load_models(model_list)
+        pipe = pipeline_class.from_model_manager(model_manager, device=device)
+        if vram_management and pipeline != "hunyuan_video":
+            # HunyuanVideoPipeline enables it in from_model_manager
+            pipe.enable_vram_management()
+        return model_manager, pipe
+
+
+    def run_job(self, pipe, job):
+        pipeline_inputs = {key: job[key] for key in PIPELINE_INPUT_KEYS if key in job}
+        pipeline_inputs.update(job.get("pipeline_inputs", {}))
+        return pipe(**pipeline_inputs)
+
+
+    def save_output(self, output, job):
+        os.makedirs(self.output_folder, exist_ok=True)
+        if job["pipeline"] in VIDEO_PIPELINES:
+            file_path = os.path.join(self.output_folder, f"{job['id']}.mp4")
+            save_video(output, file_path, fps=job.get("fps", 15), quality=job.get("quality", 5))
+        else:
+            file_path = os.path.join(self.output_folder, f"{job['id']}.png")
+            output.save(file_path)
+        with open(os.path.join(self.output_folder, f"{job['id']}.json"), "w") as f:
+            json.dump(job, f, indent=4)
+        return file_path
+
+
+    def run(self, jobs_path):
+        jobs = self.load_jobs(jobs_path)
+        os.makedirs(self.output_folder, exist_ok=True)
+        finished = self.load_checkpoint()
+        pending = [job for job in jobs if job["id"] not in finished]
+        print(f"{len(jobs)} jobs, {len(jobs) - len(pending)} already finished, {len(pending)} to run.")
+        for group in self.group_jobs(pending):
+            job = group[0]
+            print(f"Loading {job['pipeline']} for {len(group)} jobs ...")
+            try:
+                model_manager, pipe = self.load_pipeline(
+                    job["pipeline"], job["model_list"],
+                    torch_dtype=job.get("torch_dtype", "bfloat16"),
+                    device=job.get("device", "cuda"),
+                    vram_management=job.get("vram_management", True),
+                )
+            except Exception as e:
+                print(f"Loading {job['pipeline']} failed: {str(e)}")
+                for job in group:
+                    self.write_checkpoint({"id": job["id"], "status": "failed", "error": str(e)})
+                continue
+            for job in group:
+                start_time = time.time()
+                try:
+                    file_path = self.save_output(self.run_job(pipe, job), job)
+                    record = {"id": job["id"], "status": "done", "output": file_path, "seconds": time.time() - start_time}
+                    print(f"Job {job['id']} done in {record['seconds']:.1f}s: {file_path}")
+                except Exception as e:
+                    # Failed jobs are not marked done, so they are retried on the next run
+                    record = {"id": job["id"], "status": "failed", "error": str(e)}
+                    print(f"Job {job['id']} failed: {str(e)}")
+                self.write_checkpoint(record)
+            del pipe, model_manager
+            torch.cuda.empty_cache()
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a JSON or JSONL file of generation jobs without the WebUI.")
+    parser.add_argument("jobs", type=str, help="Path of the .json or .jsonl job file")
+    parser.add_argument("--output_folder", type=str, default="output/batch")
+    parser.add_argument("--no_resume", action="store_true", help="Run every job again, ignoring checkpoint.jsonl")
+    args = parser.parse_args()
+    BatchPipelineRunner(args.output_folder, resume=not args.no_resume).run(args.jobs)
+
+
+if __name__ == "__main__":
+    main()
@@ -13,7 +13,8 @@ from transformers import SiglipVisionModel
 from copy import deepcopy
 from transformers.models.t5.modeling_t5 import T5LayerNorm, T5DenseActDense, T5DenseGatedActDense
 from ..models.flux_dit import RMSNorm
-from ..vram_management import enable_vram_management, AutoWrappedModule, AutoWrappedLinear
+from ..vram_management import enable_vram_management, enable_layer_prefetch, AutoWrappedModule, AutoWrappedLinear, quantized_module_map
+from .tea_cache import TeaCache
 
 
 class FluxImagePipeline(BasePipeline):
@@ -34,7 +35,8 @@ class FluxImagePipeline(BasePipeline):
         self.model_names = ['text_encoder_1', 'text_encoder_2', 'dit', 'vae_decoder', 'vae_encoder', 'controlnet', 'ipadapter', 'ipadapter_image_encoder']
 
 
-    def enable_vram_management(self, num_persistent_param_in_dit=None):
+    def enable_vram_management(self, num_persistent_param_in_dit=None, enable_prefetch=False, dit_quantization=None):
+        # dit_quantization ("int8" or "int4") stores the linear weights of the DiT quantized
         dtype = next(iter(self.text_encoder_1.parameters())).dtype
         enable_vram_management(
             self.text_encoder_1,
@@ -74,10 +76,10 @@ class FluxImagePipeline(BasePipeline):
         dtype = next(iter(self.dit.parameters())).dtype
         enable_vram_management(
             self.dit,
-            module_map = {
+            module_map = quantized_module_map({
                 RMSNorm: AutoWrappedModule,
                 torch.nn.Linear: AutoWrappedLinear,
-            },
+            }, dit_quantization),
             module_config = dict(
                 offload_dtype=dtype,
                 offload_device="cpu",
@@ -96,6 +98,9 @@ class FluxImagePipeline(BasePipeline):
                 computation_device=self.device,
             ),
         )
+        if enable_prefetch:
+            # Overflow layers stream their weights to the device ahead of use
+            enable_layer_prefetch(self.dit, self.device)
         dtype = next(iter(self.vae_decoder.parameters())).dtype
         enable_vram_management(
             self.vae_decoder,
@@ -419,7 +424,7 @@ class FluxImagePipeline(BasePipeline):
         controlnet_kwargs_posi, controlnet_kwargs_nega, local_controlnet_kwargs = self.prepare_controlnet(controlnet_image, masks, controlnet_inpaint_mask, tiler_kwargs, enable_controlnet_on_negative)
 
         # TeaCache
-        tea_cache_kwargs = {"tea_cache": TeaCache(num_inference_steps, rel_l1_thresh=tea_cache_l1_thresh) if tea_cache_l1_thresh is not None else None}
+        tea_cache_kwargs = {"tea_cache": TeaCache(num_inference_steps, rel_l1_thresh=tea_cache_l1_thresh, model_type="flux") if tea_cache_l1_thresh is not None else None}
 
         # Denoise
         self.load_models_to_device(['dit', 'controlnet'])
@@ -460,6 +465,9 @@ class FluxImagePipeline(BasePipeline):
             if progress_bar_st is not None:
                 progress_bar_st.progress(progress_id / len(self.scheduler.timesteps))
         
+        if tea_cache_kwargs["tea_cache"] is not None:
+            tea_cache_kwargs["tea_cache"].report()
+
         # Decode image
         self.load_models_to_device(['vae_decoder'])
         image = self.decode_image(latents, **tiler_kwargs)
@@ -469,49 +477,6 @@ class FluxImagePipeline(BasePipeline):
         return image
 
 
-class TeaCache:
-    def __init__(self, num_inference_steps, rel_l1_thresh):
-        self.num_inference_steps = num_inference_steps
-        self.step = 0
-        self.accumulated_rel_l1_distance = 0
-        self.previous_modulated_input = None
-        self.rel_l1_thresh = rel_l1_thresh
-        self.previous_residual = None
-        self.previous_hidden_states = None
-
-    def check(self, dit: FluxDiT, hidden_states, conditioning):
-        inp = hidden_states.clone()
-        temb_ = conditioning.clone()
-        modulated_inp, _, _, _, _ = dit.blocks[0].norm1_a(inp, emb=temb_)
-        if self.step == 0 or self.step == self.num_inference_steps - 1:
-            should_calc = True
-            self.accumulated_rel_l1_distance = 0
-        else: 
-            coefficients = [4.98651651e+02, -2.83781631e+02,  5.58554382e+01, -3.82021401e+00, 2.64230861e-01]
-            rescale_func = np.poly1d(coefficients)
-            self.accumulated_rel_l1_distance += rescale_func(((modulated_inp-self.previous_modulated_input).abs().mean() / self.previous_modulated_input.abs().mean()).cpu().item())
-            if self.accumulated_rel_l1_distance < self.rel_l1_thresh:
-                should_calc = False
-            else:
-                should_calc = True
-                self.accumulated_rel_l1_distance = 0
-        self.previous_modulated_input = modulated_inp 
-        self.step += 1
-        if self.step == self.num_inference_steps:
-            self.step = 0
-        if should_calc:
-            self.previous_hidden_states = hidden_states.clone()
-        return not should_calc
-    
-    def store(self, hidden_states):
-        self.previous_residual = hidden_states - self.previous_hidden_states
-        self.previous_hidden_states = None
-
-    def update(self, hidden_states):
-        hidden_states = hidden_states + self.previous_residual
-        return hidden_states
-
-
 def lets_dance_flux(
     dit: FluxDiT,
     controlnet: FluxMultiControlNetManager = None,
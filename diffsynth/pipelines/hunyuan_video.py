@@ -3,7 +3,9 @@ from ..models.hunyuan_video_dit import HunyuanVideoDiT
 from ..models.hunyuan_video_text_encoder import HunyuanVideoLLMEncoder
 from ..schedulers.flow_match import FlowMatchScheduler
 from .base import BasePipeline
+from .tea_cache import TeaCache
 from ..prompters import HunyuanVideoPrompter
+from ..vram_management import enable_vram_management, quantized_module_map
 import torch
 from einops import rearrange
 import numpy as np
@@ -27,10 +29,23 @@ class HunyuanVideoPipeline(BasePipeline):
         self.vram_management = False
 
 
-    def enable_vram_management(self):
+    def enable_vram_management(self, dit_quantization=None):
         self.vram_management = True
         self.enable_cpu_offload()
         self.text_encoder_2.enable_auto_offload(dtype=self.torch_dtype, device=self.device)
+        if dit_quantization is not None:
+            # Streamed to the device in forward like the rest of the DiT, with fewer bytes.
+            # enable_auto_offload below only replaces torch.nn.Linear, so it skips these layers.
+            enable_vram_management(
+                self.dit,
+                module_map = quantized_module_map({}, dit_quantization),
+                module_config = dict(
+                    offload_device="cpu",
+                    onload_device="cpu",
+                    computation_dtype=self.torch_dtype,
+                    computation_device=self.device,
+                ),
+            )
         self.dit.enable_auto_offload(dtype=self.torch_dtype, device=self.device)
 
 
@@ -44,13 +59,13 @@ class HunyuanVideoPipeline(BasePipeline):
 
 
     @staticmethod
-    def from_model_manager(model_manager: ModelManager, torch_dtype=None, device=None, enable_vram_management=True):
+    def from_model_manager(model_manager: ModelManager, torch_dtype=None, device=None, enable_vram_management=True, dit_quantization=None):
         if device is None: device = model_manager.device
         if torch_dtype is None: torch_dtype = model_manager.torch_dtype
         pipe = HunyuanVideoPipeline(device=device, torch_dtype=torch_dtype)
         pipe.fetch_models(model_manager)
         if enable_vram_management:
-            pipe.enable_vram_management()
+            pipe.enable_vram_management(dit_quantization=dit_quantization)
         return pipe
 
 
@@ -131,7 +146,7 @@ class HunyuanVideoPipeline(BasePipeline):
         extra_input = self.prepare_extra_input(latents, guidance=embedded_guidance)
 
         # TeaCache
-        tea_cache_kwargs = {"tea_cache": TeaCache(num_inference_steps, rel_l1_thresh=tea_cache_l1_thresh) if tea_cache_l1_thresh is not None else None}
+        tea_cache_kwargs = {"tea_cache": TeaCache(num_inference_steps, rel_l1_thresh=tea_cache_l1_thresh, model_type="hunyuan_video") if tea_cache_l1_thresh is not None else None}
 
         # Denoise
         self.load_models_to_device([] if self.vram_management else ["dit"])
@@ -165,6 +180,9 @@ class HunyuanVideoPipeline(BasePipeline):
             # Scheduler
             latents = self.scheduler.step(noise_pred, self.scheduler.timesteps[progress_id], latents)
 
+        if tea_cache_kwargs["tea_cache"] is not None:
+            tea_cache_kwargs["tea_cache"].report()
+
         # Decode
         self.load_models_to_device(['vae_decoder'])
         frames = self.vae_decoder.decode_video(latents, **tiler_kwargs)
@@ -175,52 +193,6 @@ class HunyuanVideoPipeline(BasePipeline):
 
 
 
-class TeaCache:
-    def __init__(self, num_inference_steps, rel_l1_thresh):
-        self.num_inference_steps = num_inference_steps
-        self.step = 0
-        self.accumulated_rel_l1_distance = 0
-        self.previous_modulated_input = None
-        self.rel_l1_thresh = rel_l1_thresh
-        self.previous_residual = None
-        self.previous_hidden_states = None
-
-    def check(self, dit: HunyuanVideoDiT, img, vec):
-        img_ = img.clone()
-        vec_ = vec.clone()
-        img_mod1_shift, img_mod1_scale, _, _, _, _ = dit.double_blocks[0].component_a.mod(vec_).chunk(6, dim=-1)
-        normed_inp = dit.double_blocks[0].component_a.norm1(img_)
-        modulated_inp = normed_inp * (1 + img_mod1_scale.unsqueeze(1)) + img_mod1_shift.unsqueeze(1)
-        if self.step == 0 or self.step == self.num_inference_steps - 1:
-            should_calc = True
-            self.accumulated_rel_l1_distance = 0
-        else: 
-            coefficients = [7.33226126e+02, -4.01131952e+02,  6.75869174e+01, -3.14987800e+00, 9.61237896e-02]
-            rescale_func = np.poly1d(coefficients)
-            self.accumulated_rel_l1_distance += rescale_func(((modulated_inp-self.previous_modulated_input).abs().mean() / self.previous_modulated_input.abs().mean()).cpu().item())
-            if self.accumulated_rel_l1_distance < self.rel_l1_thresh:
-                should_calc = False
-            else:
-                should_calc = True
-                self.accumulated_rel_l1_distance = 0
-        self.previous_modulated_input = modulated_inp 
-        self.step += 1
-        if self.step == self.num_inference_steps:
-            self.step = 0
-        if should_calc:
-            self.previous_hidden_states = img.clone()
-        return not should_calc
-    
-    def store(self, hidden_states):
-        self.previous_residual = hidden_states - self.previous_hidden_states
-        self.previous_hidden_states = None
-
-    def update(self, hidden_states):
-        hidden_states = hidden_states + self.previous_residual
-        return hidden_states
-
-
-
 def lets_dance_hunyuan_video(
     dit: HunyuanVideoDiT,
     x: torch.Tensor,
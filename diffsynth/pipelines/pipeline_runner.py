@@ -1,4 +1,5 @@
 import os, torch, json
+from PIL import Image
 from .sd_video import ModelManager, SDVideoPipeline, ControlNetConfigUnit
 from ..processors.sequencial_processor import SequencialProcessor
 from ..data import VideoData, save_frames, save_video
@@ -56,7 +57,9 @@ class SDVideoPipelineRunner:
             start_frame_id = 0
         if end_frame_id is None:
             end_frame_id = len(video)
-        frames = [video[i] for i in range(start_frame_id, end_frame_id)]
+        # Decoded ahead and resized in batches, the pipelines take PIL images
+        frames = video.get_batch(range(start_frame_id, end_frame_id)).numpy()
+        frames = [Image.fromarray(frame) for frame in frames]
         return frames
 
 
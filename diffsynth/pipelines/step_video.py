@@ -5,12 +5,13 @@ from ..models.stepvideo_dit import StepVideoModel
 from ..models.stepvideo_vae import StepVideoVAE
 from ..schedulers.flow_match import FlowMatchScheduler
 from .base import BasePipeline
+from ..distributed import enable_sequence_parallel
 from ..prompters import StepVideoPrompter
 import torch
 from einops import rearrange
 import numpy as np
 from PIL import Image
-from ..vram_management import enable_vram_management, AutoWrappedModule, AutoWrappedLinear
+from ..vram_management import enable_vram_management, enable_layer_prefetch, AutoWrappedModule, AutoWrappedLinear
 from transformers.models.bert.modeling_bert import BertEmbeddings
 from ..models.stepvideo_dit import RMSNorm
 from ..models.stepvideo_vae import CausalConv, CausalConvAfterNorm, Upsample2D, BaseGroupNorm
@@ -30,7 +31,7 @@ class StepVideoPipeline(BasePipeline):
         self.model_names = ['text_encoder_1', 'text_encoder_2', 'dit', 'vae']
 
 
-    def enable_vram_management(self, num_persistent_param_in_dit=None):
+    def enable_vram_management(self, num_persistent_param_in_dit=None, enable_prefetch=False):
         dtype = next(iter(self.text_encoder_1.parameters())).dtype
         enable_vram_management(
             self.text_encoder_1,
@@ -92,6 +93,9 @@ class StepVideoPipeline(BasePipeline):
                 computation_device=self.device,
             ),
         )
+        if enable_prefetch:
+            # Overflow layers stream their weights to the device ahead of use
+            enable_layer_prefetch(self.dit, self.device)
         dtype = next(iter(self.vae.parameters())).dtype
         enable_vram_management(
             self.vae,
@@ -124,11 +128,15 @@ class StepVideoPipeline(BasePipeline):
 
 
     @staticmethod
-    def from_model_manager(model_manager: ModelManager, torch_dtype=None, device=None):
+    def from_model_manager(model_manager: ModelManager, torch_dtype=None, device=None, use_sequence_parallel=False):
         if device is None: device = model_manager.device
         if torch_dtype is None: torch_dtype = model_manager.torch_dtype
         pipe = StepVideoPipeline(device=device, torch_dtype=torch_dtype)
         pipe.fetch_models(model_manager)
+        if use_sequence_parallel:
+            # Run one process per device with torchrun, see diffsynth.distributed
+            enable_sequence_parallel(pipe.dit)
+            pipe.sequence_parallel = True
         return pipe
 
 
@@ -0,0 +1,108 @@
+import numpy as np
+
+
+
+def flux_modulated_input(dit, hidden_states, conditioning):
+    modulated_inp, _, _, _, _ = dit.blocks[0].norm1_a(hidden_states, emb=conditioning)
+    return modulated_inp
+
+
+def hunyuan_video_modulated_input(dit, img, vec):
+    img_mod1_shift, img_mod1_scale, _, _, _, _ = dit.double_blocks[0].component_a.mod(vec).chunk(6, dim=-1)
+    normed_inp = dit.double_blocks[0].component_a.norm1(img)
+    return normed_inp * (1 + img_mod1_scale.unsqueeze(1)) + img_mod1_shift.unsqueeze(1)
+
+
+def wan_video_modulated_input(dit, x, t_mod):
+    # The timestep modulation alone predicts the output change of Wan 2.1 well
+    return t_mod
+
+
+TEA_CACHE_MODULATED_INPUT = {
+    "flux": flux_modulated_input,
+    "hunyuan_video": hunyuan_video_modulated_input,
+    "wan_video": wan_video_modulated_input,
+}
+
+
+# Polynomials mapping the relative L1 change of the modulated input to the relative L1 change of the output.
+# A model is only registered once its polynomial is fitted, so that thresholds mean the same everywhere.
+TEA_CACHE_COEFFICIENTS = {
+    "flux": [4.98651651e+02, -2.83781631e+02, 5.58554382e+01, -3.82021401e+00, 2.64230861e-01],
+    "hunyuan_video": [7.33226126e+02, -4.01131952e+02, 6.75869174e+01, -3.14987800e+00, 9.61237896e-02],
+    "Wan2.1-T2V-1.3B": [-5.21862437e+04, 9.23041404e+03, -5.28275948e+02, 1.36987616e+01, -4.99875664e-02],
+    "Wan2.1-T2V-14B": [-3.03318725e+05, 4.90537029e+04, -2.65530556e+03, 5.87365115e+01, -3.15583525e-01],
+    "Wan2.1-I2V-14B-480P": [2.57151496e+05, -3.54229917e+04, 1.40286849e+03, -1.35890334e+01, 1.32517977e-01],
+    "Wan2.1-I2V-14B-720P": [8.10705460e+03, 2.13393892e+03, -3.72934672e+02, 1.66203073e+01, -4.17769401e-02],
+}
+
+
+
+class TeaCache:
+    """
+    Timestep-aware residual cache shared by the DiT pipelines.
+
+    On every call the DiT reports its modulated input. While the accumulated (rescaled) relative
+    change of that input stays below `rel_l1_thresh`, the block stack is skipped and the residual
+    it produced on the last computed step is added instead. The first and last steps are always
+    computed.
+
+    Args:
+        num_inference_steps (int): Number of calls per generation.
+        rel_l1_thresh (float): Skip threshold. Higher values skip more steps at lower quality.
+        model_type (str): Key of TEA_CACHE_MODULATED_INPUT.
+        model_id (str): Key of TEA_CACHE_COEFFICIENTS. Defaults to model_type.
+    """
+    def __init__(self, num_inference_steps, rel_l1_thresh, model_type, model_id=None):
+        self.num_inference_steps = num_inference_steps
+        self.step = 0
+        self.accumulated_rel_l1_distance = 0
+        self.previous_modulated_input = None
+        self.rel_l1_thresh = rel_l1_thresh
+        self.previous_residual = None
+        self.previous_hidden_states = None
+        self.modulated_input_fn = TEA_CACHE_MODULATED_INPUT[model_type]
+        self.rescale_func = np.poly1d(TEA_CACHE_COEFFICIENTS[model_type if model_id is None else model_id])
+        self.num_computed = 0
+        self.num_skipped = 0
+
+    def check(self, dit, hidden_states, *args):
+        """Returns True if the block stack can be skipped on this step."""
+        modulated_inp = self.modulated_input_fn(dit, hidden_states, *args)
+        if self.step == 0 or self.step == self.num_inference_steps - 1 or self.previous_residual is None:
+            should_calc = True
+            self.accumulated_rel_l1_distance = 0
+        else:
+            rel_l1_distance = (modulated_inp - self.previous_modulated_input).abs().mean() / self.previous_modulated_input.abs().mean()
+            self.accumulated_rel_l1_distance += self.rescale_func(rel_l1_distance.cpu().item())
+            if self.accumulated_rel_l1_distance < self.rel_l1_thresh:
+                should_calc = False
+            else:
+                should_calc = True
+                self.accumulated_rel_l1_distance = 0
+        self.previous_modulated_input = modulated_inp
+        self.step += 1
+        if self.step == self.num_inference_steps:
+            self.step = 0
+        if should_calc:
+            self.previous_hidden_states = hidden_states.clone()
+            self.num_computed += 1
+        else:
+            self.num_skipped += 1
+        return not should_calc
+
+    def store(self, hidden_states):
+        self.previous_residual = hidden_states - self.previous_hidden_states
+        self.previous_hidden_states = None
+
+    def update(self, hidden_states):
+        hidden_states = hidden_states + self.previous_residual
+        return hidden_states
+
+    def stats(self):
+        return {"computed": self.num_computed, "skipped": self.num_skipped}
+
+    def report(self):
+        total = self.num_computed + self.num_skipped
+        if total > 0:
+            print(f"TeaCache skipped {self.num_skipped} / {total} DiT forwards.")
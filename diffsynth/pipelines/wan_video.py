@@ -5,14 +5,17 @@ from ..models.wan_video_vae import WanVideoVAE
 from ..models.wan_video_image_encoder import WanImageEncoder
 from ..schedulers.flow_match import FlowMatchScheduler
 from .base import BasePipeline
+from ..distributed import enable_sequence_parallel
+from .tea_cache import TeaCache
 from ..prompters import WanPrompter
-import torch, os
+import torch, os, copy
 from einops import rearrange
 import numpy as np
 from PIL import Image
 from tqdm import tqdm
 
-from ..vram_management import enable_vram_management, AutoWrappedModule, AutoWrappedLinear
+from ..vram_management import enable_vram_management, enable_layer_prefetch, AutoWrappedModule, AutoWrappedLinear
+from ..vram_management import VRAMPlanner, save_vram_plan, load_vram_plan, quantized_module_map
 from ..models.wan_video_text_encoder import T5RelativeEmbedding, T5LayerNorm
 from ..models.wan_video_dit import WanLayerNorm, WanRMSNorm
 from ..models.wan_video_vae import RMS_norm, CausalConv3d, Upsample
@@ -32,57 +35,22 @@ class WanVideoPipeline(BasePipeline):
         self.model_names = ['text_encoder', 'dit', 'vae']
 
 
-    def enable_vram_management(self, num_persistent_param_in_dit=None):
-        dtype = next(iter(self.text_encoder.parameters())).dtype
-        enable_vram_management(
-            self.text_encoder,
-            module_map = {
+    def vram_management_module_maps(self, dit_quantization=None):
+        module_maps = {
+            "text_encoder": {
                 torch.nn.Linear: AutoWrappedLinear,
                 torch.nn.Embedding: AutoWrappedModule,
                 T5RelativeEmbedding: AutoWrappedModule,
                 T5LayerNorm: AutoWrappedModule,
             },
-            module_config = dict(
-                offload_dtype=dtype,
-                offload_device="cpu",
-                onload_dtype=dtype,
-                onload_device="cpu",
-                computation_dtype=self.torch_dtype,
-                computation_device=self.device,
-            ),
-        )
-        dtype = next(iter(self.dit.parameters())).dtype
-        enable_vram_management(
-            self.dit,
-            module_map = {
+            "dit": {
                 torch.nn.Linear: AutoWrappedLinear,
                 torch.nn.Conv3d: AutoWrappedModule,
                 torch.nn.LayerNorm: AutoWrappedModule,
                 WanLayerNorm: AutoWrappedModule,
                 WanRMSNorm: AutoWrappedModule,
             },
-            module_config = dict(
-                offload_dtype=dtype,
-                offload_device="cpu",
-                onload_dtype=dtype,
-                onload_device=self.device,
-                computation_dtype=self.torch_dtype,
-                computation_device=self.device,
-            ),
-            max_num_param=num_persistent_param_in_dit,
-            overflow_module_config = dict(
-                offload_dtype=dtype,
-                offload_device="cpu",
-                onload_dtype=dtype,
-                onload_device="cpu",
-                computation_dtype=self.torch_dtype,
-                computation_device=self.device,
-            ),
-        )
-        dtype = next(iter(self.vae.parameters())).dtype
-        enable_vram_management(
-            self.vae,
-            module_map = {
+            "vae": {
                 torch.nn.Linear: AutoWrappedLinear,
                 torch.nn.Conv2d: AutoWrappedModule,
                 RMS_norm: AutoWrappedModule,
@@ -91,33 +59,118 @@ class WanVideoPipeline(BasePipeline):
                 torch.nn.SiLU: AutoWrappedModule,
                 torch.nn.Dropout: AutoWrappedModule,
             },
-            module_config = dict(
+            "image_encoder": {
+                torch.nn.Linear: AutoWrappedLinear,
+                torch.nn.Conv2d: AutoWrappedModule,
+                torch.nn.LayerNorm: AutoWrappedModule,
+            },
+        }
+        module_maps["dit"] = quantized_module_map(module_maps["dit"], dit_quantization)
+        return module_maps
+
+
+    def plan_vram_management(self, budget_bytes=None, plan_path=None, num_inference_steps=50, cfg_scale=5.0, batch_cfg=False):
+        # Call before enable_vram_management and pass the result (or plan_path) as vram_plan
+        planner = VRAMPlanner(budget_bytes=budget_bytes, device=self.device)
+        module_maps = self.vram_management_module_maps()
+        dit_forwards_per_step = 1 if cfg_scale == 1.0 or batch_cfg else 2
+        forwards_per_step = {
+            "dit": dit_forwards_per_step,
+            "text_encoder": dit_forwards_per_step / num_inference_steps,
+            "vae": 1 / num_inference_steps,
+            "image_encoder": 1 / num_inference_steps,
+        }
+        for model_name, forwards in forwards_per_step.items():
+            model = getattr(self, model_name)
+            if model is not None:
+                planner.add_model(model_name, model, module_maps[model_name], forwards_per_step=forwards)
+                self.profile_vram_model(planner, model_name, model)
+        plan = planner.plan()
+        if plan_path is not None:
+            save_vram_plan(plan, plan_path)
+        return plan
+
+
+    def profile_vram_model(self, planner, model_name, model):
+        # Counts module calls in one forward on tiny dummy inputs. The DiT and the text encoder run on
+        # meta tensors, so nothing is computed and no weights are copied, whatever their size or device.
+        # Modules that are never called (e.g. the VAE encoder of a text-to-video pipeline) are not kept resident.
+        param = next(iter(model.parameters()))
+        dtype, device = param.dtype, param.device
+        meta_state_dict = {name: torch.empty_like(tensor, device="meta") for name, tensor in list(model.named_parameters()) + list(model.named_buffers())}
+        if model_name == "dit":
+            x = torch.zeros((1, 16, 1, 4, 4), dtype=dtype, device="meta")
+            inputs = dict(timestep=torch.tensor([500.0], device="meta"), context=torch.zeros((1, 8, model.text_dim), dtype=dtype, device="meta"), seq_len=4)
+            if model.model_type == "i2v":
+                inputs["clip_fea"] = torch.zeros((1, 257, 1280), dtype=dtype, device="meta")
+                inputs["y"] = torch.zeros((1, model.in_dim - 16, 1, 4, 4), dtype=dtype, device="meta")
+            run_fn = lambda: torch.func.functional_call(model, meta_state_dict, (x,), inputs)
+        elif model_name == "text_encoder":
+            ids = torch.ones((1, 8), dtype=torch.long, device="meta")
+            run_fn = lambda: torch.func.functional_call(model, meta_state_dict, (ids, ids))
+        elif model_name == "vae":
+            def run_fn():
+                if self.image_encoder is not None:
+                    # Image-to-video encodes the input image once
+                    model.encode([torch.zeros((3, 5, 32, 32), dtype=dtype)], device=device)
+                model.decode(torch.zeros((1, 16, 2, 4, 4), dtype=dtype), device=device)
+        else:
+            run_fn = lambda: model.encode_image([torch.zeros((1, 3, 32, 32), dtype=dtype, device=device)])
+        # The DiT moves freqs (a plain attribute, not a buffer) to the input device and caches rotations,
+        # which would leave meta tensors behind for the next real forward
+        saved_attributes = {name: copy.copy(getattr(model, name)) for name in ["freqs", "rope_cache"] if hasattr(model, name)}
+        try:
+            with torch.no_grad(), torch.amp.autocast(dtype=dtype, device_type=device.type, enabled=dtype in (torch.float16, torch.bfloat16)):
+                planner.profile(model_name, run_fn)
+        except Exception as e:
+            # Without a profile every module counts as called once per forward
+            print(f"Error profiling {model_name} for the VRAM plan: {str(e)}")
+        finally:
+            for name, value in saved_attributes.items():
+                setattr(model, name, value)
+
+
+    def enable_vram_management(self, num_persistent_param_in_dit=None, enable_prefetch=False, vram_plan=None, dit_quantization=None):
+        # dit_quantization ("int8" or "int4") stores the linear weights of the DiT quantized
+        module_maps = self.vram_management_module_maps(dit_quantization)
+        plan = None if vram_plan is None else load_vram_plan(vram_plan)["models"]
+        for model_name in ["text_encoder", "dit", "vae", "image_encoder"]:
+            model = getattr(self, model_name)
+            if model is None:
+                continue
+            dtype = next(iter(model.parameters())).dtype
+            offload_config = dict(
                 offload_dtype=dtype,
                 offload_device="cpu",
                 onload_dtype=dtype,
-                onload_device=self.device,
+                onload_device="cpu",
                 computation_dtype=self.torch_dtype,
                 computation_device=self.device,
-            ),
-        )
-        if self.image_encoder is not None:
-            dtype = next(iter(self.image_encoder.parameters())).dtype
-            enable_vram_management(
-                self.image_encoder,
-                module_map = {
-                    torch.nn.Linear: AutoWrappedLinear,
-                    torch.nn.Conv2d: AutoWrappedModule,
-                    torch.nn.LayerNorm: AutoWrappedModule,
-                },
-                module_config = dict(
-                    offload_dtype=dtype,
-                    offload_device="cpu",
-                    onload_dtype=dtype,
-                    onload_device="cpu",
-                    computation_dtype=self.torch_dtype,
-                    computation_device=self.device,
-                ),
             )
+            resident_config = dict(offload_config, onload_device=self.device)
+            if plan is not None and model_name in plan:
+                enable_vram_management(
+                    model,
+                    module_map = module_maps[model_name],
+                    module_config = resident_config,
+                    overflow_module_config = offload_config,
+                    persistent_module_names = plan[model_name]["resident_modules"],
+                )
+            elif model_name == "dit":
+                enable_vram_management(
+                    model,
+                    module_map = module_maps[model_name],
+                    module_config = resident_config,
+                    max_num_param=num_persistent_param_in_dit,
+                    overflow_module_config = offload_config,
+                )
+            elif model_name == "vae":
+                enable_vram_management(model, module_map=module_maps[model_name], module_config=resident_config)
+            else:
+                enable_vram_management(model, module_map=module_maps[model_name], module_config=offload_config)
+        if enable_prefetch:
+            # Overflow layers stream their weights to the device ahead of use
+            enable_layer_prefetch(self.dit, self.device)
         self.enable_cpu_offload()
 
 
@@ -133,11 +186,15 @@ class WanVideoPipeline(BasePipeline):
 
 
     @staticmethod
-    def from_model_manager(model_manager: ModelManager, torch_dtype=None, device=None):
+    def from_model_manager(model_manager: ModelManager, torch_dtype=None, device=None, use_sequence_parallel=False):
         if device is None: device = model_manager.device
         if torch_dtype is None: torch_dtype = model_manager.torch_dtype
         pipe = WanVideoPipeline(device=device, torch_dtype=torch_dtype)
         pipe.fetch_models(model_manager)
+        if use_sequence_parallel:
+            # Run one process per device with torchrun, see diffsynth.distributed
+            enable_sequence_parallel(pipe.dit)
+            pipe.sequence_parallel = True
         return pipe
     
     
@@ -164,9 +221,38 @@ class WanVideoPipeline(BasePipeline):
         return {"clip_fea": clip_context, "y": [y]}
 
 
-    def tensor2video(self, frames):
+    def prepare_cfg_batch(self, prompt_emb_posi, prompt_emb_nega, image_emb):
+        # WanModel pads every text embedding to text_len, so prompts of different lengths can be batched
+        prompt_emb = {"context": prompt_emb_posi["context"] + prompt_emb_nega["context"]}
+        if "clip_fea" in image_emb:
+            image_emb = {
+                "clip_fea": torch.concat([image_emb["clip_fea"], image_emb["clip_fea"]], dim=0),
+                "y": image_emb["y"] + image_emb["y"],
+            }
+        return prompt_emb, image_emb
+
+
+    def prepare_tea_cache(self, num_inference_steps, tea_cache_l1_thresh, tea_cache_model_id=None):
+        if tea_cache_l1_thresh is None:
+            return None
+        if tea_cache_model_id is None:
+            # The 720P I2V model must be selected explicitly, its architecture matches the 480P one
+            if self.dit.model_type == "i2v":
+                tea_cache_model_id = "Wan2.1-I2V-14B-480P"
+            elif self.dit.dim == 1536:
+                tea_cache_model_id = "Wan2.1-T2V-1.3B"
+            else:
+                tea_cache_model_id = "Wan2.1-T2V-14B"
+        return TeaCache(num_inference_steps, rel_l1_thresh=tea_cache_l1_thresh, model_type="wan_video", model_id=tea_cache_model_id)
+
+
+    def tensor2video(self, frames, output_type="pil"):
+        # Converted to uint8 before leaving the device, which moves a quarter of the bytes.
+        # output_type="np" returns a uint8 [T, H, W, C] array that save_video writes without PIL.
         frames = rearrange(frames, "C T H W -> T H W C")
-        frames = ((frames.float() + 1) * 127.5).clip(0, 255).cpu().numpy().astype(np.uint8)
+        frames = ((frames.float() + 1) * 127.5).clip(0, 255).to(torch.uint8).cpu().numpy()
+        if output_type == "np":
+            return frames
         frames = [Image.fromarray(frame) for frame in frames]
         return frames
     
@@ -187,6 +273,21 @@ class WanVideoPipeline(BasePipeline):
         return frames
 
 
+    @torch.no_grad()
+    def decode_video_stream(self, latents, tiled=True, tile_size=(34, 34), tile_stride=(18, 16), output_type="pil"):
+        """Yields the frames (PIL images, or uint8 arrays for output_type="np") of the first video in latents as soon as the VAE decodes them."""
+        self.load_models_to_device(['vae'])
+        videos = self.vae.decode_stream(latents[0], device=self.device, tiled=tiled, tile_size=tile_size, tile_stride=tile_stride)
+        while True:
+            # Autocast is entered per chunk so that it does not leak into the consumer between frames
+            with torch.amp.autocast(dtype=torch.bfloat16, device_type=torch.device(self.device).type):
+                video = next(videos, None)
+            if video is None:
+                break
+            yield from self.tensor2video(video, output_type)
+        self.load_models_to_device([])
+
+
     @torch.no_grad()
     def __call__(
         self,
@@ -205,6 +306,11 @@ class WanVideoPipeline(BasePipeline):
         tiled=True,
         tile_size=(30, 52),
         tile_stride=(15, 26),
+        batch_cfg=False,
+        tea_cache_l1_thresh=None,
+        tea_cache_model_id=None,
+        stream_output=False,
+        output_type="pil",
         progress_bar_cmd=tqdm,
         progress_bar_st=None,
     ):
@@ -225,8 +331,12 @@ class WanVideoPipeline(BasePipeline):
         else:
             latents = noise
         
-        # Encode prompts
-        self.load_models_to_device(["text_encoder"])
+        # Encode prompts, the text encoder is only loaded if an embedding is not cached
+        prompts_cached = self.prompter.has_cached_embedding(prompt, positive=True)
+        if cfg_scale != 1.0:
+            prompts_cached = prompts_cached and self.prompter.has_cached_embedding(negative_prompt, positive=False)
+        if not prompts_cached:
+            self.load_models_to_device(["text_encoder"])
         prompt_emb_posi = self.encode_prompt(prompt, positive=True)
         if cfg_scale != 1.0:
             prompt_emb_nega = self.encode_prompt(negative_prompt, positive=False)
@@ -241,6 +351,14 @@ class WanVideoPipeline(BasePipeline):
         # Extra input
         extra_input = self.prepare_extra_input(latents)
 
+        # Positive and negative prompts share one DiT forward with batch size 2
+        if batch_cfg and cfg_scale != 1.0:
+            prompt_emb_cfg, image_emb_cfg = self.prepare_cfg_batch(prompt_emb_posi, prompt_emb_nega, image_emb)
+
+        # TeaCache (positive and negative sides keep separate residuals)
+        tea_cache_posi = self.prepare_tea_cache(num_inference_steps, tea_cache_l1_thresh, tea_cache_model_id)
+        tea_cache_nega = self.prepare_tea_cache(num_inference_steps, tea_cache_l1_thresh, tea_cache_model_id)
+
         # Denoise
         self.load_models_to_device(["dit"])
         with torch.amp.autocast(dtype=torch.bfloat16, device_type=torch.device(self.device).type):
@@ -248,20 +366,30 @@ class WanVideoPipeline(BasePipeline):
                 timestep = timestep.unsqueeze(0).to(dtype=torch.float32, device=self.device)
 
                 # Inference
-                noise_pred_posi = self.dit(latents, timestep=timestep, **prompt_emb_posi, **image_emb, **extra_input)
-                if cfg_scale != 1.0:
-                    noise_pred_nega = self.dit(latents, timestep=timestep, **prompt_emb_nega, **image_emb, **extra_input)
+                if batch_cfg and cfg_scale != 1.0:
+                    latents_cfg = torch.concat([latents, latents], dim=0)
+                    noise_pred_posi, noise_pred_nega = self.dit(latents_cfg, timestep=timestep, **prompt_emb_cfg, **image_emb_cfg, **extra_input, tea_cache=tea_cache_posi).chunk(2, dim=0)
+                    noise_pred = noise_pred_nega + cfg_scale * (noise_pred_posi - noise_pred_nega)
+                elif cfg_scale != 1.0:
+                    noise_pred_posi = self.dit(latents, timestep=timestep, **prompt_emb_posi, **image_emb, **extra_input, tea_cache=tea_cache_posi)
+                    noise_pred_nega = self.dit(latents, timestep=timestep, **prompt_emb_nega, **image_emb, **extra_input, tea_cache=tea_cache_nega)
                     noise_pred = noise_pred_nega + cfg_scale * (noise_pred_posi - noise_pred_nega)
                 else:
-                    noise_pred = noise_pred_posi
+                    noise_pred = self.dit(latents, timestep=timestep, **prompt_emb_posi, **image_emb, **extra_input, tea_cache=tea_cache_posi)
 
                 # Scheduler
                 latents = self.scheduler.step(noise_pred, self.scheduler.timesteps[progress_id], latents)
 
+        if tea_cache_posi is not None:
+            tea_cache_posi.report()
+
         # Decode
+        if stream_output:
+            # Frames are decoded while the caller consumes them, e.g. save_video(pipe(..., stream_output=True), ...)
+            return self.decode_video_stream(latents, output_type=output_type, **tiler_kwargs)
         self.load_models_to_device(['vae'])
         frames = self.decode_video(latents, **tiler_kwargs)
         self.load_models_to_device([])
-        frames = self.tensor2video(frames[0])
+        frames = self.tensor2video(frames[0], output_type)
 
         return frames
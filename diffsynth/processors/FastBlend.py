@@ -1,8 +1,8 @@
 from PIL import Image
-import cupy as cp
 import numpy as np
 from tqdm import tqdm
 from ..extensions.FastBlend.patch_match import PyramidPatchMatcher
+from ..extensions.FastBlend.backends import get_backend
 from ..extensions.FastBlend.runners.fast import TableManager
 from .base import VideoProcessor
 
@@ -11,7 +11,8 @@ class FastBlendSmoother(VideoProcessor):
     def __init__(
         self,
         inference_mode="fast", batch_size=8, window_size=60,
-        minimum_patch_size=5, threads_per_block=8, num_iter=5, gpu_id=0, guide_weight=10.0, initialize="identity", tracking_window_size=0
+        minimum_patch_size=5, threads_per_block=8, num_iter=5, gpu_id=0, guide_weight=10.0, initialize="identity", tracking_window_size=0,
+        backend="auto"
     ):
         self.inference_mode = inference_mode
         self.batch_size = batch_size
@@ -23,7 +24,9 @@ class FastBlendSmoother(VideoProcessor):
             "gpu_id": gpu_id,
             "guide_weight": guide_weight,
             "initialize": initialize,
-            "tracking_window_size": tracking_window_size
+            "tracking_window_size": tracking_window_size,
+            # "cupy" (CUDA), "cpu" (NumPy/torch) or "auto"
+            "backend": get_backend(backend, gpu_id=gpu_id, threads_per_block=threads_per_block),
         }
 
     @staticmethod
@@ -122,10 +125,7 @@ class FastBlendSmoother(VideoProcessor):
         return output_frames
     
     def release_vram(self):
-        mempool = cp.get_default_memory_pool()
-        pinned_mempool = cp.get_default_pinned_memory_pool()
-        mempool.free_all_blocks()
-        pinned_mempool.free_all_blocks()
+        self.ebsynth_config["backend"].release_memory()
     
     def __call__(self, rendered_frames, original_frames=None, **kwargs):
         rendered_frames = [np.array(frame) for frame in rendered_frames]
@@ -1,4 +1,5 @@
 from ..models.model_manager import ModelManager
+from .embedding_cache import default_embedding_cache
 import torch
 
 
@@ -40,6 +41,33 @@ class BasePrompter:
     def __init__(self):
         self.refiners = []
         self.extenders = []
+        self.embedding_cache = default_embedding_cache
+
+
+    def set_embedding_cache(self, cache):
+        # Pass None to disable the cache, or a PromptEmbeddingCache (e.g. with a cache_dir)
+        self.embedding_cache = cache
+
+
+    def embedding_cacheable(self):
+        return (
+            getattr(self, "embedding_cache", None) is not None
+            and hasattr(type(self).encode_prompt, "signature")
+            and len(self.refiners) == 0 and len(self.extenders) == 0
+        )
+
+
+    def embedding_cache_key(self, *args, **kwargs):
+        arguments = type(self).encode_prompt.signature.bind(self, *args, **kwargs)
+        arguments.apply_defaults()
+        arguments = dict(arguments.arguments)
+        arguments.pop("self")
+        return self.embedding_cache.make_key(self, arguments)
+
+
+    def has_cached_embedding(self, *args, **kwargs):
+        """Returns True if encode_prompt(*args, **kwargs) will be served from the cache, so the text encoder need not be loaded."""
+        return self.embedding_cacheable() and self.embedding_cache_key(*args, **kwargs) in self.embedding_cache
 
 
     def load_prompt_refiners(self, model_manager: ModelManager, refiner_classes=[]):
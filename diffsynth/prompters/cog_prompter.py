@@ -1,4 +1,5 @@
 from .base_prompter import BasePrompter
+from .embedding_cache import cache_prompt_embedding
 from ..models.flux_text_encoder import FluxTextEncoder2
 from transformers import T5TokenizerFast
 import os
@@ -35,6 +36,7 @@ class CogPrompter(BasePrompter):
         return prompt_emb
     
 
+    @cache_prompt_embedding
     def encode_prompt(
         self,
         prompt,
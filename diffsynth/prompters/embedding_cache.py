@@ -0,0 +1,187 @@
+import os, hashlib, inspect, functools, itertools, weakref
+from collections import OrderedDict
+import torch
+
+
+
+def map_tensors(data, fn):
+    if isinstance(data, torch.Tensor):
+        return fn(data)
+    if isinstance(data, (list, tuple)):
+        return type(data)(map_tensors(item, fn) for item in data)
+    if isinstance(data, dict):
+        return {key: map_tensors(value, fn) for key, value in data.items()}
+    return data
+
+
+
+checksum_int_dtypes = {1: torch.uint8, 2: torch.int16, 4: torch.int32, 8: torch.int64}
+# A prime, so that the position weights of consecutive elements never line up with a power of two
+checksum_period = 65521
+checksum_chunk_size = checksum_period * 256
+
+
+def tensor_checksum(tensor: torch.Tensor):
+    """
+    Exact checksum of the raw bits of tensor, computed on its device.
+
+    Every element is weighted by its position (modulo a prime) and summed in int64, so changing
+    any single element always changes the checksum. Reading the weights where they are is much
+    faster than copying them to the CPU for hashlib.
+    """
+    flat = tensor.detach().reshape(-1)
+    if flat.dtype == torch.bool:
+        flat = flat.to(torch.uint8)
+    flat = flat.view(checksum_int_dtypes[flat.element_size()])
+    weights = torch.arange(min(checksum_chunk_size, flat.numel()), device=flat.device, dtype=torch.int64) % checksum_period + 1
+    total = torch.zeros((), device=flat.device, dtype=torch.int64)
+    for start in range(0, flat.numel(), checksum_chunk_size):
+        chunk = flat[start: start + checksum_chunk_size].to(torch.int64)
+        total += (chunk * weights[:chunk.numel()]).sum()
+    return total.item()
+
+
+class PromptEmbeddingCache:
+    """
+    Least recently used cache of prompt embeddings, shared by every prompter.
+
+    Embeddings are kept in RAM and moved back to their device on a hit, so repeated prompts
+    (e.g. the fixed negative prompt of a tab) skip the text encoders. With `cache_dir`, entries
+    are also written to disk and survive restarts.
+
+    Keys combine a fingerprint of the text encoder weights (see module_fingerprint), the
+    tokenizers, the prompt and every other encode_prompt argument (positive flag, sequence
+    lengths, device).
+    """
+    def __init__(self, max_entries=32, cache_dir=None):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.entries = OrderedDict()
+        self.fingerprints = weakref.WeakKeyDictionary()
+        self.tokens = itertools.count()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+
+    def module_fingerprint(self, module: torch.nn.Module):
+        """
+        Identifies the weights of a text encoder.
+
+        In memory, every parameter object gets its own token, combined with its version counter,
+        which changes with every in-place edit (e.g. a fused LoRA). This is exact and free, but only
+        valid in this process. With `cache_dir`, the keys use a checksum of the full weights instead,
+        computed again whenever the weights change.
+        """
+        params = list(module.parameters())
+        for param in params:
+            if not hasattr(param, "embedding_cache_token"):
+                param.embedding_cache_token = next(self.tokens)
+        local_fingerprint = tuple((param.embedding_cache_token, param._version) for param in params)
+        if self.cache_dir is None:
+            return hashlib.sha1(repr(local_fingerprint).encode()).hexdigest()
+        cached = self.fingerprints.get(module)
+        if cached is not None and cached[0] == local_fingerprint:
+            return cached[1]
+        digest = hashlib.sha1(type(module).__name__.encode())
+        for param in params:
+            digest.update(f"{tuple(param.shape)}{param.dtype}{tensor_checksum(param)}".encode())
+        fingerprint = digest.hexdigest()
+        self.fingerprints[module] = (local_fingerprint, fingerprint)
+        return fingerprint
+
+
+    def make_key(self, prompter, arguments):
+        encoders, tokenizers = [], []
+        for name, value in sorted(vars(prompter).items()):
+            if isinstance(value, torch.nn.Module):
+                encoders.append((name, self.module_fingerprint(value)))
+            elif "tokenizer" in name and value is not None:
+                # The vocabulary size changes when textual inversion tokens are added
+                vocab_size = len(value) if hasattr(value, "__len__") else None
+                tokenizers.append((name, type(value).__name__, str(getattr(value, "name_or_path", getattr(value, "name", ""))), vocab_size))
+        arguments = tuple((name, str(value) if isinstance(value, torch.device) else value) for name, value in arguments.items())
+        return repr((type(prompter).__name__, tuple(encoders), tuple(tokenizers), arguments))
+
+
+    def file_path(self, key):
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode()).hexdigest() + ".pt")
+
+
+    def __contains__(self, key):
+        return key in self.entries or (self.cache_dir is not None and os.path.exists(self.file_path(key)))
+
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+        elif self.cache_dir is not None and os.path.exists(self.file_path(key)):
+            entry = torch.load(self.file_path(key), map_location="cpu", weights_only=False)
+            self.put(key, entry, write_to_disk=False)
+            self.disk_hits += 1
+        else:
+            self.misses += 1
+            return None
+        embeddings, devices = entry
+        devices = iter(devices)
+        # Always a copy, so that in-place changes by the caller never reach the cache
+        return map_tensors(embeddings, lambda tensor: tensor.to(device=next(devices), copy=True))
+
+
+    def put(self, key, entry, write_to_disk=True):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        if write_to_disk and self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            file_path = self.file_path(key)
+            torch.save(entry, file_path + ".tmp")
+            os.replace(file_path + ".tmp", file_path)
+
+
+    def store(self, key, embeddings):
+        devices = []
+        def to_cpu(tensor):
+            devices.append(str(tensor.device))
+            return tensor.detach().to("cpu", copy=True)
+        self.put(key, (map_tensors(embeddings, to_cpu), devices))
+
+
+    def clear(self):
+        self.entries.clear()
+
+
+    def stats(self):
+        return {"entries": len(self.entries), "hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses}
+
+
+
+default_embedding_cache = PromptEmbeddingCache()
+
+
+
+def cache_prompt_embedding(encode_prompt):
+    """
+    Serves encode_prompt from the prompter's embedding cache.
+
+    Prompters with refiners or extenders are not cached, because these may rewrite the same
+    prompt differently on every call.
+    """
+    signature = inspect.signature(encode_prompt)
+
+    @functools.wraps(encode_prompt)
+    def wrapper(self, *args, **kwargs):
+        if not self.embedding_cacheable():
+            return encode_prompt(self, *args, **kwargs)
+        key = self.embedding_cache_key(*args, **kwargs)
+        embeddings = self.embedding_cache.get(key)
+        if embeddings is None:
+            embeddings = encode_prompt(self, *args, **kwargs)
+            self.embedding_cache.store(key, embeddings)
+        return embeddings
+
+    wrapper.signature = signature
+    return wrapper
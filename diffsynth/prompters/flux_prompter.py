@@ -1,4 +1,5 @@
 from .base_prompter import BasePrompter
+from .embedding_cache import cache_prompt_embedding
 from ..models.flux_text_encoder import FluxTextEncoder2
 from ..models.sd3_text_encoder import SD3TextEncoder1
 from transformers import CLIPTokenizer, T5TokenizerFast
@@ -53,6 +54,7 @@ class FluxPrompter(BasePrompter):
         return prompt_emb
     
 
+    @cache_prompt_embedding
     def encode_prompt(
         self,
         prompt,
@@ -1,4 +1,5 @@
 from .base_prompter import BasePrompter
+from .embedding_cache import cache_prompt_embedding
 from ..models.model_manager import ModelManager
 from ..models import HunyuanDiTCLIPTextEncoder, HunyuanDiTT5TextEncoder
 from transformers import BertTokenizer, AutoTokenizer
@@ -50,6 +51,7 @@ class HunyuanDiTPrompter(BasePrompter):
         return prompt_embeds, attention_mask
     
 
+    @cache_prompt_embedding
     def encode_prompt(
         self,
         prompt,
@@ -1,4 +1,5 @@
 from .base_prompter import BasePrompter
+from .embedding_cache import cache_prompt_embedding
 from ..models.sd3_text_encoder import SD3TextEncoder1
 from ..models.hunyuan_video_text_encoder import HunyuanVideoLLMEncoder
 from transformers import CLIPTokenizer, LlamaTokenizerFast
@@ -107,6 +108,7 @@ class HunyuanVideoPrompter(BasePrompter):
 
         return last_hidden_state, attention_mask
 
+    @cache_prompt_embedding
     def encode_prompt(self,
                       prompt,
                       positive=True,
@@ -1,4 +1,5 @@
 from .base_prompter import BasePrompter
+from .embedding_cache import cache_prompt_embedding
 from ..models.model_manager import ModelManager
 import json, os, re
 from typing import List, Optional, Union, Dict
@@ -340,6 +341,7 @@ class KolorsPrompter(BasePrompter):
         return prompt_emb, pooled_prompt_emb
     
 
+    @cache_prompt_embedding
     def encode_prompt(
         self,
         prompt,
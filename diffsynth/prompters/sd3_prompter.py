@@ -1,4 +1,5 @@
 from .base_prompter import BasePrompter
+from .embedding_cache import cache_prompt_embedding
 from ..models.model_manager import ModelManager
 from ..models import SD3TextEncoder1, SD3TextEncoder2, SD3TextEncoder3
 from transformers import CLIPTokenizer, T5TokenizerFast
@@ -63,6 +64,7 @@ class SD3Prompter(BasePrompter):
         return prompt_emb
     
 
+    @cache_prompt_embedding
     def encode_prompt(
         self,
         prompt,
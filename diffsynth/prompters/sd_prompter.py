@@ -1,4 +1,5 @@
 from .base_prompter import BasePrompter, tokenize_long_prompt
+from .embedding_cache import cache_prompt_embedding
 from ..models.utils import load_state_dict, search_for_embeddings
 from ..models import SDTextEncoder
 from transformers import CLIPTokenizer
@@ -60,6 +61,7 @@ class SDPrompter(BasePrompter):
         self.add_textual_inversions_to_tokenizer(self.textual_inversion_dict, self.tokenizer)
 
 
+    @cache_prompt_embedding
     def encode_prompt(self, prompt, clip_skip=1, device="cuda", positive=True):
         prompt = self.process_prompt(prompt, positive=positive)
         for keyword in self.keyword_dict:
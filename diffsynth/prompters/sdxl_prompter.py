@@ -1,4 +1,5 @@
 from .base_prompter import BasePrompter, tokenize_long_prompt
+from .embedding_cache import cache_prompt_embedding
 from ..models.model_manager import ModelManager
 from ..models import SDXLTextEncoder, SDXLTextEncoder2
 from transformers import CLIPTokenizer
@@ -30,6 +31,7 @@ class SDXLPrompter(BasePrompter):
         self.text_encoder_2 = text_encoder_2
     
     
+    @cache_prompt_embedding
     def encode_prompt(
         self,
         prompt,
@@ -1,4 +1,5 @@
 from .base_prompter import BasePrompter
+from .embedding_cache import cache_prompt_embedding
 from ..models.hunyuan_dit_text_encoder import HunyuanDiTCLIPTextEncoder
 from ..models.stepvideo_text_encoder import STEP1TextEncoder
 from transformers import BertTokenizer
@@ -41,6 +42,7 @@ class StepVideoPrompter(BasePrompter):
         y, y_mask = self.text_encoder_2(prompt, max_length=max_length, device=device)
         return y, y_mask
 
+    @cache_prompt_embedding
     def encode_prompt(self,
                       prompt,
                       positive=True,
@@ -1,4 +1,5 @@
 from .base_prompter import BasePrompter
+from .embedding_cache import cache_prompt_embedding
 from ..models.wan_video_text_encoder import WanTextEncoder
 from transformers import AutoTokenizer
 import os, torch
@@ -96,6 +97,7 @@ class WanPrompter(BasePrompter):
     def fetch_models(self, text_encoder: WanTextEncoder = None):
         self.text_encoder = text_encoder
 
+    @cache_prompt_embedding
     def encode_prompt(self, prompt, positive=True, device="cuda"):
         prompt = self.process_prompt(prompt, positive=positive)
         
@@ -1,9 +1,11 @@
 import lightning as pl
 from peft import LoraConfig, inject_adapter_in_model
-import torch, os
-from ..data.simple_text_image import TextImageDataset
+import torch, os, hashlib
+from ..data.simple_text_image import TextImageDataset, image_to_model_input, create_data_loader
+from ..data.latent_cache import build_latent_cache, CachedLatentDataset
 from modelscope.hub.api import HubApi
 from ..models.utils import load_state_dict
+from ..prompters.embedding_cache import tensor_checksum
 
 
 
@@ -33,6 +35,35 @@ class LightningModelForT2ILoRA(pl.LightningModule):
         self.pipe.eval()
         self.pipe.denoising_model().train()
 
+
+    def iter_encoders(self):
+        # The text encoders and the VAE encoder, which a latent cache replaces during training
+        for owner in [self.pipe, getattr(self.pipe, "prompter", None)]:
+            for name in dir(owner) if owner is not None else []:
+                if (name.startswith("text_encoder") or name == "vae_encoder") and isinstance(getattr(owner, name, None), torch.nn.Module):
+                    yield owner, name, getattr(owner, name)
+
+
+    def unload_encoders(self):
+        # With a latent cache, the text encoders and the VAE encoder are not needed during training
+        for owner, name, _ in list(self.iter_encoders()):
+            setattr(owner, name, None)
+        torch.cuda.empty_cache()
+
+
+    def encoder_fingerprint(self):
+        # Identifies the encoder weights, so that a latent cache of another base model is not reused
+        digest = hashlib.sha1()
+        seen = set()
+        for _, name, module in self.iter_encoders():
+            if id(module) in seen:
+                continue
+            seen.add(id(module))
+            digest.update(f"{name}:{type(module).__name__}".encode())
+            for key, tensor in module.state_dict().items():
+                digest.update(f"{key}{tuple(tensor.shape)}{tensor.dtype}{tensor_checksum(tensor)}".encode())
+        return digest.hexdigest()
+
     
     def add_lora_to_model(self, model, lora_rank=4, lora_alpha=4, lora_target_modules="to_q,to_k,to_v,to_out", init_lora_weights="gaussian", pretrained_lora_path=None, state_dict_converter=None):
         # Add LoRA to UNet
@@ -65,16 +96,19 @@ class LightningModelForT2ILoRA(pl.LightningModule):
 
 
     def training_step(self, batch, batch_idx):
-        # Data
-        text, image = batch["text"], batch["image"]
-
         # Prepare input parameters
         self.pipe.device = self.device
-        prompt_emb = self.pipe.encode_prompt(text, positive=True)
+        if "prompt_emb" in batch:
+            prompt_emb = {
+                name: value.to(dtype=self.pipe.torch_dtype, device=self.device) if value.is_floating_point() else value.to(self.device)
+                for name, value in batch["prompt_emb"].items()
+            }
+        else:
+            prompt_emb = self.pipe.encode_prompt(batch["text"], positive=True)
         if "latents" in batch:
             latents = batch["latents"].to(dtype=self.pipe.torch_dtype, device=self.device)
         else:
-            latents = self.pipe.vae_encoder(image.to(dtype=self.pipe.torch_dtype, device=self.device))
+            latents = self.pipe.vae_encoder(image_to_model_input(batch["image"], self.pipe.torch_dtype, self.device))
         noise = torch.randn_like(latents)
         timestep_id = torch.randint(0, self.pipe.scheduler.num_train_timesteps, (1,))
         timestep = self.pipe.scheduler.timesteps[timestep_id].to(self.device)
@@ -163,6 +197,18 @@ def add_general_parsers(parser):
         action="store_true",
         help="Whether to randomly flip images horizontally",
     )
+    parser.add_argument(
+        "--aspect_ratio_buckets",
+        default=False,
+        action="store_true",
+        help="Whether to resize each image to the bucket closest to its aspect ratio instead of cropping it to height x width.",
+    )
+    parser.add_argument(
+        "--fast_jpeg_decode",
+        default=False,
+        action="store_true",
+        help="Whether to decode JPEG images at a reduced scale. Faster for large photos, but the training images differ slightly from a full decode.",
+    )
     parser.add_argument(
         "--batch_size",
         type=int,
@@ -175,6 +221,12 @@ def add_general_parsers(parser):
         default=0,
         help="Number of subprocesses to use for data loading. 0 means that the data will be loaded in the main process.",
     )
+    parser.add_argument(
+        "--dataloader_prefetch_factor",
+        type=int,
+        default=4,
+        help="Number of batches loaded in advance by each data loading subprocess.",
+    )
     parser.add_argument(
         "--precision",
         type=str,
@@ -244,6 +296,18 @@ def add_general_parsers(parser):
         default=None,
         help="Access key on ModelScope (https://www.modelscope.cn/). Required if you want to upload the model to ModelScope.",
     )
+    parser.add_argument(
+        "--latent_cache_path",
+        type=str,
+        default=None,
+        help="Folder of the pre-computed latents and prompt embeddings. The dataset is encoded into it once, then the text encoders and the VAE encoder are unloaded during training.",
+    )
+    parser.add_argument(
+        "--latent_cache_repeats",
+        type=int,
+        default=1,
+        help="Number of cached crops/flips of each image. Only used with --latent_cache_path.",
+    )
     parser.add_argument(
         "--pretrained_lora_path",
         type=str,
@@ -261,13 +325,31 @@ def launch_training_task(model, args):
         height=args.height,
         width=args.width,
         center_crop=args.center_crop,
-        random_flip=args.random_flip
+        random_flip=args.random_flip,
+        aspect_ratio_buckets=getattr(args, "aspect_ratio_buckets", False),
+        uint8=True,
+        fast_jpeg_decode=getattr(args, "fast_jpeg_decode", False),
     )
-    train_loader = torch.utils.data.DataLoader(
+    latent_cache_path = getattr(args, "latent_cache_path", None)
+    if latent_cache_path is not None:
+        cache_config = {
+            "dataset_path": os.path.abspath(args.dataset_path), "height": args.height, "width": args.width,
+            "center_crop": args.center_crop, "random_flip": args.random_flip, "num_repeats": args.latent_cache_repeats,
+            "aspect_ratio_buckets": dataset.buckets is not None, "fast_jpeg_decode": dataset.fast_jpeg_decode,
+            "torch_dtype": str(model.pipe.torch_dtype), "encoders": model.encoder_fingerprint(),
+        }
+        if not CachedLatentDataset.is_available(latent_cache_path, cache_config):
+            print(f"Encoding the dataset into {latent_cache_path} ...")
+            model.pipe.to("cuda")
+            model.pipe.device = "cuda"
+            build_latent_cache(model.pipe, dataset, latent_cache_path, num_repeats=args.latent_cache_repeats, config=cache_config)
+        model.unload_encoders()
+        dataset = CachedLatentDataset(latent_cache_path, steps_per_epoch=args.steps_per_epoch * args.batch_size)
+    train_loader = create_data_loader(
         dataset,
-        shuffle=True,
         batch_size=args.batch_size,
-        num_workers=args.dataloader_num_workers
+        num_workers=args.dataloader_num_workers,
+        prefetch_factor=getattr(args, "dataloader_prefetch_factor", 4),
     )
     # train
     trainer = pl.Trainer(
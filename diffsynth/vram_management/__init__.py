@@ -1 +1,4 @@
 from .layers import *
+from .offload_engine import *
+from .planner import *
+from .quantization import *
@@ -0,0 +1,81 @@
+"""
+Measures the memory, speed and error of quantized linear layers on the CPU.
+
+    python -m diffsynth.vram_management.benchmark --features 3072 --tokens 256
+
+Every variant runs a stack of linear layers shaped like a DiT block (attention projections and
+the MLP). The reported error is relative to the float32 output. On the GPU the dequantization
+is cheaper relative to the matmul, so the speed ratios here are a worst case.
+"""
+import argparse, os, time, tempfile
+import torch
+from .quantization import QuantizedLinear, quantize_model, save_quantized_model, load_quantized_model
+
+
+def make_block(features, mlp_ratio=4):
+    return torch.nn.Sequential(
+        torch.nn.Linear(features, features * 3),
+        torch.nn.Linear(features * 3, features),
+        torch.nn.Linear(features, features * mlp_ratio),
+        torch.nn.Linear(features * mlp_ratio, features),
+    )
+
+
+def model_bytes(model):
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+
+
+@torch.no_grad()
+def run_layers(model, inputs):
+    # The layers are not chained, so that the error of one layer does not feed the next
+    return [layer(inputs[layer.in_features]) for layer in model]
+
+
+def measure(model, inputs, num_runs):
+    run_layers(model, inputs)
+    start_time = time.time()
+    for _ in range(num_runs):
+        outputs = run_layers(model, inputs)
+    return (time.time() - start_time) / num_runs, outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark int8/int4 quantized linear layers on the CPU.")
+    parser.add_argument("--features", type=int, default=3072)
+    parser.add_argument("--tokens", type=int, default=256)
+    parser.add_argument("--num_runs", type=int, default=3)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    reference = make_block(args.features)
+    inputs = {layer.in_features: torch.randn(1, args.tokens, layer.in_features) for layer in reference}
+    _, reference_outputs = measure(reference, inputs, 1)
+
+    variants = {"float32": (reference, torch.float32), "bfloat16": (make_block(args.features).to(torch.bfloat16), torch.bfloat16)}
+    variants["bfloat16"][0].load_state_dict(reference.state_dict())
+    for quantization in ["int8", "int4"]:
+        model = make_block(args.features)
+        model.load_state_dict(reference.state_dict())
+        variants[quantization] = (quantize_model(model, quantization), torch.bfloat16)
+
+    for name, (model, dtype) in variants.items():
+        seconds, outputs = measure(model, {features: x.to(dtype) for features, x in inputs.items()}, args.num_runs)
+        error = max(
+            ((output.float() - reference_output).norm() / reference_output.norm()).item()
+            for output, reference_output in zip(outputs, reference_outputs)
+        )
+        print(f"{name}: {model_bytes(model) / 2**20:.1f} MiB, {seconds * 1000:.1f} ms per block, relative error {error:.4f}")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        file_path = os.path.join(temp_dir, "block.safetensors")
+        save_quantized_model(variants["int4"][0], file_path)
+        with torch.device("meta"):
+            restored = make_block(args.features)
+        load_quantized_model(restored, file_path)
+        same = all(isinstance(layer, QuantizedLinear) and torch.equal(layer.qweight, original.qweight) for layer, original in zip(restored, variants["int4"][0]))
+        print(f"int4 file: {os.path.getsize(file_path) / 2**20:.1f} MiB, restored {'exactly' if same else 'with differences'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-import torch, copy
+import torch
 from ..models.utils import init_weights_on_device
 
 
@@ -32,10 +32,15 @@ class AutoWrappedModule(torch.nn.Module):
 
     def forward(self, *args, **kwargs):
         if self.onload_dtype == self.computation_dtype and self.onload_device == self.computation_device:
-            module = self.module
-        else:
-            module = copy.deepcopy(self.module).to(dtype=self.computation_dtype, device=self.computation_device)
-        return module(*args, **kwargs)
+            return self.module(*args, **kwargs)
+        # Run the module with cast copies of its tensors instead of deep-copying the whole module
+        tensors = {}
+        for name, tensor in list(self.module.named_parameters()) + list(self.module.named_buffers()):
+            dtype = self.computation_dtype if tensor.is_floating_point() else tensor.dtype
+            tensors[name] = cast_to(tensor, dtype, self.computation_device)
+        if len(tensors) == 0:
+            return self.module(*args, **kwargs)
+        return torch.func.functional_call(self.module, tensors, args, kwargs)
     
 
 class AutoWrappedLinear(torch.nn.Linear):
@@ -50,6 +55,7 @@ class AutoWrappedLinear(torch.nn.Linear):
         self.onload_device = onload_device
         self.computation_dtype = computation_dtype
         self.computation_device = computation_device
+        self.offload_engine = None
         self.state = 0
 
     def offload(self):
@@ -65,18 +71,23 @@ class AutoWrappedLinear(torch.nn.Linear):
     def forward(self, x, *args, **kwargs):
         if self.onload_dtype == self.computation_dtype and self.onload_device == self.computation_device:
             weight, bias = self.weight, self.bias
+        elif self.offload_engine is not None:
+            weight, bias = self.offload_engine.fetch(self, self.computation_dtype)
         else:
             weight = cast_to(self.weight, self.computation_dtype, self.computation_device)
             bias = None if self.bias is None else cast_to(self.bias, self.computation_dtype, self.computation_device)
         return torch.nn.functional.linear(x, weight, bias)
 
 
-def enable_vram_management_recursively(model: torch.nn.Module, module_map: dict, module_config: dict, max_num_param=None, overflow_module_config: dict = None, total_num_param=0):
+def enable_vram_management_recursively(model: torch.nn.Module, module_map: dict, module_config: dict, max_num_param=None, overflow_module_config: dict = None, total_num_param=0, persistent_module_names=None, prefix=""):
     for name, module in model.named_children():
+        full_name = name if prefix == "" else f"{prefix}.{name}"
         for source_module, target_module in module_map.items():
             if isinstance(module, source_module):
                 num_param = sum(p.numel() for p in module.parameters())
-                if max_num_param is not None and total_num_param + num_param > max_num_param:
+                if persistent_module_names is not None:
+                    module_config_ = module_config if full_name in persistent_module_names else overflow_module_config
+                elif max_num_param is not None and total_num_param + num_param > max_num_param:
                     module_config_ = overflow_module_config
                 else:
                     module_config_ = module_config
@@ -85,11 +96,13 @@ def enable_vram_management_recursively(model: torch.nn.Module, module_map: dict,
                 total_num_param += num_param
                 break
         else:
-            total_num_param = enable_vram_management_recursively(module, module_map, module_config, max_num_param, overflow_module_config, total_num_param)
+            total_num_param = enable_vram_management_recursively(module, module_map, module_config, max_num_param, overflow_module_config, total_num_param, persistent_module_names, full_name)
     return total_num_param
 
 
-def enable_vram_management(model: torch.nn.Module, module_map: dict, module_config: dict, max_num_param=None, overflow_module_config: dict = None):
-    enable_vram_management_recursively(model, module_map, module_config, max_num_param, overflow_module_config, total_num_param=0)
+def enable_vram_management(model: torch.nn.Module, module_map: dict, module_config: dict, max_num_param=None, overflow_module_config: dict = None, persistent_module_names=None):
+    # persistent_module_names (e.g. from a VRAMPlanner plan) takes precedence over max_num_param
+    if persistent_module_names is not None:
+        persistent_module_names = set(persistent_module_names)
+    enable_vram_management_recursively(model, module_map, module_config, max_num_param, overflow_module_config, total_num_param=0, persistent_module_names=persistent_module_names)
     model.vram_management_enabled = True
-
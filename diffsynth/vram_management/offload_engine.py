@@ -0,0 +1,178 @@
+import torch
+
+
+class PrefetchSlot:
+    def __init__(self):
+        self.buffer = None
+        self.layer_id = None
+        self.ready = None
+        self.released = None
+        # A prefetched layer keeps its slot until fetch has read it
+        self.consumed = True
+
+
+class LayerPrefetchEngine:
+    """
+    Streams offloaded layer weights host-to-device ahead of use.
+
+    Host weights are pinned once, and each layer is copied on a side stream into one of
+    `num_slots` fixed device staging buffers while the previous layers compute. The call
+    order is recorded during the first forward pass, after which up to the next
+    `num_slots - 1` layers are in flight. A layer that was not predicted falls
+    back to a copy issued on demand.
+
+    Registering pins the host weights of every offloaded layer, so pinned host memory grows
+    by the size of those weights. A pinned copy replaces the original tensor, but pages that
+    are shared elsewhere (e.g. a memory-mapped checkpoint) can end up held twice.
+    """
+    def __init__(self, device, num_slots=3):
+        self.device = torch.device(device)
+        self.copy_stream = torch.cuda.Stream(self.device)
+        self.slots = [PrefetchSlot() for _ in range(num_slots)]
+        self.next_slot = 0
+        self.order = []
+        self.layer_index = {}
+        self.order_complete = False
+        self.num_prefetched = 0
+        self.num_missed = 0
+        self.slot_bytes = 0
+
+
+    def register(self, layer):
+        for name in ["weight", "bias"]:
+            param = getattr(layer, name)
+            if param is not None and not param.is_pinned():
+                param.data = param.data.pin_memory()
+        self.slot_bytes = max(self.slot_bytes, self.layout(layer)[1])
+        layer.offload_engine = self
+
+
+    @staticmethod
+    def layout(layer):
+        # Byte offsets of weight and bias inside a staging buffer, 256-byte aligned
+        weight_bytes = layer.weight.numel() * layer.weight.element_size()
+        bias_offset = (weight_bytes + 255) // 256 * 256
+        bias_bytes = 0 if layer.bias is None else layer.bias.numel() * layer.bias.element_size()
+        return bias_offset, bias_offset + bias_bytes
+
+
+    def record(self, layer):
+        layer_id = id(layer)
+        if layer_id not in self.layer_index:
+            self.layer_index[layer_id] = len(self.order)
+            self.order.append(layer)
+        elif self.layer_index[layer_id] == 0:
+            self.order_complete = True
+        return self.layer_index[layer_id]
+
+
+    def find_slot(self, layer_id):
+        for slot in self.slots:
+            if slot.layer_id == layer_id:
+                return slot
+        return None
+
+
+    def acquire_slot(self, protected_layer_id=None, on_demand=False):
+        # Round robin over the slots whose layer was already read, never the one about to compute.
+        # A prefetch finds no slot while all are in flight; a copy on demand then takes the next one.
+        num_slots = len(self.slots)
+        candidates = [(self.next_slot + i) % num_slots for i in range(num_slots)]
+        free = [
+            slot_id for slot_id in candidates
+            if self.slots[slot_id].consumed and (protected_layer_id is None or self.slots[slot_id].layer_id != protected_layer_id)
+        ]
+        if len(free) > 0:
+            slot_id = free[0]
+        elif on_demand:
+            slot_id = candidates[0]
+        else:
+            return None
+        self.next_slot = (slot_id + 1) % num_slots
+        return self.slots[slot_id]
+
+
+    def issue_copy(self, layer, protected_layer_id=None, on_demand=False):
+        slot = self.acquire_slot(protected_layer_id=protected_layer_id, on_demand=on_demand)
+        if slot is None:
+            return None
+        bias_offset, _ = self.layout(layer)
+        if slot.buffer is None:
+            # Sized for the largest registered layer, so it is allocated only once
+            slot.buffer = torch.empty(self.slot_bytes, dtype=torch.uint8, device=self.device)
+        # The slot may still be read by a layer launched on the compute stream
+        slot.released = torch.cuda.Event()
+        slot.released.record(torch.cuda.current_stream(self.device))
+        with torch.cuda.stream(self.copy_stream):
+            self.copy_stream.wait_event(slot.released)
+            weight = self.view(slot.buffer, 0, layer.weight)
+            weight.copy_(layer.weight, non_blocking=True)
+            if layer.bias is not None:
+                bias = self.view(slot.buffer, bias_offset, layer.bias)
+                bias.copy_(layer.bias, non_blocking=True)
+            slot.ready = torch.cuda.Event()
+            slot.ready.record(self.copy_stream)
+        slot.layer_id = id(layer)
+        slot.consumed = False
+        return slot
+
+
+    @staticmethod
+    def view(buffer, offset, tensor):
+        num_bytes = tensor.numel() * tensor.element_size()
+        return buffer[offset: offset + num_bytes].view(tensor.dtype).view(tensor.shape)
+
+
+    def fetch(self, layer, dtype):
+        """Returns device copies of a layer's weight and bias in the computation dtype."""
+        index = self.record(layer)
+        slot = self.find_slot(id(layer))
+        if slot is None:
+            self.num_missed += 1
+            slot = self.issue_copy(layer, on_demand=True)
+        else:
+            self.num_prefetched += 1
+        torch.cuda.current_stream(self.device).wait_event(slot.ready)
+        slot.consumed = True
+        weight = self.view(slot.buffer, 0, layer.weight)
+        bias = None if layer.bias is None else self.view(slot.buffer, self.layout(layer)[0], layer.bias)
+        if weight.dtype != dtype:
+            weight = weight.to(dtype)
+            bias = None if bias is None else bias.to(dtype)
+        if self.order_complete:
+            for step in range(1, len(self.slots)):
+                next_layer = self.order[(index + step) % len(self.order)]
+                if next_layer is not layer and self.find_slot(id(next_layer)) is None:
+                    if self.issue_copy(next_layer, protected_layer_id=id(layer)) is None:
+                        break
+        return weight, bias
+
+
+    def stats(self):
+        return {"layers": len(self.order), "prefetched": self.num_prefetched, "missed": self.num_missed}
+
+
+
+def enable_layer_prefetch(model: torch.nn.Module, device, num_slots=3):
+    """
+    Attaches a LayerPrefetchEngine to every offloaded AutoWrappedLinear in a model.
+
+    Only layers whose weights stay on the host and compute on a CUDA device are affected.
+    Returns the engine, or None if there is nothing to prefetch.
+    """
+    from .layers import AutoWrappedLinear
+    if not torch.cuda.is_available() or torch.device(device).type != "cuda":
+        return None
+    layers = [
+        module for module in model.modules()
+        if isinstance(module, AutoWrappedLinear)
+        and torch.device(module.onload_device).type == "cpu"
+        and torch.device(module.computation_device).type == "cuda"
+    ]
+    if len(layers) == 0:
+        return None
+    engine = LayerPrefetchEngine(device, num_slots=num_slots)
+    for layer in layers:
+        engine.register(layer)
+    model.offload_engine = engine
+    return engine
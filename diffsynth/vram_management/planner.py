@@ -0,0 +1,114 @@
+import torch, json
+
+
+def iter_managed_modules(model: torch.nn.Module, module_map: dict, prefix=""):
+    # Mirrors the traversal of enable_vram_management_recursively
+    for name, module in model.named_children():
+        full_name = name if prefix == "" else f"{prefix}.{name}"
+        if isinstance(module, tuple(module_map.keys())):
+            yield full_name, module
+        else:
+            yield from iter_managed_modules(module, module_map, full_name)
+
+
+def get_free_device_memory(device="cuda"):
+    if torch.cuda.is_available() and torch.device(device).type == "cuda":
+        free_bytes, _ = torch.cuda.mem_get_info(torch.device(device))
+        return free_bytes
+    return 0
+
+
+class VRAMPlanner:
+    """
+    Chooses which managed modules stay resident on the device under a byte budget.
+
+    Every module that is not resident is copied to the device each time it is called,
+    so the planner keeps the modules with the most calls per denoising step resident
+    (a greedy knapsack on calls per step, ties broken by size). Models are loaded one at
+    a time by load_models_to_device, so each model gets the whole budget.
+
+    On a machine without CUDA, pass budget_bytes explicitly to plan for a fake device.
+    """
+    def __init__(self, budget_bytes=None, device="cuda", reserved_bytes=2 * 1024**3):
+        if budget_bytes is None:
+            budget_bytes = max(get_free_device_memory(device) - reserved_bytes, 0)
+        self.budget_bytes = budget_bytes
+        self.models = {}
+
+
+    def add_model(self, name, model: torch.nn.Module, module_map: dict, forwards_per_step=1.0):
+        """
+        Registers the modules of a model that enable_vram_management would wrap.
+
+        Args:
+            forwards_per_step (float): How often the model runs per denoising step,
+                e.g. 2 for a DiT with classifier-free guidance, 1 / num_inference_steps for a VAE.
+        """
+        modules = {}
+        for module_name, module in iter_managed_modules(model, module_map):
+            num_bytes = sum(p.numel() * p.element_size() for p in module.parameters())
+            modules[module_name] = {"module": module, "bytes": num_bytes, "calls_per_forward": 1}
+        self.models[name] = {"modules": modules, "forwards_per_step": forwards_per_step}
+
+
+    def profile(self, name, run_fn):
+        """Counts how often each managed module is called during run_fn(), which should run one forward pass."""
+        modules = self.models[name]["modules"]
+        counts = {module_name: 0 for module_name in modules}
+        handles = []
+        for module_name, info in modules.items():
+            def hook(module, args, module_name=module_name):
+                counts[module_name] += 1
+            handles.append(info["module"].register_forward_pre_hook(hook))
+        try:
+            with torch.no_grad():
+                run_fn()
+        finally:
+            for handle in handles:
+                handle.remove()
+        for module_name, count in counts.items():
+            modules[module_name]["calls_per_forward"] = count
+
+
+    def plan(self):
+        """
+        Returns:
+            dict: A JSON-serialisable plan with the resident module names of each model
+            and the expected transfer bytes per denoising step.
+        """
+        plan = {"budget_bytes": self.budget_bytes, "models": {}}
+        for name, model_info in self.models.items():
+            forwards_per_step = model_info["forwards_per_step"]
+            modules = sorted(
+                model_info["modules"].items(),
+                key=lambda item: (item[1]["calls_per_forward"], item[1]["bytes"]),
+                reverse=True,
+            )
+            resident, resident_bytes, transfer_bytes = [], 0, 0
+            for module_name, info in modules:
+                if info["calls_per_forward"] > 0 and resident_bytes + info["bytes"] <= self.budget_bytes:
+                    resident.append(module_name)
+                    resident_bytes += info["bytes"]
+                else:
+                    transfer_bytes += info["bytes"] * info["calls_per_forward"] * forwards_per_step
+            total_bytes = sum(info["bytes"] for _, info in modules)
+            plan["models"][name] = {
+                "resident_modules": sorted(resident),
+                "resident_bytes": resident_bytes,
+                "offloaded_bytes": total_bytes - resident_bytes,
+                "transfer_bytes_per_step": transfer_bytes,
+            }
+        return plan
+
+
+def save_vram_plan(plan, file_path):
+    with open(file_path, "w") as f:
+        json.dump(plan, f, indent=4)
+
+
+def load_vram_plan(plan):
+    # Accepts a plan dict or the path of a plan file
+    if isinstance(plan, str):
+        with open(plan, "r") as f:
+            plan = json.load(f)
+    return plan
@@ -0,0 +1,186 @@
+import torch, json
+from safetensors import safe_open
+from safetensors.torch import save_file, load_file
+
+
+def quantize_weight(weight: torch.Tensor, bits=8, group_size=None):
+    """
+    Symmetric round-to-nearest quantization of a [out_features, in_features] weight.
+
+    Each output channel, or each group of `group_size` input channels of it, gets its own scale.
+    4-bit values are packed two per byte, the even input channel in the low nibble.
+
+    Returns:
+        qweight (torch.Tensor): int8 [out_features, in_features], or uint8 [out_features, in_features // 2] for bits=4
+        scale (torch.Tensor): float32 [out_features, num_groups]
+    """
+    out_features, in_features = weight.shape
+    group_size = in_features if group_size is None else group_size
+    qmax = 2 ** (bits - 1) - 1
+    weight = weight.detach().float().reshape(out_features, in_features // group_size, group_size)
+    scale = weight.abs().amax(dim=-1, keepdim=True).clamp(min=1e-12) / qmax
+    qweight = torch.round(weight / scale).clamp(-qmax, qmax).to(torch.int8).reshape(out_features, in_features)
+    if bits == 4:
+        qweight = (qweight + 8).to(torch.uint8)
+        qweight = qweight[:, 0::2] | (qweight[:, 1::2] << 4)
+    return qweight, scale.squeeze(-1)
+
+
+def dequantize_weight(qweight: torch.Tensor, scale: torch.Tensor, bits=8, dtype=torch.bfloat16):
+    if bits == 4:
+        qweight = torch.stack([qweight & 0xF, qweight >> 4], dim=-1).reshape(qweight.shape[0], -1).to(torch.int8) - 8
+    out_features, in_features = qweight.shape
+    weight = qweight.reshape(out_features, scale.shape[1], -1).to(dtype) * scale.to(dtype).unsqueeze(-1)
+    return weight.reshape(out_features, in_features)
+
+
+class QuantizedLinear(torch.nn.Module):
+    """
+    Linear layer that stores its weight as int8 or int4 and dequantizes it in forward.
+
+    The constructor takes the arguments of AutoWrappedLinear, so that subclasses can be used as
+    targets in the module map of enable_vram_management. Only the device of the offload and
+    onload settings applies: the quantized weight keeps its dtype, and is dequantized to
+    `computation_dtype` on `computation_device`. Without these settings, the layer computes in
+    the dtype and on the device of its input.
+
+    Passing a QuantizedLinear (e.g. one restored by load_quantized_model) reuses its quantized weight.
+    """
+    bits = 8
+    group_size = None
+
+    def __init__(self, module, offload_dtype=None, offload_device=None, onload_dtype=None, onload_device=None, computation_dtype=None, computation_device=None):
+        super().__init__()
+        self.in_features = module.in_features
+        self.out_features = module.out_features
+        if isinstance(module, QuantizedLinear):
+            self.bits, self.group_size = module.bits, module.group_size
+            qweight, scale = module.qweight, module.scale
+        else:
+            if self.group_size is not None and self.in_features % self.group_size != 0:
+                # Per-channel scales for layers that cannot be split into groups
+                self.group_size = None
+            qweight, scale = quantize_weight(module.weight, self.bits, self.group_size)
+        self.register_buffer("qweight", qweight.to(offload_device))
+        self.register_buffer("scale", scale.to(offload_device))
+        self.bias = None if module.bias is None else torch.nn.Parameter(module.bias.detach().to(device=offload_device), requires_grad=False)
+        self.offload_device = offload_device
+        self.onload_device = onload_device
+        self.computation_dtype = computation_dtype
+        self.computation_device = computation_device
+        self.state = 0
+
+    @staticmethod
+    def empty(in_features, out_features, bias, bits, group_size):
+        # Placeholder on the meta device, to be filled by load_state_dict(..., assign=True)
+        layer = QuantizedLinear.__new__(QuantizedLinear)
+        torch.nn.Module.__init__(layer)
+        layer.in_features, layer.out_features = in_features, out_features
+        layer.bits, layer.group_size = bits, group_size
+        num_groups = 1 if group_size is None else in_features // group_size
+        packed_features = in_features // 2 if bits == 4 else in_features
+        layer.register_buffer("qweight", torch.empty((out_features, packed_features), dtype=torch.uint8 if bits == 4 else torch.int8, device="meta"))
+        layer.register_buffer("scale", torch.empty((out_features, num_groups), dtype=torch.float32, device="meta"))
+        layer.bias = torch.nn.Parameter(torch.empty(out_features, device="meta"), requires_grad=False) if bias else None
+        layer.offload_device = layer.onload_device = layer.computation_dtype = layer.computation_device = None
+        layer.state = 0
+        return layer
+
+    def quantization_config(self):
+        return {"bits": self.bits, "group_size": self.group_size, "in_features": self.in_features, "out_features": self.out_features, "bias": self.bias is not None}
+
+    def offload(self):
+        if self.state == 1 and self.offload_device != self.onload_device:
+            self.to(device=self.offload_device)
+            self.state = 0
+
+    def onload(self):
+        if self.state == 0 and self.offload_device != self.onload_device:
+            self.to(device=self.onload_device)
+            self.state = 1
+
+    def forward(self, x, *args, **kwargs):
+        dtype = self.computation_dtype or x.dtype
+        device = self.computation_device or x.device
+        weight = dequantize_weight(self.qweight.to(device), self.scale.to(device), self.bits, dtype)
+        bias = None if self.bias is None else self.bias.to(dtype=dtype, device=device)
+        return torch.nn.functional.linear(x, weight, bias)
+
+    def extra_repr(self):
+        return f"in_features={self.in_features}, out_features={self.out_features}, bits={self.bits}, group_size={self.group_size}"
+
+
+class Int8WrappedLinear(QuantizedLinear):
+    bits = 8
+    group_size = None
+
+
+class Int4WrappedLinear(QuantizedLinear):
+    bits = 4
+    group_size = 64
+
+
+quantized_linear_classes = {
+    "int8": Int8WrappedLinear,
+    "int4": Int4WrappedLinear,
+}
+
+
+def quantized_module_map(module_map: dict, quantization=None):
+    """
+    Returns a copy of module_map that quantizes torch.nn.Linear layers ("int8" or "int4").
+    Layers that are already quantized keep their weights and only get the offload settings.
+    """
+    if quantization is None:
+        return module_map
+    if quantization not in quantized_linear_classes:
+        raise ValueError(f"Unsupported quantization {quantization}, expected one of {list(quantized_linear_classes)}")
+    module_map = {QuantizedLinear: QuantizedLinear, **module_map}
+    module_map[torch.nn.Linear] = quantized_linear_classes[quantization]
+    return module_map
+
+
+def quantize_model(model: torch.nn.Module, quantization="int8"):
+    """Replaces every torch.nn.Linear of model with a quantized linear layer, in place"""
+    linear_class = quantized_linear_classes[quantization]
+    for name, module in model.named_children():
+        if isinstance(module, torch.nn.Linear):
+            setattr(model, name, linear_class(module, offload_device=module.weight.device))
+        else:
+            quantize_model(module, quantization)
+    return model
+
+
+def save_quantized_model(model: torch.nn.Module, file_path):
+    """
+    Saves the state dict of a model quantized by quantize_model, with the quantization
+    settings of every layer in the metadata. Load it with load_quantized_model.
+    """
+    layers = {name: module.quantization_config() for name, module in model.named_modules() if isinstance(module, QuantizedLinear)}
+    state_dict = {name: tensor.detach().contiguous().cpu() for name, tensor in model.state_dict().items()}
+    save_file(state_dict, file_path, metadata={"quantized_layers": json.dumps(layers)})
+
+
+def load_quantized_model(model: torch.nn.Module, file_path, device="cpu", torch_dtype=None):
+    """
+    Loads a file written by save_quantized_model into model.
+
+    The model may be created on the meta device (see init_weights_on_device), so that the
+    unquantized weights are never allocated. The quantized layers are replaced by QuantizedLinear
+    and can be passed on to enable_vram_management with quantized_module_map.
+    """
+    with safe_open(file_path, framework="pt", device="cpu") as f:
+        layers = json.loads(f.metadata()["quantized_layers"])
+    for name, config in layers.items():
+        parent_name, _, child_name = name.rpartition(".")
+        parent = model.get_submodule(parent_name)
+        setattr(parent, child_name, QuantizedLinear.empty(**config))
+    state_dict = load_file(file_path, device=str(device))
+    if torch_dtype is not None:
+        quantized_names = set(f"{name}.{key}" for name in layers for key in ["qweight", "scale"])
+        state_dict = {
+            name: tensor.to(torch_dtype) if tensor.is_floating_point() and name not in quantized_names else tensor
+            for name, tensor in state_dict.items()
+        }
+    model.load_state_dict(state_dict, assign=True)
+    return model
@@ -8,9 +8,8 @@ import numpy as np
 import os
 import modules.util.appstate
 from datetime import datetime
-from diffusers import OmniGenPipeline
-from diffusers.utils import load_image
-from modules.util.utilities import clear_previous_model_memory
+from modules.util.utilities import acquire_pipeline, register_loaded_pipeline, run_gpu_job
+from modules.util.pipeline_cache import make_pipeline_key
 from modules.util.appstate import state_manager
 
 MAX_SEED = np.iinfo(np.int32).max
@@ -20,15 +19,13 @@ def random_seed():
     return torch.randint(0, MAX_SEED, (1,)).item()
 
 def get_pipeline(memory_optimization, vaeslicing, vaetiling):
+    from diffusers import OmniGenPipeline
     print("----OmniGen mode: ", memory_optimization, vaeslicing, vaetiling)
     # If model is already loaded with same configuration, reuse it
-    if (modules.util.appstate.global_pipe is not None and 
-        type(modules.util.appstate.global_pipe).__name__ == "OmniGenPipeline" and
-        modules.util.appstate.global_memory_mode == memory_optimization):
+    pipe = acquire_pipeline("OmniGenPipeline", memory_mode=memory_optimization)
+    if pipe is not None:
         print(">>>>Reusing OmniGen pipe<<<<")
-        return modules.util.appstate.global_pipe
-    else:
-        clear_previous_model_memory()
+        return pipe
     
     repo_id = "Shitao/OmniGen-v1-diffusers"
 
@@ -54,17 +51,13 @@ def get_pipeline(memory_optimization, vaeslicing, vaetiling):
 
     modules.util.appstate.global_memory_mode = memory_optimization
     
-    return modules.util.appstate.global_pipe
+    return register_loaded_pipeline()
 
-def generate_image(
+def generate_image_job(
     memory_optimization, vaeslicing, vaetiling, input_image1, input_image2, 
     input_image3, prompt, width, height, guidance_scale, img_guidance_scale, 
     num_inference_steps, use_input_image_size_as_output, seed, max_input_image_size
 ):
-    if modules.util.appstate.global_inference_in_progress == True:
-        print(">>>>Inference in progress, can't continue<<<<")
-        return None
-    modules.util.appstate.global_inference_in_progress = True
     try:
         # Get pipeline (either cached or newly loaded)
         pipe = get_pipeline(memory_optimization, vaeslicing, vaetiling)
@@ -150,15 +143,23 @@ def generate_image(
         # Save the image
         image.save(output_path)
         print(f"Image generated: {output_path}")
-        modules.util.appstate.global_inference_in_progress = False
         # Add to gallery items
         gallery_items.append((output_path, "OmniGen"))
         return gallery_items
     except Exception as e:
         print(f"Error during inference: {str(e)}")
         return None
-    finally:
-        modules.util.appstate.global_inference_in_progress = False
+
+def generate_image(
+    memory_optimization, vaeslicing, vaetiling, input_image1, input_image2, 
+    input_image3, prompt, width, height, guidance_scale, img_guidance_scale, 
+    num_inference_steps, use_input_image_size_as_output, seed, max_input_image_size
+):
+    pipeline_key = make_pipeline_key("OmniGenPipeline", memory_mode=memory_optimization)
+    return run_gpu_job(
+        generate_image_job, memory_optimization, vaeslicing, vaetiling, input_image1, input_image2, input_image3, prompt, width, height, guidance_scale, img_guidance_scale, num_inference_steps, use_input_image_size_as_output, seed, max_input_image_size,
+        pipeline_key=pipeline_key
+    )
 
 def create_omnigen_tab():
     initial_state = state_manager.get_state("omnigen") or {}
@@ -288,5 +289,6 @@ def create_omnigen_tab():
             omnigen_img_guidance_scale, omnigen_num_inference_steps, 
             omnigen_use_input_image_size_as_output, omnigen_seed, omnigen_max_input_image_size
         ],
-        outputs=[output_gallery]
+        outputs=[output_gallery],
+        concurrency_limit=modules.util.appstate.JOB_QUEUE_SIZE,
     )
\ No newline at end of file
@@ -2,40 +2,43 @@ import gradio as gr
 import torch
 import cv2
 import os
-from basicsr.utils.download_util import load_file_from_url
-from basicsr.archs.rrdbnet_arch import RRDBNet
-from realesrgan.archs.srvgg_arch import SRVGGNetCompact
-from realesrgan import RealESRGANer
-from gfpgan import GFPGANer
 import tempfile
-from modules.util.utilities import clear_previous_model_memory
+import modules.util.appstate
+from modules.util.utilities import run_gpu_job, park_current_pipeline
+from modules.util.pipeline_cache import make_pipeline_key
 
 class VideoUpscaler:
     def __init__(self):
+        # Networks are built in load_model, so that basicsr and realesrgan are only imported when upscaling
         self.models = {
             "RealESRGAN_x4plus": {
                 "scale": 4,
-                "model": RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=4),
+                "arch": "RRDBNet",
+                "arch_kwargs": dict(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=4),
                 "url": "https://github.com/xinntao/Real-ESRGAN/releases/download/v0.1.0/RealESRGAN_x4plus.pth"
             },
             "RealESRNet_x4plus": {
                 "scale": 4,
-                "model": RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=4),
+                "arch": "RRDBNet",
+                "arch_kwargs": dict(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=4),
                 "url": "https://github.com/xinntao/Real-ESRGAN/releases/download/v0.1.1/RealESRNet_x4plus.pth"
             },
             "RealESRGAN_x4plus_anime_6B": {
                 "scale": 4,
-                "model": RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=6, num_grow_ch=32, scale=4),
+                "arch": "RRDBNet",
+                "arch_kwargs": dict(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=6, num_grow_ch=32, scale=4),
                 "url": "https://github.com/xinntao/Real-ESRGAN/releases/download/v0.2.2.4/RealESRGAN_x4plus_anime_6B.pth"
             },
             "RealESRGAN_x2plus": {
                 "scale": 2,
-                "model": RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=2),
+                "arch": "RRDBNet",
+                "arch_kwargs": dict(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=2),
                 "url": "https://github.com/xinntao/Real-ESRGAN/releases/download/v0.2.1/RealESRGAN_x2plus.pth"
             },
             "realesr-animevideov3": {
                 "scale": 4,
-                "model": SRVGGNetCompact(num_in_ch=3, num_out_ch=3, num_feat=64, num_conv=16, upscale=4, act_type='prelu'),
+                "arch": "SRVGGNetCompact",
+                "arch_kwargs": dict(num_in_ch=3, num_out_ch=3, num_feat=64, num_conv=16, upscale=4, act_type='prelu'),
                 "url": "https://github.com/xinntao/Real-ESRGAN/releases/download/v0.2.5.0/realesr-animevideov3.pth"
             }
         }
@@ -60,9 +63,18 @@ class VideoUpscaler:
         
         return f"Resolution: {width}x{height} | FPS: {fps} | Duration: {duration:.2f}s | Frames: {frame_count}"
         
+    def build_model(self, model_info):
+        if model_info["arch"] == "SRVGGNetCompact":
+            from realesrgan.archs.srvgg_arch import SRVGGNetCompact
+            return SRVGGNetCompact(**model_info["arch_kwargs"])
+        from basicsr.archs.rrdbnet_arch import RRDBNet
+        return RRDBNet(**model_info["arch_kwargs"])
+
     def load_model(self, model_name, denoise_strength=1):
+        from basicsr.utils.download_util import load_file_from_url
+        from realesrgan import RealESRGANer
         model_info = self.models[model_name]
-        model = model_info["model"]
+        model = self.build_model(model_info)
         scale = model_info["scale"]
 
         model_path = os.path.join("models/video_upscaler/", f"{model_name}.pth")
@@ -90,6 +102,7 @@ class VideoUpscaler:
 
     def load_face_enhancer(self, outscale):
         if self.face_enhancer is None:
+            from gfpgan import GFPGANer
             self.face_enhancer = GFPGANer(
                 model_path="https://github.com/TencentARC/GFPGAN/releases/download/v1.3.0/GFPGANv1.3.pth",
                 upscale=outscale,
@@ -101,7 +114,16 @@ class VideoUpscaler:
     def process_video(self, video_path, model_name, denoise_strength, face_enhance, outscale, progress=gr.Progress()):
         if not video_path:
             return None, "", ""
-        clear_previous_model_memory()
+        pipeline_key = make_pipeline_key("VideoUpscaler", inference_type=model_name)
+        result = run_gpu_job(
+            self.process_video_job, video_path, model_name, denoise_strength, face_enhance, outscale, progress,
+            pipeline_key=pipeline_key
+        )
+        if result is None:
+            return None, "", ""
+        return result
+
+    def process_video_job(self, video_path, model_name, denoise_strength, face_enhance, outscale, progress):
         import time
         start_time = time.time()
 
@@ -111,6 +133,10 @@ class VideoUpscaler:
         output_path = os.path.abspath(os.path.join("output/upscaled_video/", f"{name}_upscaled{ext}"))
         temp_output = os.path.abspath(os.path.join("temp_output", f"temp_{name}{ext}"))
         
+        # Free the device for the upscaler: park the active pipeline and evict parked pipelines holding VRAM
+        park_current_pipeline()
+        modules.util.appstate.global_pipeline_cache.make_room(make_pipeline_key("VideoUpscaler", inference_type=model_name))
+
         # Load model
         self.load_model(model_name, denoise_strength)
         if face_enhance:
@@ -126,37 +152,30 @@ class VideoUpscaler:
         if not success:
             return None, "", ""
 
-        h, w = frame.shape[:2]
-        output_h, output_w = int(h * outscale), int(w * outscale)
-
         # Reset video capture to start
         cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
 
-        # Use more compatible codec
-        writer = cv2.VideoWriter(
-            temp_output,
-            cv2.VideoWriter_fourcc(*"mp4v"),  # Try H.264 codec instead of mp4v
-            fps,
-            (output_w, output_h),
-        )
-
-        # Process video frames
-        while True:
-            success, frame = cap.read()
-            if not success:
-                break
-
-            if face_enhance:
-                _, _, frame = self.face_enhancer.enhance(frame, has_aligned=False, only_center_face=False, paste_back=True)
-            else:
-                frame, _ = self.current_model.enhance(frame, outscale=outscale)
+        # MPEG-4 like mp4v, encoded by ffmpeg while the next frames are upscaled.
+        # The BGR frames of OpenCV are converted on the writer thread.
+        from diffsynth.data.video import VideoWriter
+        try:
+            with VideoWriter(temp_output, fps=fps, bgr=True, codec="mpeg4", macro_block_size=2) as writer:
+                # Process video frames
+                while True:
+                    success, frame = cap.read()
+                    if not success:
+                        break
 
-            writer.write(frame)
-            processed_frames += 1
-            progress(processed_frames / total_frames)
+                    if face_enhance:
+                        _, _, frame = self.face_enhancer.enhance(frame, has_aligned=False, only_center_face=False, paste_back=True)
+                    else:
+                        frame, _ = self.current_model.enhance(frame, outscale=outscale)
 
-        cap.release()
-        writer.release()
+                    writer.append(frame)
+                    processed_frames += 1
+                    progress(processed_frames / total_frames)
+        finally:
+            cap.release()
 
         # Calculate processing time
         processing_time = time.time() - start_time
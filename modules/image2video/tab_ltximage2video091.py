@@ -8,10 +8,8 @@ import numpy as np
 import os
 import modules.util.appstate
 from datetime import datetime
-from diffusers.utils import export_to_video, load_image
-from diffusers import LTXImageToVideoPipeline
-from transformers import T5EncoderModel, T5Tokenizer
-from modules.util.utilities import clear_previous_model_memory
+from modules.util.utilities import acquire_pipeline, register_loaded_pipeline, run_gpu_job
+from modules.util.pipeline_cache import make_pipeline_key
 from modules.util.appstate import state_manager
 
 MAX_SEED = np.iinfo(np.int32).max
@@ -21,15 +19,13 @@ def random_seed():
     return torch.randint(0, MAX_SEED, (1,)).item()
 
 def get_pipeline(memory_optimization):
+    from diffusers import LTXImageToVideoPipeline
     print("----ltxvideo image2video 091 mode: ", memory_optimization)
     # If model is already loaded with same configuration, reuse it
-    if (modules.util.appstate.global_pipe is not None and 
-        type(modules.util.appstate.global_pipe).__name__ == "LTXImageToVideoPipeline" and
-        modules.util.appstate.global_memory_mode == memory_optimization):
+    pipe = acquire_pipeline("LTXImageToVideoPipeline", memory_mode=memory_optimization)
+    if pipe is not None:
         print(">>>>Reusing ltxvideo091 image2video pipe<<<<")
-        return modules.util.appstate.global_pipe
-    else:
-        clear_previous_model_memory()
+        return pipe
     
     repo_id = "newgenai79/LTX-Video-0.9.1-diffusers"
     modules.util.appstate.global_pipe = LTXImageToVideoPipeline.from_pretrained(
@@ -46,16 +42,12 @@ def get_pipeline(memory_optimization):
 
     modules.util.appstate.global_memory_mode = memory_optimization
     
-    return modules.util.appstate.global_pipe
+    return register_loaded_pipeline()
 
-def generate_video(
+def generate_video_job(
     seed, input_image, prompt, negative_prompt, width, height, fps,
     num_inference_steps, num_frames, memory_optimization,
 ):
-    if modules.util.appstate.global_inference_in_progress == True:
-        print(">>>>Inference in progress, can't continue<<<<")
-        return None
-    modules.util.appstate.global_inference_in_progress = True
     try:
         # Get pipeline (either cached or newly loaded)
         pipe = get_pipeline(memory_optimization)
@@ -65,6 +57,7 @@ def generate_video(
         def callback_on_step_end(pipe, i, t, callback_kwargs):
             progress_bar(i / num_inference_steps, desc=f"Generating video (Step {i}/{num_inference_steps})")
             return callback_kwargs
+        from diffusers.utils import load_image
         image = load_image(
             input_image
         )
@@ -95,16 +88,24 @@ def generate_video(
         output_path = os.path.join(OUTPUT_DIR, filename)
         
         # Save the video
+        from diffusers.utils import export_to_video
         export_to_video(video, output_path, fps=fps)
         print(f"Video generated: {output_path}")
-        modules.util.appstate.global_inference_in_progress = False
         
         return output_path
     except Exception as e:
         print(f"Error during inference: {str(e)}")
         return None
-    finally:
-        modules.util.appstate.global_inference_in_progress = False
+
+def generate_video(
+    seed, input_image, prompt, negative_prompt, width, height, fps,
+    num_inference_steps, num_frames, memory_optimization,
+):
+    pipeline_key = make_pipeline_key("LTXImageToVideoPipeline", memory_mode=memory_optimization)
+    return run_gpu_job(
+        generate_video_job, seed, input_image, prompt, negative_prompt, width, height, fps, num_inference_steps, num_frames, memory_optimization,
+        pipeline_key=pipeline_key
+    )
 
 def create_ltximage2video091_tab():
     initial_state = state_manager.get_state("ltximage2video091") or {}
@@ -199,5 +200,6 @@ def create_ltximage2video091_tab():
             ltximage2video091_height_input, ltximage2video091_fps_input, ltximage2video091_num_inference_steps_input, 
             ltximage2video091_num_frames_input, ltximage2video091_memory_optimization,
         ],
-        outputs=[output_video]
+        outputs=[output_video],
+        concurrency_limit=modules.util.appstate.JOB_QUEUE_SIZE,
     )
\ No newline at end of file
@@ -8,8 +8,8 @@ import numpy as np
 import os
 import modules.util.appstate
 from datetime import datetime
-from diffusers import AuraFlowPipeline, AuraFlowTransformer2DModel
-from modules.util.utilities import clear_previous_model_memory
+from modules.util.utilities import acquire_pipeline, register_loaded_pipeline, run_gpu_job
+from modules.util.pipeline_cache import make_pipeline_key
 from modules.util.appstate import state_manager
 
 MAX_SEED = np.iinfo(np.int32).max
@@ -19,16 +19,13 @@ def random_seed():
     return torch.randint(0, MAX_SEED, (1,)).item()
 
 def get_pipeline(memory_optimization, vaeslicing, vaetiling, inference_type):
+    from diffusers import AuraFlowPipeline
     print("----auraflow mode: ", memory_optimization, vaeslicing, vaetiling, inference_type)
     # If model is already loaded with same configuration, reuse it
-    if (modules.util.appstate.global_pipe is not None and 
-        type(modules.util.appstate.global_pipe).__name__ == "AuraFlowPipeline" and
-        modules.util.appstate.global_inference_type == inference_type and
-        modules.util.appstate.global_memory_mode == memory_optimization):
+    pipe = acquire_pipeline("AuraFlowPipeline", inference_type=inference_type, memory_mode=memory_optimization)
+    if pipe is not None:
         print(">>>>Reusing auraflow pipe<<<<")
-        return modules.util.appstate.global_pipe
-    else:
-        clear_previous_model_memory()
+        return pipe
 
     modules.util.appstate.global_pipe = AuraFlowPipeline.from_pretrained(
         "fal/AuraFlow-v0.3",
@@ -52,20 +49,16 @@ def get_pipeline(memory_optimization, vaeslicing, vaetiling, inference_type):
 
     modules.util.appstate.global_memory_mode = memory_optimization
     modules.util.appstate.global_inference_type = inference_type
-    return modules.util.appstate.global_pipe
+    return register_loaded_pipeline()
 def get_gguf(gguf_user_selection):
     gguf_file, gguf_file_size_str = gguf_user_selection.split(' - ')
     gguf_file_size = float(gguf_file_size_str.replace(' GB', ''))
     return gguf_file, gguf_file_size
 
-def generate_images(
+def generate_images_job(
     seed, prompt, negative_prompt, width, height, guidance_scale,
     num_inference_steps, memory_optimization, vaeslicing, vaetiling
 ):
-    if modules.util.appstate.global_inference_in_progress == True:
-        print(">>>>Inference in progress, can't continue<<<<")
-        return None
-    modules.util.appstate.global_inference_in_progress = True
     try:
         pipe = get_pipeline(memory_optimization, vaeslicing, vaetiling, "auraflow")
         generator = torch.Generator(device="cpu").manual_seed(seed)
@@ -119,7 +112,6 @@ def generate_images(
         image.save(output_path)
         modules.util.utilities.save_metadata_to_file(output_path, metadata)
         print(f"Image generated: {output_path}")
-        modules.util.appstate.global_inference_in_progress = False
         # Add to gallery items
         gallery_items.append((output_path, "AuraFlow"))
     
@@ -127,8 +119,16 @@ def generate_images(
     except Exception as e:
         print(f"Error during inference: {str(e)}")
         return None
-    finally:
-        modules.util.appstate.global_inference_in_progress = False
+
+def generate_images(
+    seed, prompt, negative_prompt, width, height, guidance_scale,
+    num_inference_steps, memory_optimization, vaeslicing, vaetiling
+):
+    pipeline_key = make_pipeline_key("AuraFlowPipeline", inference_type="auraflow", memory_mode=memory_optimization)
+    return run_gpu_job(
+        generate_images_job, seed, prompt, negative_prompt, width, height, guidance_scale, num_inference_steps, memory_optimization, vaeslicing, vaetiling,
+        pipeline_key=pipeline_key
+    )
 
 def create_auraflow_tab():
     initial_state = state_manager.get_state("auraflow") or {}
@@ -240,5 +240,6 @@ def create_auraflow_tab():
             auraflow_height_input, auraflow_guidance_scale_slider, auraflow_num_inference_steps_input, 
             auraflow_memory_optimization, auraflow_vaeslicing, auraflow_vaetiling
         ],
-        outputs=[output_gallery]
+        outputs=[output_gallery],
+        concurrency_limit=modules.util.appstate.JOB_QUEUE_SIZE,
     )
@@ -8,9 +8,8 @@ import numpy as np
 import os
 import modules.util.appstate
 from datetime import datetime
-from diffusers import AuraFlowPipeline, AuraFlowTransformer2DModel
-from diffusers import GGUFQuantizationConfig
-from modules.util.utilities import clear_previous_model_memory
+from modules.util.utilities import acquire_pipeline, register_loaded_pipeline, run_gpu_job
+from modules.util.pipeline_cache import make_pipeline_key
 from modules.util.appstate import state_manager
 
 MAX_SEED = np.iinfo(np.int32).max
@@ -39,17 +38,13 @@ def random_seed():
     return torch.randint(0, MAX_SEED, (1,)).item()
 
 def get_pipeline(memory_optimization, gguf_file, vaeslicing, vaetiling, inference_type):
+    from diffusers import AuraFlowPipeline, AuraFlowTransformer2DModel, GGUFQuantizationConfig
     print("----auraflow mode: ", memory_optimization, gguf_file, vaeslicing, vaetiling, inference_type)
     # If model is already loaded with same configuration, reuse it
-    if (modules.util.appstate.global_pipe is not None and 
-        type(modules.util.appstate.global_pipe).__name__ == "AuraFlowPipeline" and
-        modules.util.appstate.global_selected_gguf == gguf_file and
-        modules.util.appstate.global_inference_type == inference_type and 
-        modules.util.appstate.global_memory_mode == memory_optimization):
+    pipe = acquire_pipeline("AuraFlowPipeline", inference_type=inference_type, memory_mode=memory_optimization, gguf=gguf_file)
+    if pipe is not None:
         print(">>>>Reusing auraflow pipe<<<<")
-        return modules.util.appstate.global_pipe
-    else:
-        clear_previous_model_memory()
+        return pipe
 
     transformer_path = f"https://huggingface.co/city96/AuraFlow-v0.3-gguf/blob/main/{gguf_file}"
     transformer = AuraFlowTransformer2DModel.from_single_file(
@@ -81,20 +76,16 @@ def get_pipeline(memory_optimization, gguf_file, vaeslicing, vaetiling, inferenc
     modules.util.appstate.global_selected_gguf = gguf_file
     modules.util.appstate.global_inference_type = inference_type
     
-    return modules.util.appstate.global_pipe
+    return register_loaded_pipeline()
 def get_gguf(gguf_user_selection):
     gguf_file, gguf_file_size_str = gguf_user_selection.split(' - ')
     gguf_file_size = float(gguf_file_size_str.replace(' GB', ''))
     return gguf_file, gguf_file_size
 
-def generate_images(
+def generate_images_job(
     seed, prompt, negative_prompt, width, height, guidance_scale,
     num_inference_steps, memory_optimization, vaeslicing, vaetiling, gguf_file
 ):
-    if modules.util.appstate.global_inference_in_progress == True:
-        print(">>>>Inference in progress, can't continue<<<<")
-        return None
-    modules.util.appstate.global_inference_in_progress = True
     try:
         gguf_file, gguf_file_size = get_gguf(gguf_file)
         # Get pipeline (either cached or newly loaded)
@@ -151,7 +142,6 @@ def generate_images(
         image.save(output_path)
         modules.util.utilities.save_metadata_to_file(output_path, metadata)
         print(f"Image generated: {output_path}")
-        modules.util.appstate.global_inference_in_progress = False
         # Add to gallery items
         gallery_items.append((output_path, "AuraFlow"))
     
@@ -159,8 +149,16 @@ def generate_images(
     except Exception as e:
         print(f"Error during inference: {str(e)}")
         return None
-    finally:
-        modules.util.appstate.global_inference_in_progress = False
+
+def generate_images(
+    seed, prompt, negative_prompt, width, height, guidance_scale,
+    num_inference_steps, memory_optimization, vaeslicing, vaetiling, gguf_file
+):
+    pipeline_key = make_pipeline_key("AuraFlowPipeline", inference_type="auraflow_gguf", memory_mode=memory_optimization, gguf=gguf_file)
+    return run_gpu_job(
+        generate_images_job, seed, prompt, negative_prompt, width, height, guidance_scale, num_inference_steps, memory_optimization, vaeslicing, vaetiling, gguf_file,
+        pipeline_key=pipeline_key
+    )
 
 def create_auraflow_gguf_tab():
     initial_state = state_manager.get_state("auraflow_gguf") or {}
@@ -281,5 +279,6 @@ def create_auraflow_gguf_tab():
             auraflow_gguf_height_input, auraflow_gguf_guidance_scale_slider, auraflow_gguf_num_inference_steps_input, 
             auraflow_gguf_memory_optimization, auraflow_gguf_vaeslicing, auraflow_gguf_vaetiling, auraflow_gguf_dropdown
         ],
-        outputs=[output_gallery]
+        outputs=[output_gallery],
+        concurrency_limit=modules.util.appstate.JOB_QUEUE_SIZE,
     )
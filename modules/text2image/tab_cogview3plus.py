@@ -8,8 +8,8 @@ import numpy as np
 import os
 import modules.util.appstate
 from datetime import datetime
-from diffusers import CogView3PlusPipeline
-from modules.util.utilities import clear_previous_model_memory
+from modules.util.utilities import acquire_pipeline, register_loaded_pipeline, run_gpu_job
+from modules.util.pipeline_cache import make_pipeline_key
 from modules.util.appstate import state_manager
 
 MAX_SEED = np.iinfo(np.int32).max
@@ -26,15 +26,13 @@ def random_seed():
     return torch.randint(0, MAX_SEED, (1,)).item()
 
 def get_pipeline(memory_optimization, vaeslicing, vaetiling):
+    from diffusers import CogView3PlusPipeline
     print("----cogView3Plus mode: ",memory_optimization)
     # If model is already loaded with same configuration, reuse it
-    if (modules.util.appstate.global_pipe is not None and 
-        type(modules.util.appstate.global_pipe).__name__ == "CogView3PlusPipeline" and
-        modules.util.appstate.global_memory_mode == memory_optimization):
+    pipe = acquire_pipeline("CogView3PlusPipeline", memory_mode=memory_optimization)
+    if pipe is not None:
         print(">>>>Reusing cogView3Plus pipe<<<<")
-        return modules.util.appstate.global_pipe
-    else:
-        clear_previous_model_memory()
+        return pipe
     
     modules.util.appstate.global_pipe = CogView3PlusPipeline.from_pretrained(
         "THUDM/CogView3-Plus-3B",
@@ -61,20 +59,16 @@ def get_pipeline(memory_optimization, vaeslicing, vaetiling):
         
     # Update global variables
     modules.util.appstate.global_memory_mode = memory_optimization
-    return modules.util.appstate.global_pipe
+    return register_loaded_pipeline()
 
 def get_dimensions(resolution):
     width, height = map(int, resolution.split('x'))
     return width, height
-def generate_images(
+def generate_images_job(
     seed, prompt, negative_prompt, resolution, guidance_scale,
     num_inference_steps, memory_optimization, vaeslicing, vaetiling, 
 ):
 
-    if modules.util.appstate.global_inference_in_progress == True:
-        print(">>>>Inference in progress, can't continue<<<<")
-        return None
-    modules.util.appstate.global_inference_in_progress = True
     try:
         # Get pipeline (either cached or newly loaded)
         pipe = get_pipeline(memory_optimization, vaeslicing, vaetiling)
@@ -131,7 +125,6 @@ def generate_images(
         image.save(output_path)
         modules.util.utilities.save_metadata_to_file(output_path, metadata)
         print(f"Image generated: {output_path}")
-        modules.util.appstate.global_inference_in_progress = False
         # Add to gallery items
         gallery_items.append((output_path, "cogView3Plus"))
         
@@ -139,8 +132,16 @@ def generate_images(
     except Exception as e:
         print(f"Error during inference: {str(e)}")
         return None
-    finally:
-        modules.util.appstate.global_inference_in_progress = False
+
+def generate_images(
+    seed, prompt, negative_prompt, resolution, guidance_scale,
+    num_inference_steps, memory_optimization, vaeslicing, vaetiling, 
+):
+    pipeline_key = make_pipeline_key("CogView3PlusPipeline", memory_mode=memory_optimization)
+    return run_gpu_job(
+        generate_images_job, seed, prompt, negative_prompt, resolution, guidance_scale, num_inference_steps, memory_optimization, vaeslicing, vaetiling,
+        pipeline_key=pipeline_key
+    )
 
 def create_cogView3Plus_tab():
     initial_state = state_manager.get_state("cogview3plus") or {}
@@ -245,5 +246,6 @@ def create_cogView3Plus_tab():
             cogView3Plus_num_inference_steps_input, cogView3Plus_memory_optimization, 
             cogView3Plus_vaeslicing, cogView3Plus_vaetiling,
         ],
-        outputs=[output_gallery]
+        outputs=[output_gallery],
+        concurrency_limit=modules.util.appstate.JOB_QUEUE_SIZE,
     )
\ No newline at end of file
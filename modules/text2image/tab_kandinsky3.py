@@ -8,8 +8,8 @@ import numpy as np
 import os
 import modules.util.appstate
 from datetime import datetime
-from diffusers import AutoPipelineForText2Image
-from modules.util.utilities import clear_previous_model_memory
+from modules.util.utilities import acquire_pipeline, register_loaded_pipeline, run_gpu_job
+from modules.util.pipeline_cache import make_pipeline_key
 from modules.util.appstate import state_manager
 
 MAX_SEED = np.iinfo(np.int32).max
@@ -19,15 +19,13 @@ def random_seed():
     return torch.randint(0, MAX_SEED, (1,)).item()
 
 def get_pipeline(memory_optimization):
+    from diffusers import AutoPipelineForText2Image
     print("----kandinsky3 mode: ", memory_optimization)
     # If model is already loaded with same configuration, reuse it
-    if (modules.util.appstate.global_pipe is not None and 
-        type(modules.util.appstate.global_pipe).__name__ == "Kandinsky3Pipeline" and
-        modules.util.appstate.global_memory_mode == memory_optimization):
+    pipe = acquire_pipeline("Kandinsky3Pipeline", memory_mode=memory_optimization)
+    if pipe is not None:
         print(">>>>Reusing kandinsky3 pipe<<<<")
-        return modules.util.appstate.global_pipe
-    else:
-        clear_previous_model_memory()
+        return pipe
 
     modules.util.appstate.global_pipe = AutoPipelineForText2Image.from_pretrained(
         "kandinsky-community/kandinsky-3",
@@ -44,16 +42,12 @@ def get_pipeline(memory_optimization):
 
     modules.util.appstate.global_memory_mode = memory_optimization
     
-    return modules.util.appstate.global_pipe
+    return register_loaded_pipeline()
 
-def generate_images(
+def generate_images_job(
     seed, prompt, negative_prompt, width, height, guidance_scale,
     num_inference_steps, memory_optimization,
 ):
-    if modules.util.appstate.global_inference_in_progress == True:
-        print(">>>>Inference in progress, can't continue<<<<")
-        return None
-    modules.util.appstate.global_inference_in_progress = True
     try:
         # Get pipeline (either cached or newly loaded)
         pipe = get_pipeline(memory_optimization)
@@ -109,7 +103,6 @@ def generate_images(
         image.save(output_path)
         modules.util.utilities.save_metadata_to_file(output_path, metadata)
         print(f"Image generated: {output_path}")
-        modules.util.appstate.global_inference_in_progress = False
         # Add to gallery items
         gallery_items.append((output_path, "Kandinsky-3"))
         
@@ -117,8 +110,16 @@ def generate_images(
     except Exception as e:
         print(f"Error during inference: {str(e)}")
         return None
-    finally:
-        modules.util.appstate.global_inference_in_progress = False
+
+def generate_images(
+    seed, prompt, negative_prompt, width, height, guidance_scale,
+    num_inference_steps, memory_optimization,
+):
+    pipeline_key = make_pipeline_key("Kandinsky3Pipeline", memory_mode=memory_optimization)
+    return run_gpu_job(
+        generate_images_job, seed, prompt, negative_prompt, width, height, guidance_scale, num_inference_steps, memory_optimization,
+        pipeline_key=pipeline_key
+    )
 
 def create_kandinsky3_tab():
     initial_state = state_manager.get_state("kandinsky3") or {}
@@ -220,5 +221,6 @@ def create_kandinsky3_tab():
             kandinsky3_height_input, kandinsky3_guidance_scale_slider, kandinsky3_num_inference_steps_input, 
             kandinsky3_memory_optimization,
         ],
-        outputs=[output_gallery]
+        outputs=[output_gallery],
+        concurrency_limit=modules.util.appstate.JOB_QUEUE_SIZE,
     )
\ No newline at end of file
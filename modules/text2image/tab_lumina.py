@@ -8,8 +8,8 @@ import numpy as np
 import os
 import modules.util.appstate
 from datetime import datetime
-from diffusers import LuminaText2ImgPipeline
-from modules.util.utilities import clear_previous_model_memory
+from modules.util.utilities import acquire_pipeline, load_shared_components, register_loaded_pipeline, run_gpu_job
+from modules.util.pipeline_cache import make_pipeline_key
 from modules.util.appstate import state_manager
 
 MAX_SEED = np.iinfo(np.int32).max
@@ -19,20 +19,22 @@ def random_seed():
     return torch.randint(0, MAX_SEED, (1,)).item()
 
 def get_pipeline(memory_optimization, vaeslicing, vaetiling, inference_type):
+    from diffusers import LuminaText2ImgPipeline
     print("----Lumina mode: ",memory_optimization, vaeslicing, vaetiling)
     # If model is already loaded with same configuration, reuse it
-    if (modules.util.appstate.global_pipe is not None and 
-        type(modules.util.appstate.global_pipe).__name__ == "LuminaText2ImgPipeline" and
-        modules.util.appstate.global_inference_type == inference_type and 
-        modules.util.appstate.global_memory_mode == memory_optimization):
+    pipe = acquire_pipeline("LuminaText2ImgPipeline", inference_type=inference_type, memory_mode=memory_optimization)
+    if pipe is not None:
         print(">>>>Reusing Lumina pipe<<<<")
-        return modules.util.appstate.global_pipe
-    else:
-        clear_previous_model_memory()
+        return pipe
         
+    # Only the text encoder is shared, the VAE settings are changed on the module below
+    shared_components = load_shared_components(
+        LuminaText2ImgPipeline, "Alpha-VLLM/Lumina-Next-SFT-diffusers", ["text_encoder"], torch.bfloat16, memory_optimization
+    )
     modules.util.appstate.global_pipe = LuminaText2ImgPipeline.from_pretrained(
         "Alpha-VLLM/Lumina-Next-SFT-diffusers",
         torch_dtype=torch.bfloat16,
+        **shared_components,
     )
 
     if memory_optimization == "Low VRAM":
@@ -54,16 +56,12 @@ def get_pipeline(memory_optimization, vaeslicing, vaetiling, inference_type):
     # Update global variables
     modules.util.appstate.global_memory_mode = memory_optimization
     modules.util.appstate.global_inference_type = inference_type
-    return modules.util.appstate.global_pipe
+    return register_loaded_pipeline()
 
-def generate_images(
+def generate_images_job(
     seed, prompt, negative_prompt, width, height, guidance_scale,
     num_inference_steps, memory_optimization, vaeslicing, vaetiling, 
 ):
-    if modules.util.appstate.global_inference_in_progress == True:
-        print(">>>>Inference in progress, can't continue<<<<")
-        return None
-    modules.util.appstate.global_inference_in_progress = True
     try:
         # Get pipeline (either cached or newly loaded)
         pipe = get_pipeline(memory_optimization, vaeslicing, vaetiling, "lumina1")
@@ -113,7 +111,6 @@ def generate_images(
         image.save(output_path)
         modules.util.utilities.save_metadata_to_file(output_path, metadata)
         print(f"Image generated: {output_path}")
-        modules.util.appstate.global_inference_in_progress = False
         # Add to gallery items
         gallery_items.append((output_path, "Lumina"))
         
@@ -121,8 +118,16 @@ def generate_images(
     except Exception as e:
         print(f"Error during inference: {str(e)}")
         return None
-    finally:
-        modules.util.appstate.global_inference_in_progress = False
+
+def generate_images(
+    seed, prompt, negative_prompt, width, height, guidance_scale,
+    num_inference_steps, memory_optimization, vaeslicing, vaetiling, 
+):
+    pipeline_key = make_pipeline_key("LuminaText2ImgPipeline", inference_type="lumina1", memory_mode=memory_optimization)
+    return run_gpu_job(
+        generate_images_job, seed, prompt, negative_prompt, width, height, guidance_scale, num_inference_steps, memory_optimization, vaeslicing, vaetiling,
+        pipeline_key=pipeline_key
+    )
 
 def create_lumina_tab():
     initial_state = state_manager.get_state("lumina") or {}
@@ -234,5 +239,6 @@ def create_lumina_tab():
             lumina_height_input, lumina_guidance_scale_slider, lumina_num_inference_steps_input, 
             lumina_memory_optimization, lumina_vaeslicing, lumina_vaetiling,
         ],
-        outputs=[output_gallery]
+        outputs=[output_gallery],
+        concurrency_limit=modules.util.appstate.JOB_QUEUE_SIZE,
     )
\ No newline at end of file
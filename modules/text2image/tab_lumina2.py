@@ -9,8 +9,8 @@ import os
 import re
 import modules.util.appstate
 from datetime import datetime
-from diffusers import Lumina2Text2ImgPipeline
-from modules.util.utilities import clear_previous_model_memory
+from modules.util.utilities import acquire_pipeline, load_shared_components, register_loaded_pipeline, run_gpu_job
+from modules.util.pipeline_cache import make_pipeline_key
 from modules.util.appstate import state_manager
 
 MAX_SEED = np.iinfo(np.int32).max
@@ -36,23 +36,23 @@ def generate_crop_size_list(num_patches, patch_size, max_ratio=4.0):
     return crop_size_list
 
 def get_pipeline(inference_type, memory_optimization, vaeslicing, vaetiling):
+    from diffusers import Lumina2Text2ImgPipeline
     print("----Lumina2 mode: ", inference_type, memory_optimization, vaeslicing, vaetiling)
     # If model is already loaded with same configuration, reuse it
-    if (modules.util.appstate.global_pipe is not None and 
-    type(modules.util.appstate.global_pipe).__name__ == "Lumina2Text2ImgPipeline" and
-    modules.util.appstate.global_inference_type == inference_type and 
-    modules.util.appstate.global_memory_mode == memory_optimization):
-            print(">>>>Reusing Lumina2 Default pipe<<<<")
-            return modules.util.appstate.global_pipe
-    else:
-        clear_previous_model_memory()
+    pipe = acquire_pipeline("Lumina2Text2ImgPipeline", inference_type=inference_type, memory_mode=memory_optimization)
+    if pipe is not None:
+        print(">>>>Reusing Lumina2 Default pipe<<<<")
+        return pipe
 
     bfl_repo = "Alpha-VLLM/Lumina-Image-2.0"
     dtype = torch.bfloat16
     
+    # Only the text encoder is shared, the VAE settings are changed on the module below
+    shared_components = load_shared_components(Lumina2Text2ImgPipeline, bfl_repo, ["text_encoder"], dtype, memory_optimization)
     modules.util.appstate.global_pipe = Lumina2Text2ImgPipeline.from_pretrained(
         bfl_repo,
         torch_dtype=dtype,
+        **shared_components,
     )
     if memory_optimization == "Low VRAM":
         modules.util.appstate.global_pipe.enable_model_cpu_offload()
@@ -72,16 +72,12 @@ def get_pipeline(inference_type, memory_optimization, vaeslicing, vaetiling):
     # Update global variables
     modules.util.appstate.global_memory_mode = memory_optimization
     modules.util.appstate.global_inference_type = inference_type
-    return modules.util.appstate.global_pipe
+    return register_loaded_pipeline()
 
-def generate_images(
+def generate_images_job(
     seed, prompt, negative_prompt, resolution, guidance_scale,
     num_inference_steps, memory_optimization, vaeslicing, vaetiling
 ):
-    if modules.util.appstate.global_inference_in_progress == True:
-        print(">>>>Inference in progress, can't continue<<<<")
-        return None
-    modules.util.appstate.global_inference_in_progress = True
     try:
         width, height = get_dimensions(resolution)
         # Get pipeline (either cached or newly loaded)
@@ -136,7 +132,6 @@ def generate_images(
         image.save(output_path)
         modules.util.utilities.save_metadata_to_file(output_path, metadata)
         print(f"Image generated: {output_path}")
-        modules.util.appstate.global_inference_in_progress = False
         # Add to gallery items
         gallery_items.append((output_path, "Lumina 2"))
         
@@ -144,8 +139,17 @@ def generate_images(
     except Exception as e:
         print(f"Error during inference: {str(e)}")
         return None
-    finally:
-        modules.util.appstate.global_inference_in_progress = False
+
+def generate_images(
+    seed, prompt, negative_prompt, resolution, guidance_scale,
+    num_inference_steps, memory_optimization, vaeslicing, vaetiling
+):
+    pipeline_key = make_pipeline_key("Lumina2Text2ImgPipeline", inference_type="lumina2", memory_mode=memory_optimization)
+    return run_gpu_job(
+        generate_images_job, seed, prompt, negative_prompt, resolution, guidance_scale, num_inference_steps, memory_optimization, vaeslicing, vaetiling,
+        pipeline_key=pipeline_key
+    )
+
 def create_lumina2_tab():
     gr.HTML("<style>.small-button { max-width: 2.2em; min-width: 2.2em !important; height: 2.4em; align-self: end; line-height: 1em; border-radius: 0.5em; }</style>", visible=False)
     initial_state = state_manager.get_state("lumina2") or {}
@@ -247,5 +251,6 @@ def create_lumina2_tab():
             lumina2_num_inference_steps_input, lumina2_memory_optimization, 
             lumina2_vaeslicing, lumina2_vaetiling
         ],
-        outputs=[output_gallery]
+        outputs=[output_gallery],
+        concurrency_limit=modules.util.appstate.JOB_QUEUE_SIZE,
     )
\ No newline at end of file
@@ -8,8 +8,8 @@ import numpy as np
 import os
 import modules.util.appstate
 from datetime import datetime
-from diffusers import SanaPipeline
-from modules.util.utilities import clear_previous_model_memory
+from modules.util.utilities import acquire_pipeline, load_shared_components, register_loaded_pipeline, run_gpu_job
+from modules.util.pipeline_cache import make_pipeline_key
 from modules.util.appstate import state_manager
 
 MAX_SEED = np.iinfo(np.int32).max
@@ -76,15 +76,12 @@ def random_seed():
     return torch.randint(0, MAX_SEED, (1,)).item()
 
 def get_pipeline(inference_type, memory_optimization, vaeslicing, vaetiling):
+    from diffusers import SanaPipeline
     print("----Sana mode: ",inference_type, memory_optimization, vaeslicing, vaetiling)
-    if (modules.util.appstate.global_pipe is not None and 
-        type(modules.util.appstate.global_pipe).__name__ == "SanaPipeline" and
-        modules.util.appstate.global_inference_type == inference_type and 
-        modules.util.appstate.global_memory_mode == memory_optimization):
+    pipe = acquire_pipeline("SanaPipeline", inference_type=inference_type, memory_mode=memory_optimization)
+    if pipe is not None:
         print(">>>>Reusing Sana pipe<<<<")
-        return modules.util.appstate.global_pipe
-    else:
-        clear_previous_model_memory()
+        return pipe
     
     # Determine model path based on inference type
     if inference_type == "Sana_1600M_512px_MultiLing":
@@ -108,6 +105,14 @@ def get_pipeline(inference_type, memory_optimization, vaeslicing, vaetiling):
         dtype = torch.bfloat16
         variant="bf16"
 
+    # The text encoder is keyed by its files, so every Sana checkpoint shipping the same one (and Twig,
+    # which uses the Sana 1K repository) shares it. The VAE is not shared, because its slicing and
+    # tiling settings are changed on the module below.
+    shared_components = load_shared_components(
+        SanaPipeline, model_path, ["text_encoder"], dtype, memory_optimization,
+        variant=None if inference_type == "Sana_1600M_512px_MultiLing" else variant,
+    )
+
     # Initialize pipeline
     if inference_type == "Twig-v0-alpha":
         from diffusers import SanaTransformer2DModel
@@ -120,6 +125,7 @@ def get_pipeline(inference_type, memory_optimization, vaeslicing, vaetiling):
             transformer=transformer,
             torch_dtype=dtype,
             use_safetensors=True,
+            **shared_components,
         )
     else:
         if inference_type == "Sana_1600M_512px_MultiLing":
@@ -127,6 +133,7 @@ def get_pipeline(inference_type, memory_optimization, vaeslicing, vaetiling):
                 pretrained_model_name_or_path=model_path,
                 torch_dtype=dtype,
                 use_safetensors=True,
+                **shared_components,
             )
         else:
             modules.util.appstate.global_pipe = SanaPipeline.from_pretrained(
@@ -134,6 +141,7 @@ def get_pipeline(inference_type, memory_optimization, vaeslicing, vaetiling):
                 variant=variant,
                 torch_dtype=dtype,
                 use_safetensors=True,
+                **shared_components,
             )
     # modules.util.appstate.global_pipe.to("cuda")
     # modules.util.appstate.global_pipe.vae.to(torch.bfloat16)
@@ -163,30 +171,39 @@ def get_pipeline(inference_type, memory_optimization, vaeslicing, vaetiling):
     # Update global variables
     modules.util.appstate.global_memory_mode = memory_optimization
     modules.util.appstate.global_inference_type = inference_type
-    return modules.util.appstate.global_pipe
+    return register_loaded_pipeline()
 
-def generate_images(
-    seed, prompt, negative_prompt, width, height, guidance_scale,
-    num_inference_steps, memory_optimization, inference_type, 
-    vaeslicing, vaetiling, sana_dropdown
-):
+def apply_style(prompt, negative_prompt, sana_dropdown):
+    # Apply style template if a style is selected
+    if sana_dropdown != "(No style)":
+        selected_style = next((style for style in style_list if style["name"] == sana_dropdown), None)
+        if selected_style:
+            prompt = selected_style["prompt"].replace("{prompt}", prompt)
+            if not negative_prompt:  # Only override if no custom negative prompt
+                negative_prompt = selected_style["negative_prompt"]
+    return prompt, negative_prompt
+
+def generate_images_batch(jobs):
+    """
+    Generates the images of several queued requests with one pipeline call
 
-    if modules.util.appstate.global_inference_in_progress == True:
-        print(">>>>Inference in progress, can't continue<<<<")
-        return None
-    modules.util.appstate.global_inference_in_progress = True
+    Args:
+        jobs (list): The generate_images arguments of each request. All requests share
+            the settings in their batch key and differ only in seed, prompt and style
+
+    Returns:
+        list: The gallery items of each request, or None for every request on failure
+    """
     try:
-        # Apply style template if a style is selected
-        if sana_dropdown != "(No style)":
-            selected_style = next((style for style in style_list if style["name"] == sana_dropdown), None)
-            if selected_style:
-                prompt = selected_style["prompt"].replace("{prompt}", prompt)
-                if not negative_prompt:  # Only override if no custom negative prompt
-                    negative_prompt = selected_style["negative_prompt"]
+        _, _, _, width, height, guidance_scale, num_inference_steps, memory_optimization, inference_type, vaeslicing, vaetiling, _ = jobs[0]
+        seeds = [job[0] for job in jobs]
+        styled = [apply_style(job[1], job[2], job[11]) for job in jobs]
+        prompts = [prompt for prompt, _ in styled]
+        negative_prompts = [negative_prompt for _, negative_prompt in styled]
 
         # Get pipeline (either cached or newly loaded)
         pipe = get_pipeline(inference_type, memory_optimization, vaeslicing, vaetiling)
-        generator = torch.Generator(device="cpu").manual_seed(seed)
+        generators = [torch.Generator(device="cpu").manual_seed(seed) for seed in seeds]
         
         progress_bar = gr.Progress(track_tqdm=True)
 
@@ -196,17 +213,17 @@ def generate_images(
 
         # Prepare inference parameters
         inference_params = {
-            "prompt": prompt,
-            "negative_prompt": negative_prompt,
+            "prompt": prompts,
+            "negative_prompt": negative_prompts,
             "height": height,
             "width": width,
             "guidance_scale": guidance_scale,
             "num_inference_steps": num_inference_steps,
-            "generator": generator,
+            "generator": generators,
             "callback_on_step_end": callback_on_step_end,
         }
         
-        # Generate images
+        # Generate images, one per request
         start_time = datetime.now()
         images = pipe(**inference_params).images
         end_time = datetime.now()
@@ -226,19 +243,19 @@ def generate_images(
         elif inference_type == "Twig-v0-alpha":
             base_filename = "sana_Twig-v0-alpha.png"
         
-        # Save each image with unique timestamp and collect paths for gallery
-        gallery_items = []
-        for idx, image in enumerate(images):
+        # Save each image with unique timestamp and collect paths for the gallery of its request
+        results = []
+        for idx, (image, job) in enumerate(zip(images, jobs)):
             # Generate unique timestamp for each image
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
             filename = f"{timestamp}_{idx+1}_{base_filename}"
             output_path = os.path.join(OUTPUT_DIR, filename)
             metadata = {
                 "inference_type": inference_type,
-                "style": sana_dropdown,
-                "prompt": prompt,
-                "negative_prompt": negative_prompt,
-                "seed": seed,
+                "style": job[11],
+                "prompt": prompts[idx],
+                "negative_prompt": negative_prompts[idx],
+                "seed": seeds[idx],
                 "guidance_scale": guidance_scale,
                 "num_inference_steps": num_inference_steps,
                 "width": width,
@@ -247,7 +264,8 @@ def generate_images(
                 "vae_slicing": vaeslicing,
                 "vae_tiling": vaetiling,
                 "timestamp": timestamp,
-                "generation_time": generation_time
+                "generation_time": generation_time,
+                "batch_size": len(jobs)
             }
             # Save the image
             image.save(output_path)
@@ -255,14 +273,27 @@ def generate_images(
             print(f"Image {idx+1} generated: {output_path}")
             
             # Add to gallery items
-            gallery_items.append((output_path, f"{inference_type}"))
-        modules.util.appstate.global_inference_in_progress = False
-        return gallery_items
+            results.append([(output_path, f"{inference_type}")])
+        return results
     except Exception as e:
         print(f"Error during inference: {str(e)}")
-        return None
-    finally:
-        modules.util.appstate.global_inference_in_progress = False
+        return [None] * len(jobs)
+
+def generate_images_job(*args):
+    return generate_images_batch([args])[0]
+
+def generate_images(
+    seed, prompt, negative_prompt, width, height, guidance_scale,
+    num_inference_steps, memory_optimization, inference_type, 
+    vaeslicing, vaetiling, sana_dropdown
+):
+    pipeline_key = make_pipeline_key("SanaPipeline", inference_type=inference_type, memory_mode=memory_optimization)
+    # Requests that differ only in seed, prompt and style are merged into one pipeline call
+    batch_key = (pipeline_key, width, height, guidance_scale, num_inference_steps, vaeslicing, vaetiling)
+    return run_gpu_job(
+        generate_images_job, seed, prompt, negative_prompt, width, height, guidance_scale, num_inference_steps, memory_optimization, inference_type, vaeslicing, vaetiling, sana_dropdown,
+        pipeline_key=pipeline_key, batch_key=batch_key, batch_fn=generate_images_batch
+    )
 
 def update_style_prompts(style_name):
     """Update the prompt template and negative prompt based on selected style"""
@@ -434,5 +465,6 @@ def create_sana_tab():
             sana_memory_optimization, sana_inference_type, sana_vaeslicing, sana_vaetiling, 
             sana_style_dropdown,
         ],
-        outputs=[output_gallery]
+        outputs=[output_gallery],
+        concurrency_limit=modules.util.appstate.JOB_QUEUE_SIZE,
     )
\ No newline at end of file
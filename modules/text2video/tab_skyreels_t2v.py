@@ -8,9 +8,8 @@ import numpy as np
 import os
 import modules.util.appstate
 from datetime import datetime
-from diffusers.utils import export_to_video
-from diffusers import HunyuanVideoPipeline, HunyuanVideoTransformer3DModel
-from modules.util.utilities import clear_previous_model_memory
+from modules.util.utilities import acquire_pipeline, clear_previous_model_memory, register_loaded_pipeline, run_gpu_job
+from modules.util.pipeline_cache import make_pipeline_key
 from modules.util.appstate import state_manager
 
 MAX_SEED = np.iinfo(np.int32).max
@@ -20,16 +19,11 @@ def random_seed():
     return torch.randint(0, MAX_SEED, (1,)).item()
 
 def get_pipeline(inference_type, memory_optimization, vaeslicing, vaetiling):
+    from diffusers import HunyuanVideoPipeline, HunyuanVideoTransformer3DModel
     print("----skyreels mode: ", inference_type, memory_optimization, vaeslicing, vaetiling)
-    # If model is already loaded with same configuration, reuse it
-    if (modules.util.appstate.global_pipe is not None and 
-        type(modules.util.appstate.global_pipe).__name__ == "HunyuanVideoPipeline" and
-        modules.util.appstate.global_inference_type == inference_type and
-        modules.util.appstate.global_memory_mode == memory_optimization):
+    # The int4 SkyReels pipe is always reloaded, even when the same configuration is resident
+    if acquire_pipeline("HunyuanVideoPipeline", inference_type=inference_type, memory_mode=memory_optimization) is not None:
         print(">>>>Reusing Skyreel pipe<<<<")
-        # return modules.util.appstate.global_pipe
-        clear_previous_model_memory()
-    else:
         clear_previous_model_memory()
 
     repo_id = "newgenai79/HunyuanVideo-int4"
@@ -59,16 +53,12 @@ def get_pipeline(inference_type, memory_optimization, vaeslicing, vaetiling):
 
     modules.util.appstate.global_memory_mode = memory_optimization
     modules.util.appstate.global_inference_type = inference_type
-    return modules.util.appstate.global_pipe
+    return register_loaded_pipeline()
 
-def generate_video(
+def generate_video_job(
     seed, prompt, width, height, fps, num_inference_steps, num_frames, 
     memory_optimization, vaeslicing, vaetiling, guidance_scale
 ):
-    if modules.util.appstate.global_inference_in_progress == True:
-        print(">>>>Inference in progress, can't continue<<<<")
-        return None
-    modules.util.appstate.global_inference_in_progress = True
     try:
         # Get pipeline (either cached or newly loaded)
         pipe = get_pipeline("skyreelst2v", memory_optimization, vaeslicing, vaetiling)
@@ -104,16 +94,24 @@ def generate_video(
         output_path = os.path.join(OUTPUT_DIR, filename)
         
         # Save the video
+        from diffusers.utils import export_to_video
         export_to_video(video, output_path, fps=fps)
         print(f"Video generated: {output_path}")
-        modules.util.appstate.global_inference_in_progress = False
         
         return output_path
     except Exception as e:
         print(f"Error during inference: {str(e)}")
         return None
-    finally:
-        modules.util.appstate.global_inference_in_progress = False
+
+def generate_video(
+    seed, prompt, width, height, fps, num_inference_steps, num_frames, 
+    memory_optimization, vaeslicing, vaetiling, guidance_scale
+):
+    pipeline_key = make_pipeline_key("HunyuanVideoPipeline", inference_type="skyreelst2v", memory_mode=memory_optimization)
+    return run_gpu_job(
+        generate_video_job, seed, prompt, width, height, fps, num_inference_steps, num_frames, memory_optimization, vaeslicing, vaetiling, guidance_scale,
+        pipeline_key=pipeline_key
+    )
 
 def create_skyreels_t2v_tab():
     initial_state = state_manager.get_state("skyreels_t2v") or {}
@@ -223,5 +221,6 @@ def create_skyreels_t2v_tab():
             skyreels_num_frames_input, skyreels_memory_optimization, skyreels_vaeslicing,
             skyreels_vaetiling, skyreels_guidance_scale_slider
         ],
-        outputs=[output_video]
+        outputs=[output_video],
+        concurrency_limit=modules.util.appstate.JOB_QUEUE_SIZE,
     )
\ No newline at end of file
@@ -8,11 +8,8 @@ import numpy as np
 import os
 import modules.util.appstate
 from datetime import datetime
-from diffsynth.models.model_manager import ModelManager
-from diffsynth.pipelines.wan_video import WanVideoPipeline
-from diffsynth.data.video import save_video, VideoData
-from modelscope import snapshot_download
-from modules.util.utilities import clear_previous_model_memory
+from modules.util.utilities import acquire_pipeline, register_loaded_pipeline, run_gpu_job
+from modules.util.pipeline_cache import make_pipeline_key
 from modules.util.appstate import state_manager
 
 MAX_SEED = np.iinfo(np.int32).max
@@ -22,16 +19,15 @@ def random_seed():
     return torch.randint(0, MAX_SEED, (1,)).item()
 
 def get_pipeline(inference_type, memory_optimization):
+    from modelscope import snapshot_download
+    from diffsynth.models.model_manager import ModelManager
+    from diffsynth.pipelines.wan_video import WanVideoPipeline
     print("----Wan 2.1 mode: ", inference_type, memory_optimization)
     # If model is already loaded with same configuration, reuse it
-    if (modules.util.appstate.global_pipe is not None and 
-        type(modules.util.appstate.global_pipe).__name__ == "WanVideoPipeline" and
-        modules.util.appstate.global_inference_type == inference_type and
-        modules.util.appstate.global_memory_mode == memory_optimization):
+    pipe = acquire_pipeline("WanVideoPipeline", inference_type=inference_type, memory_mode=memory_optimization)
+    if pipe is not None:
         print(">>>>Reusing Wan 2.1 pipe<<<<")
-        return modules.util.appstate.global_pipe
-    else:
-        clear_previous_model_memory()
+        return pipe
     if(memory_optimization == "bfloat16"):
         dtype=torch.bfloat16
     else:
@@ -60,16 +56,12 @@ def get_pipeline(inference_type, memory_optimization):
 
     modules.util.appstate.global_memory_mode = memory_optimization
     modules.util.appstate.global_inference_type = inference_type
-    return modules.util.appstate.global_pipe
+    return register_loaded_pipeline()
 
-def generate_video(
+def generate_video_job(
     seed, prompt, negative_prompt, width, height, fps, num_inference_steps, 
-    num_frames, memory_optimization, quality
+    num_frames, memory_optimization, quality, tea_cache_l1_thresh
 ):
-    if modules.util.appstate.global_inference_in_progress == True:
-        print(">>>>Inference in progress, can't continue<<<<")
-        return None
-    modules.util.appstate.global_inference_in_progress = True
     try:
         # Get pipeline (either cached or newly loaded)
         pipe = get_pipeline("wan21t2v", memory_optimization)
@@ -84,6 +76,9 @@ def generate_video(
             num_frames=num_frames,
             seed=seed, 
             tiled=True,
+            tea_cache_l1_thresh=tea_cache_l1_thresh if tea_cache_l1_thresh > 0 else None,
+            stream_output=True,
+            output_type="np",
             progress_bar_cmd=lambda x: progress_bar.tqdm(x, desc="Processing")
         )
         
@@ -97,17 +92,25 @@ def generate_video(
         filename = f"{timestamp}_{base_filename}"
         output_path = os.path.join(OUTPUT_DIR, filename)
         
-        # Save the video
+        # Save the video, frames are written while the VAE decodes them
+        from diffsynth.data.video import save_video
         save_video(video, output_path, fps=fps, quality=quality)
         print(f"Video generated: {output_path}")
-        modules.util.appstate.global_inference_in_progress = False
         
         return output_path
     except Exception as e:
         print(f"Error during inference: {str(e)}")
         return None
-    finally:
-        modules.util.appstate.global_inference_in_progress = False
+
+def generate_video(
+    seed, prompt, negative_prompt, width, height, fps, num_inference_steps, 
+    num_frames, memory_optimization, quality, tea_cache_l1_thresh
+):
+    pipeline_key = make_pipeline_key("WanVideoPipeline", inference_type="wan21t2v", memory_mode=memory_optimization)
+    return run_gpu_job(
+        generate_video_job, seed, prompt, negative_prompt, width, height, fps, num_inference_steps, num_frames, memory_optimization, quality, tea_cache_l1_thresh,
+        pipeline_key=pipeline_key
+    )
 
 def create_wan21_t2v_tab():
     initial_state = state_manager.get_state("wan21_t2v") or {}
@@ -176,6 +179,14 @@ def create_wan21_t2v_tab():
                     step=1,
                     interactive=True
                 )
+                wan21_tea_cache_slider = gr.Slider(
+                    label="TeaCache threshold (0 = off, higher is faster)", 
+                    minimum=0, 
+                    maximum=0.3, 
+                    value=initial_state.get("tea_cache_l1_thresh", 0),
+                    step=0.01,
+                    interactive=True
+                )
             # with gr.Row():
                 # save_state_button = gr.Button("Save State")
         with gr.Column():
@@ -224,7 +235,8 @@ def create_wan21_t2v_tab():
         inputs=[
             seed_input, wan21_prompt_input, wan21_negative_prompt_input, wan21_width_input, 
             wan21_height_input, wan21_fps_input, wan21_num_inference_steps_input, 
-            wan21_num_frames_input, wan21_memory_optimization, wan21_quality_slider
+            wan21_num_frames_input, wan21_memory_optimization, wan21_quality_slider, wan21_tea_cache_slider
         ],
-        outputs=[output_video]
+        outputs=[output_video],
+        concurrency_limit=modules.util.appstate.JOB_QUEUE_SIZE,
     )
\ No newline at end of file
@@ -3,17 +3,49 @@ Global application state and browser state management for the WebUI
 """
 import os
 import json
+from modules.util.pipeline_cache import PipelineCache
+from modules.util.component_registry import ComponentRegistry
+from modules.util.job_scheduler import JobScheduler
+
+# Budget for pipelines kept warm besides the active one (None = unlimited RAM, 25% of VRAM)
+PIPELINE_CACHE_RAM_BUDGET_BYTES = 48 * 1024**3
+PIPELINE_CACHE_VRAM_BUDGET_BYTES = None
+PIPELINE_CACHE_MAX_PIPELINES = 3
+
+# Inference jobs waiting at most, and jobs with identical settings merged into one pipeline call
+JOB_QUEUE_SIZE = 16
+JOB_MAX_BATCH_SIZE = 4
+JOB_MAX_WAIT_SECONDS = 120
+
+def pipeline_is_resident(key):
+    # Imported here because utilities imports this module
+    from modules.util.utilities import current_pipeline_key
+    if global_pipe is not None and current_pipeline_key() == key:
+        return True
+    return key in global_pipeline_cache
 
 # Existing global variables
 global_pipe = None
 global_memory_mode = None
 global_inference_type = None
 global_quantization = None
-global_inference_in_progress = False
 global_selected_gguf = None
 global_textencoder = None
 global_model_type = None
 global_selected_lora = None
+global_component_registry = ComponentRegistry()
+global_pipeline_cache = PipelineCache(
+    ram_budget_bytes=PIPELINE_CACHE_RAM_BUDGET_BYTES,
+    vram_budget_bytes=PIPELINE_CACHE_VRAM_BUDGET_BYTES,
+    max_pipelines=PIPELINE_CACHE_MAX_PIPELINES,
+    component_registry=global_component_registry,
+)
+global_job_scheduler = JobScheduler(
+    max_queue_size=JOB_QUEUE_SIZE,
+    max_batch_size=JOB_MAX_BATCH_SIZE,
+    max_wait_seconds=JOB_MAX_WAIT_SECONDS,
+    is_resident=pipeline_is_resident,
+)
 class StateManager:
     def __init__(self):
         self.state_dir = "saved_state"
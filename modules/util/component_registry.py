@@ -0,0 +1,172 @@
+"""
+Registry of loaded pipeline components (text encoders, VAEs) shared between pipelines
+"""
+import importlib, hashlib, json, os
+from collections import namedtuple
+import torch
+
+
+ComponentKey = namedtuple(
+    "ComponentKey",
+    ["source", "subfolder", "dtype", "quantization", "placement"]
+)
+
+
+def make_component_key(source, subfolder=None, dtype=None, quantization=None, placement=None):
+    return ComponentKey(source, subfolder, str(dtype) if dtype is not None else None, quantization, placement)
+
+
+# Content identities resolved in this session, by (repo_id, subfolder, variant)
+resolved_sources = {}
+
+
+def resolve_component_source(repo_id, subfolder, variant=None):
+    """
+    Identifies a component of a diffusers repository by its files rather than by the repository
+
+    Repositories that ship the same component (e.g. the text encoder of every Sana checkpoint)
+    resolve to the same identity and share one instance. The identity hashes the name and the
+    LFS sha256 (or git blob id) of every file in the subfolder, as listed by the HuggingFace Hub.
+    Local folders and failed lookups (e.g. offline) fall back to the repository name.
+    """
+    fallback = repo_id if variant is None else f"{repo_id}@{variant}"
+    if os.path.isdir(repo_id):
+        return fallback
+    cache_key = (repo_id, subfolder, variant)
+    if cache_key not in resolved_sources:
+        try:
+            from huggingface_hub import HfApi
+            siblings = HfApi().model_info(repo_id, files_metadata=True).siblings
+            prefix = f"{subfolder}/"
+            files = sorted(
+                (sibling.rfilename[len(prefix):], sibling.lfs["sha256"] if sibling.lfs is not None else sibling.blob_id)
+                for sibling in siblings if sibling.rfilename.startswith(prefix)
+            )
+            if len(files) == 0:
+                return fallback
+            digest = hashlib.sha256(json.dumps([variant, files]).encode("utf-8")).hexdigest()
+            resolved_sources[cache_key] = f"sha256:{digest[:16]}"
+        except Exception as e:
+            print(f"Error resolving the files of {repo_id}/{subfolder}, sharing it by repository: {str(e)}")
+            return fallback
+    return resolved_sources[cache_key]
+
+
+def iter_pipeline_components(pipe):
+    """Yields the torch modules a diffusers or diffsynth pipeline was built from"""
+    if isinstance(pipe, torch.nn.Module):
+        yield from pipe.children()
+        return
+    components = getattr(pipe, "components", None)
+    if not isinstance(components, dict):
+        components = vars(pipe)
+    for component in components.values():
+        if isinstance(component, torch.nn.Module):
+            yield component
+
+
+class ComponentRegistry:
+    """
+    Hands the same module instance to every pipeline that loads the same component.
+
+    Components are reference counted by the pipelines that hold them: attach counts the
+    registered components a freshly loaded pipeline uses, detach uncounts them when the
+    pipeline is released. A component is dropped from the registry when no pipeline holds
+    it, so that only unshared weights are freed when switching models.
+
+    The placement (memory mode) is part of the key, because CPU offload hooks and device
+    moves apply to the module itself and would conflict between pipelines.
+    """
+    def __init__(self):
+        self.entries = {}
+        self.hits = 0
+        self.loads = 0
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, loader, loaded_from=None):
+        """
+        Returns the registered component for key, or registers the result of loader()
+
+        Args:
+            key (ComponentKey): Identifies the weights, dtype, quantization and placement
+            loader (callable): Loads the component when it is not registered yet
+            loaded_from (str): Where loader reads the component from, for the log. Defaults to key.source
+        """
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            print(f">>>>Sharing {key.subfolder} of {entry['loaded_from']} ({len(entry['owners'])} pipelines)<<<<")
+            return entry["component"]
+        self.loads += 1
+        component = loader()
+        self.entries[key] = {"component": component, "owners": set(), "loaded_from": key.source if loaded_from is None else loaded_from}
+        return component
+
+    def attach(self, pipe):
+        """Counts the registered components used by a freshly loaded pipeline"""
+        components = set(id(component) for component in iter_pipeline_components(pipe))
+        for entry in self.entries.values():
+            if id(entry["component"]) in components:
+                entry["owners"].add(id(pipe))
+        # Components loaded for a pipeline that failed to build
+        self.collect()
+
+    def detach(self, pipe):
+        """
+        Uncounts the components of a released pipeline
+
+        Returns:
+            bool: True if the pipeline holds components still used by other pipelines
+        """
+        kept = []
+        for key, entry in self.entries.items():
+            if id(pipe) in entry["owners"]:
+                entry["owners"].discard(id(pipe))
+                if len(entry["owners"]) > 0:
+                    kept.append(key)
+        if len(kept) > 0:
+            print(f">>>>Keeping shared {', '.join(key.subfolder for key in kept)}, freeing the rest of the pipeline<<<<")
+        self.collect()
+        return len(kept) > 0
+
+    def collect(self):
+        for key in [key for key, entry in self.entries.items() if len(entry["owners"]) == 0]:
+            del self.entries[key]
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        return {
+            "components": len(self.entries),
+            "shared_components": sum(len(entry["owners"]) > 1 for entry in self.entries.values()),
+            "hits": self.hits,
+            "loads": self.loads,
+        }
+
+
+def load_shared_components(registry, pipeline_class, repo_id, component_names, torch_dtype, placement, variant=None, quantization=None):
+    """
+    Loads components of a diffusers repository through the registry
+
+    The component classes are read from the model_index.json of the repository. Components
+    are keyed by their content (see resolve_component_source), so other repositories with
+    the same files reuse them.
+
+    Returns:
+        dict: Component name to module, to be passed on to pipeline_class.from_pretrained
+    """
+    model_index = pipeline_class.load_config(repo_id)
+    components = {}
+    for name in component_names:
+        library, class_name = model_index[name]
+        component_class = getattr(importlib.import_module(library), class_name)
+        source = resolve_component_source(repo_id, name, variant=variant)
+        key = make_component_key(source, name, torch_dtype, quantization, placement)
+        kwargs = {"subfolder": name, "torch_dtype": torch_dtype}
+        if variant is not None:
+            kwargs["variant"] = variant
+        components[name] = registry.get(key, lambda: component_class.from_pretrained(repo_id, **kwargs), loaded_from=repo_id)
+    return components
@@ -0,0 +1,184 @@
+"""
+GPU job scheduler that runs the inference requests of every tab on one worker thread
+"""
+import contextvars
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+
+class QueueFullError(RuntimeError):
+    pass
+
+
+class Job:
+    def __init__(self, fn, args, kwargs, pipeline_key=None, priority=0, batch_key=None, batch_fn=None):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.pipeline_key = pipeline_key
+        self.priority = priority
+        self.batch_key = batch_key
+        self.batch_fn = batch_fn
+        # Gradio keeps the progress tracker of a request in a context variable
+        self.context = contextvars.copy_context()
+        self.future = Future()
+        self.sequence = None
+        self.submitted = time.time()
+
+
+class JobScheduler:
+    """
+    Bounded priority queue of inference jobs drained by a single worker that owns the device.
+
+    The next job is chosen by priority (higher first), then by whether its pipeline is
+    already loaded, then by submission order. A job that has waited max_wait_seconds is
+    no longer overtaken by jobs for a resident pipeline. Queued jobs with the same
+    batch_key are merged into one call of their batch_fn.
+
+    Args:
+        max_queue_size (int): Jobs waiting at most, submit raises QueueFullError beyond it
+        max_batch_size (int): Jobs merged into one batch_fn call at most
+        max_wait_seconds (float): Wait after which a job is served in submission order
+        is_resident (callable): Maps a pipeline key to True if that pipeline is loaded
+    """
+    def __init__(self, max_queue_size=16, max_batch_size=4, max_wait_seconds=120, is_resident=None):
+        self.max_queue_size = max_queue_size
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_seconds
+        self.is_resident = is_resident
+        self.queue = []
+        self.condition = threading.Condition()
+        self.counter = itertools.count()
+        self.worker = None
+        self.running = []
+        self.completed = 0
+        self.failed = 0
+        self.merged = 0
+        self.resident_first = 0
+        self.wait_times = deque(maxlen=100)
+
+    def submit(self, fn, *args, pipeline_key=None, priority=0, batch_key=None, batch_fn=None, **kwargs):
+        """
+        Queues fn(*args, **kwargs) for the worker
+
+        Args:
+            pipeline_key (PipelineKey): The pipeline the job loads, used to run resident jobs first
+            priority (int): Jobs with a higher priority run first
+            batch_key: Jobs with an equal, non-None batch_key may be merged
+            batch_fn (callable): Receives a list with the args tuple of each merged job
+                and returns a list with one result per job
+
+        Returns:
+            concurrent.futures.Future: Resolves to the return value of the job
+        """
+        job = Job(fn, args, kwargs, pipeline_key, priority, batch_key, batch_fn)
+        with self.condition:
+            if len(self.queue) >= self.max_queue_size:
+                raise QueueFullError(f"Job queue is full ({self.max_queue_size} jobs waiting)")
+            job.sequence = next(self.counter)
+            self.queue.append(job)
+            self.start_worker()
+            self.condition.notify()
+        return job.future
+
+    def run(self, fn, *args, **kwargs):
+        """Submits a job and blocks until its result is available"""
+        return self.submit(fn, *args, **kwargs).result()
+
+    def start_worker(self):
+        if self.worker is None or not self.worker.is_alive():
+            self.worker = threading.Thread(target=self.worker_loop, name="gpu-job-worker", daemon=True)
+            self.worker.start()
+
+    def job_is_resident(self, job):
+        if self.is_resident is None or job.pipeline_key is None:
+            return False
+        try:
+            return self.is_resident(job.pipeline_key)
+        except Exception as e:
+            print(f"Error checking pipeline residency: {str(e)}")
+            return False
+
+    def job_order(self, job, now):
+        served_in_order = now - job.submitted >= self.max_wait_seconds
+        return (-job.priority, not (served_in_order or self.job_is_resident(job)), job.sequence)
+
+    def take_next_jobs(self):
+        # Called with the condition held; residency is read here because only the worker changes it
+        now = time.time()
+        head = min(self.queue, key=lambda job: self.job_order(job, now))
+        if head.sequence != min(job.sequence for job in self.queue):
+            self.resident_first += 1
+        jobs = [head]
+        if head.batch_fn is not None and head.batch_key is not None:
+            for job in sorted(self.queue, key=lambda job: job.sequence):
+                if len(jobs) >= self.max_batch_size:
+                    break
+                if job is not head and job.batch_fn is head.batch_fn and job.batch_key == head.batch_key:
+                    jobs.append(job)
+        for job in jobs:
+            self.queue.remove(job)
+        return jobs
+
+    def worker_loop(self):
+        while True:
+            with self.condition:
+                while len(self.queue) == 0:
+                    self.condition.wait()
+                jobs = self.take_next_jobs()
+                jobs = [job for job in jobs if job.future.set_running_or_notify_cancel()]
+                self.running = jobs
+                queued = len(self.queue)
+            if len(jobs) > 0:
+                self.run_jobs(jobs, queued)
+            with self.condition:
+                self.running = []
+
+    def run_jobs(self, jobs, queued):
+        now = time.time()
+        for job in jobs:
+            self.wait_times.append(now - job.submitted)
+        try:
+            name = getattr(jobs[0].pipeline_key, "pipeline_class", jobs[0].pipeline_key) or jobs[0].fn.__name__
+            merged = f" ({len(jobs)} merged)" if len(jobs) > 1 else ""
+            print(f">>>>Running {name} job{merged} after {now - jobs[0].submitted:.1f}s in queue, {queued} still queued<<<<")
+            if len(jobs) == 1:
+                results = [jobs[0].context.run(jobs[0].fn, *jobs[0].args, **jobs[0].kwargs)]
+            else:
+                self.merged += len(jobs) - 1
+                results = jobs[0].context.run(jobs[0].batch_fn, [job.args for job in jobs])
+                if len(results) != len(jobs):
+                    raise ValueError(f"batch_fn returned {len(results)} results for {len(jobs)} jobs")
+            for job, result in zip(jobs, results):
+                job.future.set_result(result)
+            self.completed += len(jobs)
+        except BaseException as e:
+            self.failed += len(jobs)
+            for job in jobs:
+                if not job.future.done():
+                    job.future.set_exception(e)
+
+    def stats(self):
+        """
+        Reports the queue state
+
+        Returns:
+            dict: queue depth, running and finished job counts and wait seconds of recent jobs
+        """
+        with self.condition:
+            now = time.time()
+            queued_waits = [now - job.submitted for job in self.queue]
+            return {
+                "queue_depth": len(self.queue),
+                "running": len(self.running),
+                "completed": self.completed,
+                "failed": self.failed,
+                "merged": self.merged,
+                "resident_first": self.resident_first,
+                "oldest_queued_seconds": max(queued_waits) if queued_waits else 0.0,
+                "mean_wait_seconds": sum(self.wait_times) / len(self.wait_times) if self.wait_times else 0.0,
+                "max_wait_seconds": max(self.wait_times) if self.wait_times else 0.0,
+            }
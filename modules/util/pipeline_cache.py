@@ -0,0 +1,223 @@
+"""
+Residency cache that keeps several loaded pipelines warm between generations
+"""
+import gc
+import time
+from collections import OrderedDict, namedtuple
+import torch
+
+
+PipelineKey = namedtuple(
+    "PipelineKey",
+    ["pipeline_class", "inference_type", "memory_mode", "quantization", "gguf", "lora"]
+)
+
+
+def make_pipeline_key(pipeline_class, inference_type=None, memory_mode=None, quantization=None, gguf=None, lora=None):
+    if not isinstance(pipeline_class, str):
+        pipeline_class = pipeline_class.__name__
+    return PipelineKey(pipeline_class, inference_type, memory_mode, quantization, gguf, lora)
+
+
+def iter_pipeline_modules(pipe):
+    """Yields every torch module owned by a diffusers or diffsynth pipeline"""
+    if isinstance(pipe, torch.nn.Module):
+        yield pipe
+        return
+    components = getattr(pipe, "components", None)
+    if not isinstance(components, dict):
+        components = vars(pipe)
+    for component in components.values():
+        if isinstance(component, torch.nn.Module):
+            yield component
+
+
+def measure_pipeline_bytes(pipe):
+    """
+    Measures how many bytes a pipeline holds in host RAM and in device memory
+
+    Args:
+        pipe: A diffusers or diffsynth pipeline
+
+    Returns:
+        tuple: (ram_bytes, vram_bytes)
+    """
+    ram_bytes, vram_bytes = 0, 0
+    seen = set()
+    for module in iter_pipeline_modules(pipe):
+        for tensor in list(module.parameters()) + list(module.buffers()):
+            if tensor.device.type == "meta" or tensor.data_ptr() in seen:
+                continue
+            seen.add(tensor.data_ptr())
+            nbytes = tensor.numel() * tensor.element_size()
+            if tensor.device.type == "cpu":
+                ram_bytes += nbytes
+            else:
+                vram_bytes += nbytes
+    return ram_bytes, vram_bytes
+
+
+def release_pipeline(pipe, component_registry=None):
+    # Hooks of components still used by another pipeline must stay in place
+    shared = component_registry is not None and component_registry.detach(pipe)
+    if hasattr(pipe, 'remove_all_hooks') and not shared:
+        pipe.remove_all_hooks()
+    del pipe
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+class PipelineCache:
+    """
+    Least recently used cache of loaded pipelines bounded by a RAM and a VRAM byte budget.
+
+    The active pipeline lives in modules.util.appstate.global_pipe; this cache holds the
+    pipelines that were parked when the user switched to another model or memory mode.
+    """
+    def __init__(self, ram_budget_bytes=None, vram_budget_bytes=None, max_pipelines=4, component_registry=None):
+        self.ram_budget_bytes = ram_budget_bytes
+        self.vram_budget_bytes = vram_budget_bytes
+        self.max_pipelines = max_pipelines
+        self.component_registry = component_registry
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.load_times = {}
+        self.load_started = {}
+        self.loaded_bytes = {}
+
+    def get_vram_budget(self):
+        if self.vram_budget_bytes is not None:
+            return self.vram_budget_bytes
+        if torch.cuda.is_available():
+            # Parked pipelines share the card with the active one and its activations
+            return int(torch.cuda.get_device_properties(0).total_memory * 0.25)
+        return 0
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def put(self, key, pipe):
+        """
+        Parks a pipeline in the cache and evicts least recently used entries over budget
+
+        Args:
+            key (PipelineKey): The configuration the pipeline was loaded with
+            pipe: The pipeline to keep warm
+        """
+        if key in self.entries:
+            self.evict(key)
+        ram_bytes, vram_bytes = measure_pipeline_bytes(pipe)
+        self.entries[key] = {"pipe": pipe, "ram_bytes": ram_bytes, "vram_bytes": vram_bytes}
+        self.enforce_budget()
+
+    def pop(self, key):
+        """Removes and returns a cached pipeline, counting the lookup as a hit or a miss"""
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            self.load_started[key] = time.time()
+            return None
+        self.hits += 1
+        return entry["pipe"]
+
+    def record_hit(self):
+        """Counts a lookup served by the active pipeline without touching the cache"""
+        self.hits += 1
+
+    def record_load(self, key, active_bytes=(0, 0)):
+        """Records the load time of a pipeline that missed the cache and applies the budget"""
+        started = self.load_started.pop(key, None)
+        if started is not None:
+            self.load_times.setdefault(key, []).append(time.time() - started)
+        self.loaded_bytes[key] = active_bytes
+        self.enforce_budget(extra_bytes=active_bytes)
+
+    def fits(self, expected_bytes):
+        if self.over_budget(extra_bytes=expected_bytes):
+            return False
+        free_bytes, _ = torch.cuda.mem_get_info()
+        # Leave headroom for the activations of the pipeline that is about to run
+        return free_bytes >= expected_bytes[1] * 1.25
+
+    def make_room(self, key):
+        """
+        Evicts parked pipelines holding VRAM before the pipeline for key is loaded
+
+        The size measured when key was last loaded must fit the budget and the free device
+        memory. A pipeline that was never loaded has no known size, so every parked pipeline
+        holding VRAM is evicted, like before the cache existed.
+        """
+        expected_bytes = self.loaded_bytes.get(key)
+        if torch.cuda.is_available():
+            for parked_key in list(self.entries.keys()):
+                if self.entries[parked_key]["vram_bytes"] == 0:
+                    continue
+                if expected_bytes is not None and self.fits(expected_bytes):
+                    break
+                self.evict(parked_key)
+        if expected_bytes is not None:
+            self.enforce_budget(extra_bytes=expected_bytes)
+
+    def evict(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            print(f">>>>Evicting {key.pipeline_class} ({key.inference_type}, {key.memory_mode}) from pipeline cache<<<<")
+            self.evictions += 1
+            release_pipeline(entry.pop("pipe"), self.component_registry)
+
+    def clear(self):
+        for key in list(self.entries.keys()):
+            self.evict(key)
+
+    def total_bytes(self):
+        ram_bytes = sum(entry["ram_bytes"] for entry in self.entries.values())
+        vram_bytes = sum(entry["vram_bytes"] for entry in self.entries.values())
+        return ram_bytes, vram_bytes
+
+    def over_budget(self, extra_bytes=(0, 0)):
+        if self.max_pipelines is not None and len(self.entries) > self.max_pipelines:
+            return True
+        ram_bytes, vram_bytes = self.total_bytes()
+        ram_bytes += extra_bytes[0]
+        vram_bytes += extra_bytes[1]
+        if self.ram_budget_bytes is not None and ram_bytes > self.ram_budget_bytes:
+            return True
+        if vram_bytes > self.get_vram_budget():
+            return True
+        return False
+
+    def enforce_budget(self, extra_bytes=(0, 0)):
+        """Evicts least recently used pipelines until the cache plus extra_bytes fits the budget"""
+        for key in list(self.entries.keys()):
+            if not self.over_budget(extra_bytes=extra_bytes):
+                break
+            self.evict(key)
+
+    def stats(self):
+        """
+        Reports cache effectiveness
+
+        Returns:
+            dict: hit/miss counters, resident bytes and mean load seconds per pipeline key
+        """
+        ram_bytes, vram_bytes = self.total_bytes()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+            "evictions": self.evictions,
+            "resident_pipelines": [key.pipeline_class for key in self.entries],
+            "resident_ram_bytes": ram_bytes,
+            "resident_vram_bytes": vram_bytes,
+            "load_seconds": {
+                f"{key.pipeline_class}:{key.inference_type}:{key.memory_mode}": sum(times) / len(times)
+                for key, times in self.load_times.items()
+            },
+        }
@@ -1,28 +1,139 @@
-import torch
-import gc
 import modules.util.appstate
+from modules.util.pipeline_cache import make_pipeline_key, measure_pipeline_bytes, release_pipeline
+from modules.util.job_scheduler import QueueFullError
+import modules.util.component_registry as component_registry
 from PIL import Image
 import json
 import piexif
 import piexif.helper
 from pathlib import Path
 
+def reset_pipeline_state():
+    modules.util.appstate.global_pipe = None
+    modules.util.appstate.global_memory_mode = None
+    modules.util.appstate.global_inference_type = None
+    modules.util.appstate.global_model_type = None
+    modules.util.appstate.global_quantization = None
+    modules.util.appstate.global_selected_gguf = None
+    modules.util.appstate.global_textencoder = None
+    modules.util.appstate.global_selected_lora = None
+
+def current_pipeline_key():
+    return make_pipeline_key(
+        type(modules.util.appstate.global_pipe).__name__,
+        inference_type=modules.util.appstate.global_inference_type,
+        memory_mode=modules.util.appstate.global_memory_mode,
+        quantization=modules.util.appstate.global_quantization,
+        gguf=modules.util.appstate.global_selected_gguf,
+        lora=modules.util.appstate.global_selected_lora,
+    )
+
 def clear_previous_model_memory():
     if modules.util.appstate.global_pipe is not None:
         print(">>>>clear_previous_model_memory: Removing model from memory<<<<")
-        if hasattr(modules.util.appstate.global_pipe, 'remove_all_hooks'):
-            modules.util.appstate.global_pipe.remove_all_hooks()
-        del modules.util.appstate.global_pipe
-        modules.util.appstate.global_pipe = None
-        modules.util.appstate.global_memory_mode = None
-        modules.util.appstate.global_inference_type = None
-        modules.util.appstate.global_model_type = None
-        modules.util.appstate.global_quantization = None
-        modules.util.appstate.global_selected_gguf = None
-        modules.util.appstate.global_textencoder = None
-        modules.util.appstate.global_selected_lora = None
-        gc.collect()
-        torch.cuda.empty_cache()
+        pipe = modules.util.appstate.global_pipe
+        reset_pipeline_state()
+        release_pipeline(pipe, modules.util.appstate.global_component_registry)
+
+def clear_all_model_memory():
+    """Frees the active pipeline and every pipeline kept warm in the residency cache"""
+    clear_previous_model_memory()
+    modules.util.appstate.global_pipeline_cache.clear()
+
+def park_current_pipeline():
+    """Moves the active pipeline into the residency cache instead of destroying it"""
+    if modules.util.appstate.global_pipe is not None:
+        key = current_pipeline_key()
+        print(f">>>>Parking {key.pipeline_class} pipe in pipeline cache<<<<")
+        pipe = modules.util.appstate.global_pipe
+        reset_pipeline_state()
+        modules.util.appstate.global_pipeline_cache.put(key, pipe)
+
+def acquire_pipeline(pipeline_class, inference_type=None, memory_mode=None, quantization=None, gguf=None, lora=None):
+    """
+    Returns an already loaded pipeline for the requested configuration
+
+    The active pipeline is reused when it matches, otherwise it is parked in the
+    residency cache and the requested one is restored from the cache if present.
+
+    Args:
+        pipeline_class (str): Class name of the pipeline, e.g. 'SanaPipeline'
+        inference_type, memory_mode, quantization, gguf, lora: The loading configuration
+
+    Returns:
+        The pipeline, or None when it has to be loaded (call register_loaded_pipeline afterwards)
+    """
+    cache = modules.util.appstate.global_pipeline_cache
+    key = make_pipeline_key(pipeline_class, inference_type, memory_mode, quantization, gguf, lora)
+    if modules.util.appstate.global_pipe is not None and current_pipeline_key() == key:
+        cache.record_hit()
+        return modules.util.appstate.global_pipe
+    park_current_pipeline()
+    pipe = cache.pop(key)
+    if pipe is None:
+        # The new pipeline is moved to the device while loading, before register_loaded_pipeline
+        cache.make_room(key)
+    if pipe is not None:
+        print(f">>>>Restoring {key.pipeline_class} pipe from pipeline cache<<<<")
+        modules.util.appstate.global_pipe = pipe
+        modules.util.appstate.global_inference_type = inference_type
+        modules.util.appstate.global_memory_mode = memory_mode
+        modules.util.appstate.global_quantization = quantization
+        modules.util.appstate.global_selected_gguf = gguf
+        modules.util.appstate.global_selected_lora = lora
+    return pipe
+
+def load_shared_components(pipeline_class, repo_id, component_names, torch_dtype, memory_mode, variant=None, quantization=None):
+    """
+    Loads text encoders or VAEs of a diffusers repository, reusing the instances already held by
+    another pipeline with the same memory mode. Pass the result to pipeline_class.from_pretrained.
+    Sequential CPU offload moves weights off the module itself, so it never shares.
+    """
+    if memory_mode == "Extremely Low VRAM":
+        return {}
+    return component_registry.load_shared_components(
+        modules.util.appstate.global_component_registry, pipeline_class, repo_id, component_names,
+        torch_dtype, memory_mode, variant=variant, quantization=quantization,
+    )
+
+def register_loaded_pipeline():
+    """Records the load time of the freshly loaded active pipeline and applies the cache budget"""
+    cache = modules.util.appstate.global_pipeline_cache
+    # Count shared components before the budget may evict another pipeline holding them
+    modules.util.appstate.global_component_registry.attach(modules.util.appstate.global_pipe)
+    cache.record_load(current_pipeline_key(), measure_pipeline_bytes(modules.util.appstate.global_pipe))
+    print(">>>>Pipeline cache:", cache.stats(), "<<<<")
+    print(">>>>Component registry:", modules.util.appstate.global_component_registry.stats(), "<<<<")
+    return modules.util.appstate.global_pipe
+
+def run_gpu_job(fn, *args, pipeline_key=None, priority=0, batch_key=None, batch_fn=None):
+    """
+    Runs an inference function on the GPU job worker and waits for its result
+
+    Args:
+        fn (callable): The inference function, called with *args on the worker thread
+        pipeline_key (PipelineKey): The pipeline fn loads, jobs for a loaded pipeline run first
+        priority (int): Jobs with a higher priority run first
+        batch_key, batch_fn: Queued jobs with an equal batch_key are merged into one
+            batch_fn call, see JobScheduler.submit
+
+    Returns:
+        The result of fn, or None if the queue is full or the job failed
+    """
+    scheduler = modules.util.appstate.global_job_scheduler
+    try:
+        future = scheduler.submit(fn, *args, pipeline_key=pipeline_key, priority=priority, batch_key=batch_key, batch_fn=batch_fn)
+    except QueueFullError as e:
+        print(f">>>>{str(e)}, can't continue<<<<")
+        return None
+    stats = scheduler.stats()
+    if stats["queue_depth"] > 1 or stats["running"] > 0:
+        print(f">>>>Job queued: {stats['queue_depth']} waiting, oldest for {stats['oldest_queued_seconds']:.1f}s<<<<")
+    try:
+        return future.result()
+    except Exception as e:
+        print(f"Error during inference: {str(e)}")
+        return None
 
 
 def save_metadata_to_file(file_path, metadata):
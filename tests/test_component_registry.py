@@ -0,0 +1,39 @@
+from types import SimpleNamespace
+import huggingface_hub
+import modules.util.component_registry as component_registry
+
+
+def make_siblings(text_encoder_sha256, transformer_sha256):
+    return [
+        SimpleNamespace(rfilename="model_index.json", lfs=None, blob_id="index"),
+        SimpleNamespace(rfilename="text_encoder/config.json", lfs=None, blob_id="config"),
+        SimpleNamespace(rfilename="text_encoder/model.bf16.safetensors", lfs={"sha256": text_encoder_sha256}, blob_id="pointer"),
+        SimpleNamespace(rfilename="transformer/model.bf16.safetensors", lfs={"sha256": transformer_sha256}, blob_id="pointer"),
+    ]
+
+
+class FakeHfApi:
+    repos = {
+        "org/sana-1k": make_siblings("gemma", "dit-1k"),
+        "org/sana-2k": make_siblings("gemma", "dit-2k"),
+        "org/lumina": make_siblings("other-gemma", "dit-lumina"),
+    }
+
+    def model_info(self, repo_id, files_metadata=False):
+        return SimpleNamespace(siblings=self.repos[repo_id])
+
+
+def test_same_component_files_resolve_to_one_source(monkeypatch):
+    monkeypatch.setattr(huggingface_hub, "HfApi", FakeHfApi)
+    monkeypatch.setattr(component_registry, "resolved_sources", {})
+    resolve = component_registry.resolve_component_source
+    assert resolve("org/sana-1k", "text_encoder", "bf16") == resolve("org/sana-2k", "text_encoder", "bf16")
+    assert resolve("org/sana-1k", "transformer", "bf16") != resolve("org/sana-2k", "transformer", "bf16")
+    assert resolve("org/sana-1k", "text_encoder", "bf16") != resolve("org/lumina", "text_encoder", "bf16")
+    assert resolve("org/sana-1k", "text_encoder", "bf16") != resolve("org/sana-1k", "text_encoder", None)
+
+
+def test_lookup_failure_falls_back_to_repository(monkeypatch):
+    monkeypatch.setattr(huggingface_hub, "HfApi", FakeHfApi)
+    monkeypatch.setattr(component_registry, "resolved_sources", {})
+    assert component_registry.resolve_component_source("org/missing", "text_encoder", "bf16") == "org/missing@bf16"
@@ -0,0 +1,39 @@
+import torch
+from diffsynth.vram_management import VRAMPlanner
+
+
+class ToyModel(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.shared = torch.nn.Linear(64, 64)
+        self.large = torch.nn.Linear(64, 128)
+        self.small = torch.nn.Linear(128, 8)
+        self.unused = torch.nn.Linear(8, 8)
+
+    def forward(self, x):
+        for _ in range(3):
+            x = self.shared(x)
+        return self.small(self.large(x))
+
+
+def test_plan_keeps_most_called_modules_under_budget():
+    model = ToyModel()
+    shared_bytes = (64 * 64 + 64) * 4
+    large_bytes = (64 * 128 + 128) * 4
+    small_bytes = (128 * 8 + 8) * 4
+    # Room for the shared and the small layer, not for the large one
+    planner = VRAMPlanner(budget_bytes=shared_bytes + small_bytes + 100, device="cpu")
+    planner.add_model("toy", model, {torch.nn.Linear: None}, forwards_per_step=2)
+    planner.profile("toy", lambda: model(torch.zeros((1, 64))))
+    plan = planner.plan()["models"]["toy"]
+    assert plan["resident_modules"] == ["shared", "small"]
+    assert plan["resident_bytes"] == shared_bytes + small_bytes
+    assert plan["transfer_bytes_per_step"] == large_bytes * 2
+
+
+def test_plan_without_profile_keeps_largest_modules():
+    model = ToyModel()
+    large_bytes = (64 * 128 + 128) * 4
+    planner = VRAMPlanner(budget_bytes=large_bytes, device="cpu")
+    planner.add_model("toy", model, {torch.nn.Linear: None})
+    assert planner.plan()["models"]["toy"]["resident_modules"] == ["large"]
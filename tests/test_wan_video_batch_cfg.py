@@ -0,0 +1,25 @@
+import torch
+from diffsynth.models.wan_video_dit import WanModel
+from diffsynth.pipelines.wan_video import WanVideoPipeline
+
+
+def test_batched_cfg_matches_separate_passes():
+    torch.manual_seed(0)
+    pipe = WanVideoPipeline(device="cpu", torch_dtype=torch.float32)
+    pipe.dit = WanModel(model_type="t2v", in_dim=16, dim=128, ffn_dim=256, num_heads=2, num_layers=2, text_dim=64, text_len=16)
+    latents = torch.randn((1, 16, 2, 4, 4))
+    timestep = torch.tensor([500.0])
+    # Prompts of different lengths, as the text encoder returns them
+    prompt_emb_posi = {"context": [torch.randn((5, 64))]}
+    prompt_emb_nega = {"context": [torch.randn((9, 64))]}
+    cfg_scale = 5.0
+    with torch.no_grad():
+        noise_pred_posi = pipe.dit(latents, timestep=timestep, seq_len=8, **prompt_emb_posi)
+        noise_pred_nega = pipe.dit(latents, timestep=timestep, seq_len=8, **prompt_emb_nega)
+        noise_pred = noise_pred_nega + cfg_scale * (noise_pred_posi - noise_pred_nega)
+
+        prompt_emb_cfg, image_emb_cfg = pipe.prepare_cfg_batch(prompt_emb_posi, prompt_emb_nega, {})
+        latents_cfg = torch.concat([latents, latents], dim=0)
+        batched_posi, batched_nega = pipe.dit(latents_cfg, timestep=timestep, seq_len=8, **prompt_emb_cfg, **image_emb_cfg).chunk(2, dim=0)
+        batched_noise_pred = batched_nega + cfg_scale * (batched_posi - batched_nega)
+    torch.testing.assert_close(batched_noise_pred, noise_pred, rtol=0, atol=1e-4)
@@ -0,0 +1,59 @@
+import pytest
+import torch
+from diffsynth.models.wan_video_dit import WanModel, rope_apply, rope_params, rope_precompute
+
+
+def make_freqs(d=16):
+    return torch.cat([
+        rope_params(1024, d - 4 * (d // 6)),
+        rope_params(1024, 2 * (d // 6)),
+        rope_params(1024, 2 * (d // 6))
+    ], dim=1)
+
+
+def rope_apply_loop(x, grid_sizes, freqs):
+    # The per-sample implementation rope_apply replaced
+    n, c = x.size(2), x.size(3) // 2
+    freqs = freqs.split([c - 2 * (c // 3), c // 3, c // 3], dim=1)
+    output = []
+    for i, (f, h, w) in enumerate(grid_sizes.tolist()):
+        seq_len = f * h * w
+        x_i = torch.view_as_complex(x[i, :seq_len].to(torch.float64).reshape(seq_len, n, -1, 2))
+        freqs_i = torch.cat([
+            freqs[0][:f].view(f, 1, 1, -1).expand(f, h, w, -1),
+            freqs[1][:h].view(1, h, 1, -1).expand(f, h, w, -1),
+            freqs[2][:w].view(1, 1, w, -1).expand(f, h, w, -1)
+        ], dim=-1).reshape(seq_len, 1, -1)
+        x_i = torch.view_as_real(x_i * freqs_i).flatten(2)
+        x_i = torch.cat([x_i, x[i, seq_len:]])
+        output.append(x_i)
+    return torch.stack(output).float()
+
+
+@pytest.mark.parametrize("grid_sizes, seq_len", [
+    ([[1, 4, 4]], 16),
+    ([[3, 4, 6], [3, 4, 6]], 72),
+    ([[2, 3, 5], [2, 3, 5]], 40),
+    ([[2, 4, 4], [1, 2, 3]], 32),
+])
+def test_rope_apply_matches_loop(grid_sizes, seq_len):
+    torch.manual_seed(0)
+    freqs = make_freqs()
+    grid_sizes = torch.tensor(grid_sizes, dtype=torch.long)
+    x = torch.randn((len(grid_sizes), seq_len, 2, 16))
+    grids = [rope_precompute(freqs, grid_size) for grid_size in grid_sizes.tolist()]
+    if all(grid_size == grid_sizes[0].tolist() for grid_size in grid_sizes.tolist()):
+        grids = grids[0]
+    torch.testing.assert_close(rope_apply(x, grid_sizes, grids), rope_apply_loop(x, grid_sizes, freqs), rtol=0, atol=1e-5)
+
+
+def test_rope_cache_is_bounded():
+    model = WanModel(model_type="t2v", in_dim=16, dim=32, ffn_dim=64, num_heads=2, num_layers=1, text_dim=16, text_len=8)
+    for f in range(1, 11):
+        grid_sizes = torch.tensor([[f, 2, 3]], dtype=torch.long)
+        grid = model.get_rope_freqs(grid_sizes, torch.device("cpu"))
+        torch.testing.assert_close(grid, rope_precompute(model.freqs, [f, 2, 3]))
+        assert len(model.rope_cache) <= 4
+    # A repeated size is served from the cache
+    grid_sizes = torch.tensor([[10, 2, 3], [10, 2, 3]], dtype=torch.long)
+    assert model.get_rope_freqs(grid_sizes, torch.device("cpu")) is model.rope_cache[(10, 2, 3, "cpu")]
@@ -0,0 +1,22 @@
+import torch
+from diffsynth.models.wan_video_dit import WanModel
+from diffsynth.pipelines.wan_video import WanVideoPipeline
+
+
+def make_tiny_dit():
+    torch.manual_seed(0)
+    return WanModel(model_type="t2v", in_dim=16, dim=128, ffn_dim=256, num_heads=2, num_layers=2, text_dim=64, text_len=16)
+
+
+def test_plan_leaves_dit_usable():
+    pipe = WanVideoPipeline(device="cpu", torch_dtype=torch.float32)
+    pipe.dit = make_tiny_dit()
+    plan = pipe.plan_vram_management(budget_bytes=256 * 1024)
+    assert len(plan["models"]["dit"]["resident_modules"]) > 0
+    assert pipe.dit.freqs.device.type == "cpu"
+    assert all(grid.device.type == "cpu" for grid in pipe.dit.rope_cache.values())
+    x = torch.randn((1, 16, 1, 4, 4))
+    context = torch.randn((1, 8, 64))
+    with torch.no_grad():
+        y = pipe.dit(x, timestep=torch.tensor([500.0]), context=context, seq_len=4)
+    assert y.shape == x.shape and torch.isfinite(y).all()